@@ -1,18 +1,31 @@
 """
 Model layer: business logic for file uploads.
-- Streams content to storage (R2 or local)
-- Builds chunk index (every K lines) as compact binary
+- Streams content into a staging file in storage and moves it into place (local or S3)
+- Builds chunk index (every K lines) as compact binary, a dense per-line index, or an adaptive
+  index (checkpoints every K lines or N bytes, whichever comes first)
+- Optionally stores the content as gzip frames, one per index chunk
+- Deduplicates identical content by hash: files share one reference-counted object and index
+- Builds the longest-lines sidecar (top N lines by length) in the same pass
+- Optionally writes a per-line length column and its summary stats in the same pass
+- Publishes indexed uploads (also used by multipart uploads, see multipart_model.py)
 - Persists file metadata into SQLite
 """
 import logging
-import tempfile
+import sqlite3
+import time
+import uuid
 from datetime import datetime
 from werkzeug.datastructures import FileStorage
 import os
+from contextlib import nullcontext
+from typing import Callable, Optional, Tuple
 
 from api.utils.storage import Storage
-from api.utils.indexing import build_chunk_index
-from api.utils.db import get_conn, init_db
+from api.utils.indexing import COMPRESSIONS, INDEX_MODES, IndexMeta, build_chunk_index
+from api.utils.db import get_conn, init_db, bump_corpus_version
+from api.utils.file_cache import file_rows
+from api.utils.line_catalog import catalog
+from api.utils.metrics import INGEST_BYTES, INGEST_LINES, INGEST_SECONDS
 from config import settings
 
 logger = logging.getLogger(__name__)
@@ -21,62 +34,324 @@ logger = logging.getLogger(__name__)
 init_db()
 
 
-def handle_upload(file_storage: FileStorage, filename: str) -> dict:
-    logger.info(f"Starting upload process for file: {filename}")
-    # 1) Stream to temp file while computing index
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp_path = tmp.name
+def resolve_index_mode(index_mode: Optional[str]) -> str:
+    """Returns the upload's index mode (the configured default if not given). Raises ValueError if unknown."""
+    index_mode = index_mode or settings.INDEX_MODE
+    if index_mode not in INDEX_MODES:
+        raise ValueError(f"Unsupported index mode '{index_mode}'. Expected one of: {', '.join(INDEX_MODES)}.")
+    return index_mode
+
+
+def resolve_compression(compression: Optional[str], index_mode: str) -> str:
+    """
+    Returns the upload's storage compression (the configured default if not given).
+    Raises ValueError if unknown, or if combined with another index mode than chunk.
+    """
+    compression = compression or settings.COMPRESSION
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unsupported compression '{compression}'. Expected one of: {', '.join(COMPRESSIONS)}.")
+    if compression != "none" and index_mode != "chunk":
+        raise ValueError("Compressed storage requires the chunk index mode.")
+    return compression
+
+
+def handle_upload(file_storage: FileStorage, filename: str, index_mode: Optional[str] = None,
+                  compression: Optional[str] = None) -> dict:
+    index_mode = resolve_index_mode(index_mode)
+    compression = resolve_compression(compression, index_mode)
+    logger.info(f"Starting upload process for file: {filename} (index mode: {index_mode}, compression: {compression})")
+    storage = Storage.from_env()
+    # Stream into a staging file inside the storage root while computing the index,
+    # so persisting it is a rename rather than a second copy.
+    staged_path = storage.new_staging_file()
+    return ingest(storage, filename, index_mode, staged_path, infile=file_storage.stream, compression=compression)
+
+
+def ingest(storage: Storage, filename: str, index_mode: str, staged_path: str, infile=None,
+           progress: Optional[Callable[[int, int], None]] = None, compression: str = "none") -> dict:
+    """
+    Indexes an upload and publishes it: moves the staged object into place, stores its index and
+    longest-lines sidecar, and upserts its metadata. With `infile`, its bytes are streamed into
+    `staged_path` while indexing; without, `staged_path` already holds the spooled upload and is
+    only read (and, if compressed, written to a new staging file). The staging files are gone
+    afterwards, whether or not it succeeded.
+    """
+    # A dense index has an entry for every line, which the chunk arithmetic sees as K=1.
+    lines_per_chunk = 1 if index_mode == "dense" else settings.INDEX_LINES_PER_CHUNK
+    dense_path = storage.new_staging_file(suffix=".idx") if index_mode == "dense" else None
+    # A spooled upload is indexed in place, unless it has to be rewritten in compressed frames.
+    out_path = storage.new_staging_file() if infile is None and compression != "none" else staged_path
+    lengths_path = storage.new_staging_file(suffix=".len") if settings.LINE_STATS else None
     try:
-        meta = build_chunk_index(
-            infile=file_storage.stream,
-            outfile_path=tmp_path,
-            lines_per_chunk=settings.INDEX_LINES_PER_CHUNK,
-        )
-        size_bytes = meta.size_bytes
-        num_lines = meta.num_lines
-        offsets = meta.offsets  # list[int], offset for lines 0, K, 2K, ...
+        # 1) Build the index, streaming the upload into the staging file if needed
+        with (open(staged_path, "rb") if infile is None else nullcontext(infile)) as src, \
+                INGEST_SECONDS.time((index_mode,)):
+            meta = build_chunk_index(
+                infile=src,
+                outfile_path=None if infile is None and out_path == staged_path else out_path,
+                lines_per_chunk=lines_per_chunk,
+                longest_top_n=settings.LONGEST_LINES_TOP_N,
+                read_bytes=settings.INDEX_READ_BYTES,
+                dense_index_path=dense_path,
+                progress=progress,
+                compression=compression,
+                compression_level=settings.COMPRESSION_LEVEL,
+                hash_content=settings.DEDUP,
+                lengths_path=lengths_path,
+                chunk_bytes=settings.INDEX_CHUNK_BYTES if index_mode == "adaptive" else None,
+            )
+        INGEST_BYTES.inc(meta.size_bytes)
+        INGEST_LINES.inc(meta.num_lines)
+        return publish(storage, filename, index_mode, lines_per_chunk, meta, out_path, dense_path, compression,
+                       lengths_path)
+    finally:
+        for path in (staged_path, out_path, dense_path, lengths_path):
+            if not path:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
 
-        # 2) Persist to storage backend
-        logger.info(f"Persisting '{filename}' to storage.")
-        storage = Storage.from_env()
-        object_key = filename
-        idx_key = f"indexes/{filename}.idx"
 
-        storage.upload_file(local_path=tmp_path, object_key=object_key)
-        storage.put_index(offsets=offsets, object_key=idx_key)
+def _object_key(filename: str) -> str:
+    """
+    Storage key for a new object of `filename`: the name plus a random suffix. Objects are written
+    before their metadata is committed, so no other upload (of this name or another) can be
+    writing to or reading from that key.
+    """
+    return f"{filename}.{uuid.uuid4().hex[:16]}"
 
-        logger.info(f"Upserting metadata for '{filename}' into database.")
-        # 3) Upsert metadata in SQLite
-        with get_conn() as conn:
+
+def _stats_keys(object_key: str) -> Tuple[str, str]:
+    """Keys of an object's line-length column and stats sidecar."""
+    return f"indexes/{object_key}.len", f"indexes/{object_key}.stats"
+
+
+def _put_line_stats(storage: Storage, object_key: str, lengths_path: str, stats: dict) -> Tuple[str, str]:
+    lengths_key, stats_key = _stats_keys(object_key)
+    storage.commit_staged(lengths_path, object_key=lengths_key)
+    storage.put_stats(stats, object_key=stats_key)
+    return lengths_key, stats_key
+
+
+def _release_object(conn, object_key: str) -> Optional[sqlite3.Row]:
+    """Drops one reference to an object; returns its row if that was the last one (so it can be deleted)."""
+    conn.execute("UPDATE objects SET refcount = refcount - 1 WHERE object_key = ?", (object_key,))
+    row = conn.execute("SELECT * FROM objects WHERE object_key = ? AND refcount <= 0", (object_key,)).fetchone()
+    if row is not None:
+        conn.execute("DELETE FROM objects WHERE object_key = ?", (object_key,))
+    return row
+
+
+def _find_duplicate(conn, meta: IndexMeta, index_mode: str, lines_per_chunk: int,
+                    compression: str) -> Optional[sqlite3.Row]:
+    """The stored object with the same content hash and index layout, if any."""
+    if not meta.content_hash:
+        return None
+    return conn.execute(
+        """
+        SELECT * FROM objects
+        WHERE content_hash = ? AND index_mode = ? AND lines_per_chunk = ? AND compression = ?
+        LIMIT 1
+        """,
+        (meta.content_hash, index_mode, lines_per_chunk, compression),
+    ).fetchone()
+
+
+# Columns of `objects` (and `files`) naming stored keys.
+_KEY_COLUMNS = ("object_key", "idx_key", "longest_key", "lengths_key", "stats_key")
+
+
+def _put_object(storage: Storage, filename: str, meta: IndexMeta, offsets: list, staged_path: str,
+                dense_path: Optional[str], lengths_path: Optional[str]) -> dict:
+    """Stores a new object and its sidecars under fresh keys; returns the keys by `objects` column."""
+    object_key = _object_key(filename)
+    logger.info(f"Persisting '{filename}' to storage as '{object_key}'.")
+    keys = {
+        "object_key": object_key,
+        "idx_key": f"indexes/{object_key}.idx",
+        "longest_key": f"indexes/{object_key}.longest",
+        "lengths_key": None,
+        "stats_key": None,
+    }
+    storage.commit_staged(staged_path, object_key=object_key)
+    if dense_path:
+        storage.commit_staged(dense_path, object_key=keys["idx_key"])
+    else:
+        storage.put_index(offsets=offsets, object_key=keys["idx_key"])
+    storage.put_longest(entries=meta.longest, object_key=keys["longest_key"])
+    if lengths_path and meta.stats is not None:
+        keys["lengths_key"], keys["stats_key"] = _put_line_stats(storage, object_key, lengths_path, meta.stats)
+    return keys
+
+
+def _delete_objects(storage: Storage, keys):
+    for key in keys:
+        if key:
+            storage.delete_object(key)
+
+
+def _sweep_deletions(storage: Storage):
+    """Deletes the objects whose grace period (`[storage] orphan_grace_s`) has passed."""
+    with get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        due = [r["key"] for r in conn.execute("SELECT key FROM object_deletions WHERE delete_after <= ?", (time.time(),))]
+        conn.executemany("DELETE FROM object_deletions WHERE key = ?", [(key,) for key in due])
+    if due:
+        logger.info(f"Deleting {len(due)} key(s) of unreferenced objects.")
+        _delete_objects(storage, due)
+
+
+def _record(filename: str, meta: IndexMeta, index_mode: str, lines_per_chunk: int, compression: str,
+            written: Optional[dict], stats_written: Optional[Tuple[str, str]]):
+    """
+    The short write transaction of `publish`: points `filename` at a stored duplicate (one more
+    reference) or at the `written` object, releases the file's previous object (queueing its keys
+    for deletion if that was its last reference) and bumps the corpus version. Returns (keys of the referenced object, orphaned object row or None, corpus
+    version), or None without changing anything if there is no duplicate and nothing was written.
+    """
+    with get_conn() as conn:
+        # Hold the write lock from the duplicate check until the references are updated.
+        conn.execute("BEGIN IMMEDIATE")
+        existing = _find_duplicate(conn, meta, index_mode, lines_per_chunk, compression)
+        if existing is None and written is None:
+            conn.rollback()
+            return None
+        previous = conn.execute("SELECT object_key FROM files WHERE filename = ?", (filename,)).fetchone()
+
+        if existing is not None:
+            logger.info(f"'{filename}' has the same content as '{existing['object_key']}', reusing it.")
+            keys = {column: existing[column] for column in _KEY_COLUMNS}
+            if previous is None or previous["object_key"] != keys["object_key"]:
+                conn.execute("UPDATE objects SET refcount = refcount + 1 WHERE object_key = ?", (keys["object_key"],))
+            if written is not None and written["stats_key"] is not None:
+                stats_written = written["lengths_key"], written["stats_key"]
+            if keys["stats_key"] is None and stats_written is not None:
+                # The stored object predates line stats; keep the ones just computed.
+                keys["lengths_key"], keys["stats_key"] = stats_written
+                conn.execute(
+                    "UPDATE objects SET lengths_key = ?, stats_key = ? WHERE object_key = ?",
+                    (keys["lengths_key"], keys["stats_key"], keys["object_key"]),
+                )
+        else:
+            keys = written
             conn.execute(
                 """
-                INSERT OR REPLACE INTO files(
-                    filename, object_key, idx_key, size_bytes, uploaded_at, num_lines, lines_per_chunk
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO objects(
+                    object_key, idx_key, longest_key, content_hash, index_mode, lines_per_chunk, compression,
+                    lengths_key, stats_key, refcount
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
                 """,
-                (
-                    filename,
-                    object_key,
-                    idx_key,
-                    size_bytes,
-                    datetime.utcnow().isoformat(),
-                    num_lines,
-                    settings.INDEX_LINES_PER_CHUNK,
-                ),
+                (keys["object_key"], keys["idx_key"], keys["longest_key"], meta.content_hash, index_mode,
+                 lines_per_chunk, compression, keys["lengths_key"], keys["stats_key"]),
             )
 
-        logger.info(f"Successfully processed and stored '{filename}'.")
-        return {
-            "filename": filename,
-            "size_bytes": size_bytes,
-            "num_lines": num_lines,
-            "lines_per_chunk": settings.INDEX_LINES_PER_CHUNK,
-            "object_key": object_key,
-            "idx_key": idx_key,
-            "storage": storage.kind,
-        }
-    finally:
-        try:
-            os.unlink(tmp_path)
-        except FileNotFoundError:
-            pass
+        logger.info(f"Upserting metadata for '{filename}' into database.")
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO files(
+                filename, object_key, idx_key, size_bytes, uploaded_at, num_lines, lines_per_chunk,
+                longest_key, index_mode, compression, content_hash, lengths_key, stats_key
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                filename,
+                keys["object_key"],
+                keys["idx_key"],
+                meta.size_bytes,
+                datetime.utcnow().isoformat(),
+                meta.num_lines,
+                lines_per_chunk,
+                keys["longest_key"],
+                index_mode,
+                compression,
+                meta.content_hash,
+                keys["lengths_key"],
+                keys["stats_key"],
+            ),
+        )
+        # A re-upload under the same name stops referencing the file's previous object.
+        orphan = None
+        if previous is not None and previous["object_key"] != keys["object_key"]:
+            orphan = _release_object(conn, previous["object_key"])
+        if orphan is not None:
+            delete_after = time.time() + settings.ORPHAN_GRACE_S
+            conn.executemany(
+                "INSERT OR REPLACE INTO object_deletions(key, delete_after) VALUES (?, ?)",
+                [(orphan[column], delete_after) for column in _KEY_COLUMNS if orphan[column]],
+            )
+        return keys, orphan, bump_corpus_version(conn)
+
+
+def publish(storage: Storage, filename: str, index_mode: str, lines_per_chunk: int, meta: IndexMeta,
+            staged_path: str, dense_path: Optional[str] = None, compression: str = "none",
+            lengths_path: Optional[str] = None) -> dict:
+    """
+    Moves a fully indexed, staged upload into place as `filename`, stores its index (a staged
+    dense index, or `meta.offsets`) and longest-lines sidecar, and upserts its metadata.
+    With `lengths_path` (a staged line-length column) and `meta.stats`, both are stored as well.
+
+    If an object with the same content hash and index layout is already stored, the new row
+    points at it (one more reference) and nothing is written; the staged files are left for the
+    caller to discard. An object whose last reference goes away is deleted after
+    `[storage] orphan_grace_s`, by a later upload, so readers of the old row can finish.
+
+    Everything is written to storage (on S3: uploaded) before the SQLite write lock is taken, under
+    fresh keys, so other writers only wait for the metadata update. If an identical object was
+    committed in the meantime, that one is used and the keys just written are deleted.
+    """
+    offsets = meta.offsets  # list[int], offset for lines 0, K, 2K, ...
+    if meta.checkpoint_lines is not None:
+        # Adaptive index: all checkpoint line numbers, then all their offsets.
+        offsets = meta.checkpoint_lines + offsets
+
+    with get_conn() as conn:
+        existing = _find_duplicate(conn, meta, index_mode, lines_per_chunk, compression)
+    written = None  # keys of the object stored by this call
+    stats_written = None  # (lengths_key, stats_key) stored for a duplicate without line stats
+    fresh = set()  # every key stored by this call; the ones left unreferenced are deleted
+    try:
+        # 1) Persist to storage backend, unless the content is already stored
+        if existing is None:
+            written = _put_object(storage, filename, meta, offsets, staged_path, dense_path, lengths_path)
+            fresh.update(written.values())
+        elif existing["stats_key"] is None and lengths_path and meta.stats is not None:
+            stats_written = _put_line_stats(storage, _object_key(filename), lengths_path, meta.stats)
+            fresh.update(stats_written)
+
+        # 2) Update references and metadata in SQLite
+        recorded = _record(filename, meta, index_mode, lines_per_chunk, compression, written, stats_written)
+        if recorded is None:
+            # The duplicate found above lost its last reference meanwhile: store our own copy.
+            written = _put_object(storage, filename, meta, offsets, staged_path, dense_path, lengths_path)
+            fresh.update(written.values())
+            recorded = _record(filename, meta, index_mode, lines_per_chunk, compression, written, stats_written)
+    except BaseException:
+        _delete_objects(storage, fresh)
+        raise
+    keys, orphan, corpus_version = recorded
+    file_rows.invalidate()
+    catalog.apply_upload(filename, meta.num_lines, corpus_version)
+
+    unused = fresh - set(keys.values())
+    if unused:
+        logger.info(f"An identical object was stored concurrently; deleting {len(unused)} unused key(s).")
+        _delete_objects(storage, unused)
+    if orphan is not None:
+        logger.info(f"Object '{orphan['object_key']}' is unreferenced, deleting it in {settings.ORPHAN_GRACE_S}s.")
+    _sweep_deletions(storage)
+
+    logger.info(f"Successfully processed and stored '{filename}'.")
+    return {
+        "filename": filename,
+        "size_bytes": meta.size_bytes,
+        "num_lines": meta.num_lines,
+        "lines_per_chunk": lines_per_chunk,
+        "index_mode": index_mode,
+        "compression": compression,
+        "object_key": keys["object_key"],
+        "idx_key": keys["idx_key"],
+        "deduplicated": keys["object_key"] != (written or {}).get("object_key"),
+        "storage": storage.kind,
+    }
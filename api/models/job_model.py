@@ -0,0 +1,226 @@
+"""
+Model layer: background ingest jobs.
+- Spools an upload into the storage root and records a `jobs` row, so the request returns at once
+- Runs the index-and-publish pass (`file_model.ingest`) on a local thread pool
+- Records progress (bytes and lines indexed) and the outcome in SQLite
+- On startup, resumes unfinished jobs whose owning process is gone
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+from werkzeug.datastructures import FileStorage
+
+from api.models.file_model import ingest, resolve_compression, resolve_index_mode
+from api.utils.db import get_conn, init_db
+from api.utils.storage import Storage
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+init_db()
+
+# Minimum number of seconds between two progress writes for the same job.
+PROGRESS_INTERVAL = 0.5
+
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+# Identifies this process (not just its pid) as the owner of the jobs it runs.
+_owner_token = uuid.uuid4().hex
+
+
+def _new_owner_token():
+    global _owner_token
+    _owner_token = uuid.uuid4().hex
+
+
+os.register_at_fork(after_in_child=_new_owner_token)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.INGEST_WORKERS, thread_name_prefix="ingest")
+        return _executor
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def _update(job_id: str, **fields):
+    fields["updated_at"] = _now()
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with get_conn() as conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+def submit_upload(file_storage: FileStorage, filename: str, index_mode: Optional[str] = None,
+                  compression: Optional[str] = None) -> dict:
+    """
+    Spools the upload into a staging file and queues it for indexing. Returns the new job.
+    Raises ValueError for an unknown index mode or compression.
+    """
+    index_mode = resolve_index_mode(index_mode)
+    compression = resolve_compression(compression, index_mode)
+    storage = Storage.from_env()
+    spool_path = storage.new_staging_file(suffix=".spool")
+    try:
+        with open(spool_path, "wb") as out:
+            shutil.copyfileobj(file_storage.stream, out, settings.INDEX_READ_BYTES)
+            bytes_total = out.tell()
+    except BaseException:
+        os.unlink(spool_path)
+        raise
+
+    job_id = uuid.uuid4().hex
+    now = _now()
+    with get_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO jobs(
+                id, filename, index_mode, compression, spool_path, status, bytes_total, owner_pid,
+                owner_token, created_at, updated_at
+            ) VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?)
+            """,
+            (job_id, filename, index_mode, compression, spool_path, bytes_total, os.getpid(), _owner_token,
+             now, now),
+        )
+    logger.info(f"Queued ingest job {job_id} for '{filename}' ({bytes_total} bytes).")
+    _get_executor().submit(_run_job, job_id)
+    return get_job(job_id)
+
+
+def _run_job(job_id: str):
+    with get_conn() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return
+    _update(job_id, status="running")
+    last_write = 0.0
+
+    def progress(bytes_indexed: int, lines_indexed: int):
+        # Best effort: a busy database only delays the next progress report, never the ingest.
+        nonlocal last_write
+        now = time.monotonic()
+        if now - last_write >= PROGRESS_INTERVAL:
+            last_write = now
+            try:
+                _update(job_id, bytes_indexed=bytes_indexed, lines_indexed=lines_indexed)
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Could not record progress of ingest job {job_id}: {e}")
+
+    try:
+        result = ingest(
+            Storage.from_env(),
+            row["filename"],
+            row["index_mode"],
+            row["spool_path"],
+            progress=progress,
+            compression=row["compression"],
+        )
+    except ValueError as ve:
+        logger.warning(f"Ingest job {job_id} failed: {ve}")
+        _update(job_id, status="failed", error=str(ve))
+        return
+    except Exception:
+        logger.exception(f"An unhandled error occurred in ingest job {job_id}.")
+        _update(job_id, status="failed", error="Internal server error")
+        return
+    _update(
+        job_id,
+        status="done",
+        bytes_indexed=result["size_bytes"],
+        lines_indexed=result["num_lines"],
+        result=json.dumps(result),
+    )
+    logger.info(f"Ingest job {job_id} for '{row['filename']}' is done.")
+
+
+def get_job(job_id: str) -> dict:
+    """Returns the job's status and progress. Raises ValueError if there is no such job."""
+    with get_conn() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        raise ValueError("Job not found")
+    return {
+        "job_id": row["id"],
+        "filename": row["filename"],
+        "index_mode": row["index_mode"],
+        "compression": row["compression"],
+        "status": row["status"],
+        "bytes_total": row["bytes_total"],
+        "bytes_indexed": row["bytes_indexed"],
+        "lines_indexed": row["lines_indexed"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+    }
+
+
+def _owner_alive(pid: Optional[int], token: Optional[str]) -> bool:
+    """Whether the process that owns a job still runs. Our own pid only counts with our token."""
+    if pid is None:
+        return False
+    if pid == os.getpid():
+        return token == _owner_token
+    return _pid_alive(pid)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def resume_jobs() -> int:
+    """
+    Requeues queued or running jobs whose owner process has exited (e.g. a restarted worker)
+    and returns how many were resumed. Claiming a job swaps its `owner_pid` and `owner_token`, so
+    when several workers start together each orphaned job is resumed by exactly one of them.
+    A job recorded under this process's pid but another token was left by an earlier process
+    that had the same pid, and is resumed as well.
+    """
+    pid = os.getpid()
+    claimed = []
+    with get_conn() as conn:
+        rows = conn.execute(
+            "SELECT id, owner_pid, owner_token, spool_path FROM jobs WHERE status IN ('queued', 'running')"
+        ).fetchall()
+        for row in rows:
+            owner, token = row["owner_pid"], row["owner_token"]
+            if _owner_alive(owner, token):
+                continue
+            cur = conn.execute(
+                """
+                UPDATE jobs SET owner_pid = ?, owner_token = ?, status = 'queued', bytes_indexed = 0,
+                    lines_indexed = 0, updated_at = ?
+                WHERE id = ? AND owner_pid IS ? AND owner_token IS ?
+                """,
+                (pid, _owner_token, _now(), row["id"], owner, token),
+            )
+            if cur.rowcount:
+                claimed.append(row)
+
+    for row in claimed:
+        if not os.path.exists(row["spool_path"]):
+            _update(row["id"], status="failed", error="Spooled upload is missing")
+            continue
+        logger.info(f"Resuming ingest job {row['id']}.")
+        _get_executor().submit(_run_job, row["id"])
+    return len(claimed)
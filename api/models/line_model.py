@@ -1,15 +1,28 @@
 import logging
 import random
-from typing import Optional, Dict
+import sqlite3
+from array import array
+from bisect import bisect_right
+from itertools import groupby
+from typing import Optional, Dict, List, Sequence, Tuple
 
 from api.utils.db import get_conn
+from api.utils.file_cache import file_rows
+from api.utils.line_catalog import catalog
 from api.utils.storage import Storage
-from api.utils.reader import load_index, extract_line_from_offset
+from api.utils.reader import (
+    load_index,
+    extract_line_from_frame,
+    extract_line_from_offset,
+    extract_lines_from_frame,
+    extract_lines_from_offset,
+    read_dense_line,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def fetch_line(file_name: Optional[str] = None) -> Dict:
+def fetch_line(file_name: Optional[str] = None, scope: str = "latest") -> Dict:
     """
     Retrieves a random line from a specified file, or from the last uploaded
     file if no file name is provided.
@@ -17,6 +30,8 @@ def fetch_line(file_name: Optional[str] = None) -> Dict:
     Args:
         file_name: The name of the file to retrieve a line from. If None,
                    the most recently uploaded file is used.
+        scope: With no file_name, "latest" samples the most recently uploaded
+               file and "all" samples uniformly over every line of every file.
 
     Returns:
         A dictionary containing the file name, line number, and line content.
@@ -25,17 +40,22 @@ def fetch_line(file_name: Optional[str] = None) -> Dict:
         ValueError: If the specified file is not found, or if no files have
                     been uploaded when no file_name is provided.
     """
-    conn = get_conn()
-
+    line_num = None
+    picked = catalog.pick(get_conn()) if not file_name and scope == "all" else None
     if file_name:
         logger.info(f"Fetching random line from specified file: {file_name}")
-        file_meta = conn.execute("SELECT * FROM files WHERE filename = ?", (file_name,)).fetchone()
+        file_meta = file_rows.get(file_name)
         if not file_meta:
             raise ValueError(f"File not found: {file_name}")
+    elif picked:
+        # Uniform over all lines: the catalog maps a global line number to (file, local line).
+        logger.info("Fetching random line across all uploaded files.")
+        picked_name, line_num = picked
+        file_meta = file_rows.get(picked_name)
     else:
         # Fetch the most recently uploaded file.
         logger.info("Fetching random line from last uploaded file.")
-        file_meta = conn.execute("SELECT * FROM files ORDER BY id DESC LIMIT 1").fetchone()
+        file_meta = file_rows.get()
         if not file_meta:
             raise ValueError("No files have been uploaded yet.")
 
@@ -43,21 +63,154 @@ def fetch_line(file_name: Optional[str] = None) -> Dict:
     if num_lines == 0:
         return {"file_name": file_meta["filename"], "line_number": 0, "line": ""}
 
-    # Pick a random line number (0-indexed).
-    line_num = random.randint(0, num_lines - 1)
-
-    # Use the index to find the correct chunk and offset.
-    lines_per_chunk = file_meta["lines_per_chunk"]
-    chunk_idx = line_num // lines_per_chunk
-    line_in_chunk = line_num % lines_per_chunk
+    if line_num is None:
+        # Pick a random line number (0-indexed).
+        line_num = random.randint(0, num_lines - 1)
+    else:
+        line_num = _within(file_meta, line_num)
 
     storage = Storage.from_env()
-    offsets = load_index(storage, file_meta["idx_key"])
-    start_offset = offsets[chunk_idx]
+    # The row id and upload time identify this upload, so a re-upload never hits a stale index or block.
+    version = (file_meta["id"], file_meta["uploaded_at"])
+
+    if file_meta["index_mode"] == "dense":
+        # Dense index: the line's own start/end offsets are stored, no skipping needed.
+        line_content = read_dense_line(storage, file_meta["idx_key"], file_meta["object_key"], line_num, version)
+    else:
+        # Use the index to find the correct chunk and offset.
+        index = load_index(storage, file_meta["idx_key"], version=version)
+        offsets = _chunk_starts(index, file_meta)
+        chunk_idx, line_in_chunk = _chunk_of(index, file_meta, line_num)
+        start_offset = offsets[chunk_idx]
 
-    line_content = extract_line_from_offset(
-        storage=storage, object_key=file_meta["object_key"], start_offset=start_offset, advance_newlines=line_in_chunk
-    )
+        if file_meta["compression"] != "none":
+            # Compressed: the index holds frame offsets, decompress just this chunk's frame.
+            line_content = extract_line_from_frame(
+                storage, file_meta["object_key"], start_offset, offsets[chunk_idx + 1], line_in_chunk, version
+            )
+        else:
+            line_content = extract_line_from_offset(
+                storage=storage, object_key=file_meta["object_key"], start_offset=start_offset, advance_newlines=line_in_chunk,
+                end=_chunk_end(offsets, chunk_idx, file_meta), version=version,
+            )
 
     logger.info(f"Selected line {line_num + 1} from '{file_meta['filename']}'.")
-    return {"file_name": file_meta["filename"], "line_number": line_num + 1, "line": line_content}
\ No newline at end of file
+    return {"file_name": file_meta["filename"], "line_number": line_num + 1, "line": line_content}
+
+
+def _within(file_meta: sqlite3.Row, line_num: int) -> int:
+    """
+    A catalog pick checked against the file's row: `line_num`, or a random line of the file (-1 if
+    it is empty) if the file was re-uploaded shorter between the pick and reading its row.
+    """
+    num_lines = file_meta["num_lines"]
+    if line_num < num_lines:
+        return line_num
+    return random.randint(0, num_lines - 1) if num_lines else -1
+
+
+def _chunk_starts(index: array, file_meta: sqlite3.Row) -> Sequence[int]:
+    """Start offsets of the chunks of a chunk index, or of the checkpoints of an adaptive one."""
+    if file_meta["index_mode"] == "adaptive":
+        # Stored as all checkpoint line numbers, then all offsets.
+        return memoryview(index)[len(index) // 2:]
+    return index
+
+
+def _chunk_of(index: array, file_meta: sqlite3.Row, line_num: int) -> Tuple[int, int]:
+    """(chunk, lines to skip from its start) for a line: by arithmetic for a chunk index, by
+    binary search over the checkpoint line numbers for an adaptive one."""
+    if file_meta["index_mode"] == "adaptive":
+        chunk_idx = bisect_right(index, line_num, 0, len(index) // 2) - 1
+        return chunk_idx, line_num - index[chunk_idx]
+    return divmod(line_num, file_meta["lines_per_chunk"])
+
+
+def _chunk_end(offsets: Sequence[int], chunk_idx: int, file_meta: sqlite3.Row) -> int:
+    """End offset of an uncompressed index chunk: the next chunk's start, or the file size for the last one."""
+    return offsets[chunk_idx + 1] if chunk_idx + 1 < len(offsets) else file_meta["size_bytes"]
+
+
+def read_lines(storage: Storage, file_meta: sqlite3.Row, line_nums: List[int]) -> Dict[int, str]:
+    """
+    Reads the given ascending, unique 0-based lines of one file. Lines sharing an index chunk are
+    extracted together, and chunks are visited in byte-offset order, so the file is read forward once.
+    """
+    version = (file_meta["id"], file_meta["uploaded_at"])
+    if file_meta["index_mode"] == "dense":
+        return {
+            ln: read_dense_line(storage, file_meta["idx_key"], file_meta["object_key"], ln, version) for ln in line_nums
+        }
+
+    index = load_index(storage, file_meta["idx_key"], version=version)
+    offsets = _chunk_starts(index, file_meta)
+    out: Dict[int, str] = {}
+    for chunk_idx, group in groupby(line_nums, key=lambda ln: _chunk_of(index, file_meta, ln)[0]):
+        group = list(group)
+        base = group[0] - _chunk_of(index, file_meta, group[0])[1]
+        advances = [ln - base for ln in group]
+        if file_meta["compression"] != "none":
+            texts = extract_lines_from_frame(
+                storage, file_meta["object_key"], offsets[chunk_idx], offsets[chunk_idx + 1], advances, version
+            )
+        else:
+            texts = extract_lines_from_offset(
+                storage, file_meta["object_key"], offsets[chunk_idx], advances,
+                end=_chunk_end(offsets, chunk_idx, file_meta), version=version,
+            )
+        out.update(zip(group, texts))
+    return out
+
+
+def fetch_lines(count: int, file_name: Optional[str] = None, scope: str = "latest") -> List[Dict]:
+    """
+    Batch form of `fetch_line`: samples `count` random lines (with replacement) with the same
+    file selection rules, then reads them grouped by file and chunk in byte-offset order.
+
+    Returns:
+        A list of dictionaries like `fetch_line`'s, in sampling order.
+
+    Raises:
+        ValueError: Same conditions as `fetch_line`.
+    """
+    # (filename, 0-based line), or line -1 for an empty file
+    samples: List[Tuple[str, int]] = []
+    metas: Dict[str, sqlite3.Row] = {}
+    picked = catalog.pick_many(get_conn(), count) if not file_name and scope == "all" else []
+    if file_name:
+        logger.info(f"Fetching {count} random lines from specified file: {file_name}")
+        file_meta = file_rows.get(file_name)
+        if not file_meta:
+            raise ValueError(f"File not found: {file_name}")
+    elif picked:
+        logger.info(f"Fetching {count} random lines across all uploaded files.")
+        metas = {name: file_rows.get(name) for name in {name for name, _ in picked}}
+        samples = [(name, _within(metas[name], ln)) for name, ln in picked]
+    else:
+        logger.info(f"Fetching {count} random lines from last uploaded file.")
+        file_meta = file_rows.get()
+        if not file_meta:
+            raise ValueError("No files have been uploaded yet.")
+
+    if not samples:
+        metas = {file_meta["filename"]: file_meta}
+        num_lines = file_meta["num_lines"]
+        samples = [
+            (file_meta["filename"], random.randint(0, num_lines - 1) if num_lines else -1) for _ in range(count)
+        ]
+
+    storage = Storage.from_env()
+    wanted: Dict[str, set] = {}
+    for fname, ln in samples:
+        if ln >= 0:
+            wanted.setdefault(fname, set()).add(ln)
+    texts: Dict[Tuple[str, int], str] = {}
+    for fname, line_nums in wanted.items():
+        for ln, text in read_lines(storage, metas[fname], sorted(line_nums)).items():
+            texts[(fname, ln)] = text
+
+    logger.info(f"Selected {len(samples)} lines from {len(metas)} file(s).")
+    return [
+        {"file_name": fname, "line_number": ln + 1, "line": texts.get((fname, ln), "")}
+        for fname, ln in samples
+    ]
@@ -1,64 +1,185 @@
-from typing import Optional, List, Dict, Tuple
+from datetime import datetime, timezone
+from typing import Hashable, Iterator, Optional, List, Dict, Tuple
 import heapq
 import logging
-from api.utils.db import get_conn
+import sqlite3
+from api.utils.db import get_conn, get_corpus_state
 from api.utils.storage import Storage
-from api.utils.reader import iter_lines
+from api.utils.indexing import longest_in_chunks
+from api.utils.metrics import DB_LOOKUP_SECONDS
+from api.utils.reader import (
+    iter_chunks,
+    load_index,
+    load_longest,
+    extract_line_from_frame,
+    extract_line_from_offset,
+)
+from api.utils.partition import LineRange, split_file
+from api.utils.workers import map_ordered
+from config import settings
 
 logger = logging.getLogger(__name__)
 
-def _files_to_scan(file_name: Optional[str]) -> List[Tuple[str, str]]:
+def _files_to_scan(file_name: Optional[str]) -> List[sqlite3.Row]:
     """
-    Returns a list of (filename, object_key).
+    Returns a list of `files` rows.
     If file_name is provided, validate and return just that file.
     Otherwise return all uploaded files.
     """
-    with get_conn() as conn:
+    with get_conn() as conn, DB_LOOKUP_SECONDS.time(("files_to_scan",)):
         if file_name:
             logger.info(f"Querying database for specified file: {file_name}")
             row = conn.execute(
-                "SELECT filename, object_key FROM files WHERE filename=?",
+                "SELECT * FROM files WHERE filename=?",
                 (file_name,),
             ).fetchone()
             if not row:
                 raise ValueError("File not found")
-            return [(row["filename"], row["object_key"])]
+            return [row]
         logger.info("Querying database for all uploaded files.")
-        rows = conn.execute("SELECT filename, object_key FROM files").fetchall()
+        rows = conn.execute("SELECT * FROM files ORDER BY id").fetchall()
         if not rows:
             raise ValueError("No files uploaded yet")
-        return [(r["filename"], r["object_key"]) for r in rows]
+        return rows
+
+def _sidecar_candidates(storage: Storage, row: sqlite3.Row, limit: int) -> Optional[List[Tuple[int, int, int]]]:
+    """
+    Returns the file's precomputed (length, line_no, byte_offset) entries,
+    or None if there is no sidecar or it holds fewer than `limit` of the file's lines.
+    """
+    if not row["longest_key"]:
+        return None
+    entries = load_longest(storage, row["longest_key"])
+    if entries is None or (len(entries) < limit and len(entries) < row["num_lines"]):
+        return None
+    return entries
+
+def _push(heap: List[tuple], item: tuple, limit: int):
+    """
+    Bounded min-heap insert. Items start with (length, -file_rank, -line_no), a total order in
+    which longer wins and then the earlier position wins, so the survivors are the exact
+    top-`limit` regardless of push order and partial results can be merged.
+    """
+    if len(heap) < limit:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+def _scan_range(storage: Storage, object_key: str, line_range: LineRange, limit: int,
+                compression: str = "none", version: Optional[Hashable] = None) -> List[Tuple[int, int, int]]:
+    """
+    Full scan of one line-aligned range of a file on raw bytes. Returns its local top-`limit`
+    (length, line_no, byte_offset); only lines with more bytes than the current cut-off are
+    decoded to measure their character length. Runs in the request thread or in a worker process.
+    For compressed files the range is in stored bytes and the byte offsets returned are not
+    meaningful; their lines are read back by line number instead (see `_read_winner`).
+    """
+    chunks = iter_chunks(
+        storage, object_key, start=line_range.start, end=line_range.end, compression=compression, version=version
+    )
+    return longest_in_chunks(chunks, limit, start_offset=line_range.start, first_line=line_range.first_line)
+
+def _scan_files(storage: Storage, rows: List[sqlite3.Row], limit: int) -> Dict[str, List[Tuple[int, int, int]]]:
+    """
+    Scans whole files and returns each file's candidates by file name. With
+    `[longest_lines] scan_workers` set, files are scanned in worker processes, and large files
+    are also split into line-aligned ranges so a single big upload uses several workers.
+    """
+    workers = settings.LONGEST_SCAN_WORKERS if storage.kind == "local" else 0
+    tasks = []
+    names = []
+    for row in rows:
+        for line_range in split_file(storage, row, parts=max(1, workers)):
+            version = (row["id"], row["uploaded_at"])
+            tasks.append((storage, row["object_key"], line_range, limit, row["compression"], version))
+            names.append(row["filename"])
+    if workers > 0 and len(tasks) > 1:
+        logger.info(f"Scanning {len(tasks)} range(s) of {len(rows)} file(s) with {workers} worker process(es).")
+    results = map_ordered(_scan_range, tasks, workers)
+
+    per_file: Dict[str, List[Tuple[int, int, int]]] = {row["filename"]: [] for row in rows}
+    for fname, found in zip(names, results):
+        per_file[fname].extend(found)
+    return per_file
+
+def _read_winner(storage: Storage, row: sqlite3.Row, line_no: int, offset: int, length: int) -> str:
+    version = (row["id"], row["uploaded_at"])
+    if row["compression"] == "none":
+        # `length` is in characters, at most 4 UTF-8 bytes each, plus the newline: a bounded read
+        # (one ranged GET on S3) instead of one running to the end of the object.
+        end = min(offset + 4 * length + 1, row["size_bytes"])
+        return extract_line_from_offset(storage, row["object_key"], offset, 0, end=end, version=version)
+    # Sidecar offsets refer to the original bytes; a compressed file is read through its frame index.
+    offsets = load_index(storage, row["idx_key"], version=version)
+    chunk_idx, advance = divmod(line_no, row["lines_per_chunk"])
+    return extract_line_from_frame(
+        storage, row["object_key"], offsets[chunk_idx], offsets[chunk_idx + 1], advance, version
+    )
+
+def corpus_state() -> Tuple[int, Optional[datetime]]:
+    """
+    (corpus version, time of the last upload in UTC). `get_longest_lines` returns the same
+    result for the same arguments until the version changes.
+    """
+    with get_conn() as conn, DB_LOOKUP_SECONDS.time(("corpus_version",)):
+        row = get_corpus_state(conn)
+    updated_at = row["updated_at"]
+    return row["version"], datetime.fromisoformat(updated_at).replace(tzinfo=timezone.utc) if updated_at else None
 
 def get_longest_lines(limit: int = 100, file_name: Optional[str] = None) -> List[Dict]:
     """
     Returns up to `limit` longest lines either across all files or for one file.
     Each item: { length, file_name, line_number, line }.
+    Equal lengths are ordered by file upload order, then line number.
+
+    Files with a `.longest` sidecar only contribute their precomputed top-N entries,
+    so the cost no longer depends on corpus size; winners are read back by byte offset.
+    Files without one (uploaded before the sidecar existed) are scanned in full, in
+    parallel worker processes (and line-aligned ranges) when `[longest_lines] scan_workers` is set.
+    """
+    return list(iter_longest_lines(limit=limit, file_name=file_name))
+
+def iter_longest_lines(limit: int = 100, file_name: Optional[str] = None) -> Iterator[Dict]:
+    """
+    Lazy form of `get_longest_lines` for streaming responses. The ranking runs before this
+    returns, so unknown files still raise ValueError here; the text of each winner is only
+    read when its item is consumed, so at most one line is held at a time.
     """
     logger.info(f"Searching for up to {limit} longest lines. File filter: {file_name or 'All'}")
 
     storage = Storage.from_env()
 
-    # Min-heap of (length, file_name, line_no, text)
-    heap: List[Tuple[int, str, int, str]] = []
-
-    def push(item: Tuple[int, str, int, str]):
-        if len(heap) < limit:
-            heapq.heappush(heap, item)
-        else:
-            if item[0] > heap[0][0]:
-                heapq.heapreplace(heap, item)
+    # Min-heap of (length, -file_rank, -line_no, byte_offset), file_rank indexing `files_to_scan`.
+    # Only the final winners are read back and decoded.
+    heap: List[Tuple[int, int, int, int]] = []
 
     files_to_scan = _files_to_scan(file_name)
     logger.info(f"Scanning {len(files_to_scan)} file(s).")
-    for fname, object_key in files_to_scan:
-        for i, line in enumerate(iter_lines(storage, object_key)):
-            L = len(line)
-            push((L, fname, i, line))
+    needs_scan: List[sqlite3.Row] = []
+    for rank, row in enumerate(files_to_scan):
+        entries = _sidecar_candidates(storage, row, limit)
+        if entries is None:
+            logger.info(f"No usable longest-lines sidecar for '{row['filename']}', scanning the whole file.")
+            needs_scan.append(row)
+            continue
+        for L, i, offset in entries:
+            _push(heap, (L, -rank, -i, offset), limit)
+
+    if needs_scan:
+        scanned = _scan_files(storage, needs_scan, limit)
+        for rank, row in enumerate(files_to_scan):
+            for L, i, offset in scanned.get(row["filename"], ()):
+                _push(heap, (L, -rank, -i, offset), limit)
 
     # largest first
-    heap.sort(key=lambda x: x[0], reverse=True)
+    heap.sort(reverse=True)
     logger.info(f"Found {len(heap)} lines matching criteria.")
-    return [
-        {"length": L, "file_name": fn, "line_number": ln + 1, "line": txt} # Added one to be indexed from 1 instead of 0
-        for (L, fn, ln, txt) in heap
-    ]
+    return (
+        {
+            "length": L,
+            "file_name": files_to_scan[-neg_rank]["filename"],
+            "line_number": -neg_ln + 1, # Added one to be indexed from 1 instead of 0
+            "line": _read_winner(storage, files_to_scan[-neg_rank], -neg_ln, offset, L),
+        }
+        for (L, neg_rank, neg_ln, offset) in heap
+    )
@@ -0,0 +1,320 @@
+"""
+Model layer: resumable multipart uploads.
+- Starting an upload fixes its part size and stages one data file in the storage root
+- Every part is written straight into that file at (part_number - 1) * part_size and indexed on
+  its own (newline table, line count, longest lines), so parts can arrive in parallel and be retried;
+  a re-sent part counts as missing until it was written in full
+- Completing the upload stitches the part indexes into the file's index without rescanning the
+  data, then publishes it like a regular upload; one request claims the upload to do so
+"""
+import logging
+import os
+import uuid
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from api.models.file_model import publish, resolve_index_mode
+from api.utils.db import get_conn, init_db
+from api.utils.indexing import DENSE_ENTRY_BYTES, PartMeta, index_part, stitch_parts
+from api.utils.storage import Storage, pack_longest, unpack_longest
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+init_db()
+
+# Highest accepted part number, as in S3's multipart API.
+MAX_PART_NUMBER = 10000
+
+
+class UploadNotFound(ValueError):
+    pass
+
+
+class _BoundedReader:
+    """Reads at most `limit` bytes from `stream`; raises ValueError if the stream holds more."""
+
+    def __init__(self, stream, limit: int):
+        self._stream = stream
+        self._remaining = limit
+
+    def read(self, n: int) -> bytes:
+        if self._remaining <= 0:
+            if self._stream.read(1):
+                raise ValueError("Part is larger than the upload's part size.")
+            return b""
+        chunk = self._stream.read(min(n, self._remaining))
+        self._remaining -= len(chunk)
+        return chunk
+
+
+def _staging_key(storage: Storage, path: str) -> str:
+    return os.path.relpath(path, storage.base_dir)
+
+
+def _write_part_longest(path: str, entries) -> None:
+    """Part sidecars stay in the local staging area, whichever backend stores the published file."""
+    with open(path, "wb") as f:
+        f.write(pack_longest(entries))
+
+
+def _read_part_longest(storage: Storage, longest_key: str) -> list:
+    try:
+        with open(os.path.join(storage.base_dir, longest_key), "rb") as f:
+            return unpack_longest(f.read())
+    except FileNotFoundError:
+        return []
+
+
+def _get_upload(filename: str, upload_id: str):
+    with get_conn() as conn:
+        row = conn.execute(
+            "SELECT * FROM multipart_uploads WHERE id = ? AND filename = ?", (upload_id, filename)
+        ).fetchone()
+    if row is None:
+        raise UploadNotFound("Upload not found")
+    return row
+
+
+def _get_parts(upload_id: str) -> list:
+    with get_conn() as conn:
+        return conn.execute(
+            "SELECT * FROM upload_parts WHERE upload_id = ? ORDER BY part_number", (upload_id,)
+        ).fetchall()
+
+
+def _remove_part_files(storage: Storage, part) -> None:
+    for path in (part["newlines_path"], os.path.join(storage.base_dir, part["longest_key"])):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def describe_upload(filename: str, upload_id: str) -> dict:
+    """Returns the upload and the parts received so far. Raises UploadNotFound if there is no such upload."""
+    row = _get_upload(filename, upload_id)
+    return {
+        "upload_id": row["id"],
+        "filename": row["filename"],
+        "index_mode": row["index_mode"],
+        "part_size": row["part_size"],
+        "created_at": row["created_at"],
+        "parts": [
+            {"part_number": p["part_number"], "size_bytes": p["size_bytes"]} for p in _get_parts(upload_id)
+        ],
+    }
+
+
+def create_upload(filename: str, index_mode: Optional[str] = None, part_size: Optional[int] = None) -> dict:
+    """
+    Starts a multipart upload of `filename`. Every part except the last must be exactly
+    `part_size` bytes (default `[file_processing] multipart_part_mb`).
+    Raises ValueError for an unknown index mode or a non-positive part size.
+    """
+    index_mode = resolve_index_mode(index_mode)
+    part_size = part_size or settings.MULTIPART_PART_BYTES
+    if part_size <= 0:
+        raise ValueError("part_size must be a positive number of bytes.")
+    storage = Storage.from_env()
+    data_path = storage.new_staging_file(suffix=".upload")
+    upload_id = uuid.uuid4().hex
+    with get_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO multipart_uploads(id, filename, index_mode, part_size, data_path, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (upload_id, filename, index_mode, part_size, data_path, datetime.utcnow().isoformat()),
+        )
+    logger.info(f"Started multipart upload {upload_id} for '{filename}' (part size {part_size}).")
+    return describe_upload(filename, upload_id)
+
+
+def _check_open(conn, upload_id: str):
+    row = conn.execute("SELECT status FROM multipart_uploads WHERE id = ?", (upload_id,)).fetchone()
+    if row is None:
+        raise UploadNotFound("Upload not found")
+    if row["status"] != "open":
+        raise ValueError("Upload is being completed.")
+
+
+def upload_part(filename: str, upload_id: str, part_number: int, stream) -> dict:
+    """
+    Writes one part into the upload's data file and indexes it. Re-sending a part replaces it;
+    the earlier copy is dropped before its bytes are overwritten, so if the re-send fails the part
+    is missing (and has to be sent again) rather than described by a stale index.
+    Raises UploadNotFound, or ValueError if the part number or size is invalid or the upload is
+    being completed.
+    """
+    row = _get_upload(filename, upload_id)
+    if not 1 <= part_number <= MAX_PART_NUMBER:
+        raise ValueError(f"Part number must be between 1 and {MAX_PART_NUMBER}.")
+    storage = Storage.from_env()
+    with get_conn() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _check_open(conn, upload_id)
+        old = conn.execute(
+            "SELECT * FROM upload_parts WHERE upload_id = ? AND part_number = ?", (upload_id, part_number)
+        ).fetchone()
+        conn.execute("DELETE FROM upload_parts WHERE upload_id = ? AND part_number = ?", (upload_id, part_number))
+    if old is not None:
+        _remove_part_files(storage, old)
+    part_size = row["part_size"]
+    base_offset = (part_number - 1) * part_size
+    newlines_path = storage.new_staging_file(suffix=".newlines")
+    longest_path = storage.new_staging_file(suffix=".longest")
+    try:
+        with open(row["data_path"], "r+b") as out:
+            out.seek(base_offset)
+            meta = index_part(
+                infile=_BoundedReader(stream, part_size),
+                out=out,
+                base_offset=base_offset,
+                dense_index_path=newlines_path,
+                longest_top_n=settings.LONGEST_LINES_TOP_N,
+                read_bytes=settings.INDEX_READ_BYTES,
+            )
+        _write_part_longest(longest_path, meta.longest)
+        with get_conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            _check_open(conn, upload_id)
+            # A concurrent re-send of the same part may have been recorded meanwhile.
+            old = conn.execute(
+                "SELECT * FROM upload_parts WHERE upload_id = ? AND part_number = ?", (upload_id, part_number)
+            ).fetchone()
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO upload_parts(
+                    upload_id, part_number, size_bytes, num_newlines, first_newline, last_newline,
+                    newlines_path, longest_key
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    upload_id,
+                    part_number,
+                    meta.size_bytes,
+                    meta.num_newlines,
+                    meta.first_newline,
+                    meta.last_newline,
+                    newlines_path,
+                    _staging_key(storage, longest_path),
+                ),
+            )
+    except BaseException:
+        for path in (newlines_path, longest_path):
+            os.unlink(path)
+        raise
+    if old is not None:
+        _remove_part_files(storage, old)
+    logger.info(f"Stored part {part_number} of upload {upload_id} ({meta.size_bytes} bytes).")
+    return {"upload_id": upload_id, "part_number": part_number, "size_bytes": meta.size_bytes}
+
+
+def _iter_newlines(path: str) -> Iterator[bytes]:
+    """A part's newline table in blocks of whole entries."""
+    block_bytes = DENSE_ENTRY_BYTES * max(1, settings.INDEX_READ_BYTES // DENSE_ENTRY_BYTES)
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_bytes)
+            if not block:
+                return
+            yield block
+
+
+def complete_upload(filename: str, upload_id: str) -> dict:
+    """
+    Stitches the parts' indexes into one, publishes the file and returns its metadata
+    (as for a regular upload). The upload is claimed first, so concurrent completes (and parts sent
+    meanwhile) are rejected; it is released again if completing fails.
+    Raises UploadNotFound, or ValueError if parts are missing or mis-sized or the upload is already
+    being completed.
+    """
+    row = _get_upload(filename, upload_id)
+    with get_conn() as conn:
+        claimed = conn.execute(
+            "UPDATE multipart_uploads SET status = 'completing' WHERE id = ? AND status = 'open'", (upload_id,)
+        ).rowcount
+    if not claimed:
+        raise ValueError("Upload is already being completed.")
+    try:
+        result, parts = _complete(filename, upload_id, row)
+    except BaseException:
+        with get_conn() as conn:
+            conn.execute("UPDATE multipart_uploads SET status = 'open' WHERE id = ?", (upload_id,))
+        raise
+    _discard(Storage.from_env(), upload_id, parts)
+    return result
+
+
+def _complete(filename: str, upload_id: str, row):
+    parts = _get_parts(upload_id)
+    if not parts:
+        raise ValueError("Upload has no parts.")
+    numbers = [p["part_number"] for p in parts]
+    if numbers != list(range(1, len(parts) + 1)):
+        missing = sorted(set(range(1, numbers[-1] + 1)) - set(numbers))
+        raise ValueError(f"Missing part(s): {', '.join(map(str, missing))}.")
+    for p in parts[:-1]:
+        if p["size_bytes"] != row["part_size"]:
+            raise ValueError(f"Part {p['part_number']} must be exactly {row['part_size']} bytes.")
+
+    storage = Storage.from_env()
+    data_path = row["data_path"]
+    metas: List[PartMeta] = [
+        PartMeta(
+            size_bytes=p["size_bytes"],
+            num_newlines=p["num_newlines"],
+            first_newline=p["first_newline"],
+            last_newline=p["last_newline"],
+            longest=_read_part_longest(storage, p["longest_key"]),
+        )
+        for p in parts
+    ]
+    # A shorter re-sent last part leaves stale bytes behind it.
+    os.truncate(data_path, sum(m.size_bytes for m in metas))
+
+    index_mode = row["index_mode"]
+    lines_per_chunk = 1 if index_mode == "dense" else settings.INDEX_LINES_PER_CHUNK
+    dense_path = storage.new_staging_file(suffix=".idx") if index_mode == "dense" else None
+    try:
+        with open(data_path, "rb") as data, (open(dense_path, "wb") if dense_path else nullcontext()) as dense_out:
+
+            def read_range(start: int, end: int) -> bytes:
+                data.seek(start)
+                return data.read(end - start)
+
+            meta = stitch_parts(
+                metas,
+                read_entries=lambda i: _iter_newlines(parts[i]["newlines_path"]),
+                read_range=read_range,
+                lines_per_chunk=lines_per_chunk,
+                longest_top_n=settings.LONGEST_LINES_TOP_N,
+                dense_out=dense_out,
+                chunk_bytes=settings.INDEX_CHUNK_BYTES if index_mode == "adaptive" else None,
+            )
+        result = publish(storage, filename, index_mode, lines_per_chunk, meta, data_path, dense_path)
+    finally:
+        if dense_path and os.path.exists(dense_path):
+            os.unlink(dense_path)
+    return result, parts
+
+
+def abort_upload(filename: str, upload_id: str):
+    """Discards an upload and everything staged for it. Raises UploadNotFound if there is no such upload."""
+    row = _get_upload(filename, upload_id)
+    storage = Storage.from_env()
+    try:
+        os.unlink(row["data_path"])
+    except FileNotFoundError:
+        pass
+    _discard(storage, upload_id, _get_parts(upload_id))
+
+
+def _discard(storage: Storage, upload_id: str, parts: list):
+    with get_conn() as conn:
+        conn.execute("DELETE FROM upload_parts WHERE upload_id = ?", (upload_id,))
+        conn.execute("DELETE FROM multipart_uploads WHERE id = ?", (upload_id,))
+    for p in parts:
+        _remove_part_files(storage, p)
@@ -0,0 +1,110 @@
+"""
+Model layer: line-length statistics and length-range queries.
+- Serves the summary written at upload time (`.stats` sidecar)
+- Answers "which lines are between N and M characters long" from the uint32 length column,
+  reading only the matching lines through the offset index
+- Files indexed without a length column (older uploads, multipart uploads) are scanned instead
+"""
+import logging
+import sqlite3
+from array import array
+from itertools import compress, islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from api.models.line_model import read_lines
+from api.utils.file_cache import file_rows
+from api.utils.indexing import LENGTH_MAX, LineBlocks, line_length, line_lengths, line_stats_in_chunks
+from api.utils.reader import iter_chunks, iter_lengths, load_stats
+from api.utils.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+def _file_row(file_name: str) -> sqlite3.Row:
+    row = file_rows.get(file_name)
+    if not row:
+        raise ValueError(f"File not found: {file_name}")
+    return row
+
+
+def _version(row: sqlite3.Row) -> tuple:
+    """Identifies the upload a row describes, for the block cache (see `reader._stream_from_offset`)."""
+    return row["id"], row["uploaded_at"]
+
+
+def get_file_stats(file_name: str) -> Dict:
+    """
+    Returns the line-length summary of a file: { file_name, num_lines, min, max, mean,
+    percentiles, histogram }. Lengths are in characters, without the newline.
+
+    Raises:
+        ValueError: If the file is not found.
+    """
+    row = _file_row(file_name)
+    storage = Storage.from_env()
+    stats = load_stats(storage, row["stats_key"]) if row["stats_key"] else None
+    if stats is None:
+        logger.info(f"No line-length stats stored for '{file_name}', scanning the file.")
+        chunks = iter_chunks(storage, row["object_key"], compression=row["compression"], version=_version(row))
+        stats = line_stats_in_chunks(chunks).summary()
+    return {"file_name": row["filename"], **stats}
+
+
+def _scanned_lengths(storage: Storage, row: sqlite3.Row) -> Iterator[array]:
+    """The length column of a file that has none stored, computed by reading it."""
+    blocks = LineBlocks(iter_chunks(storage, row["object_key"], compression=row["compression"], version=_version(row)))
+    for buf, lo, hi in blocks:
+        yield line_lengths(buf, lo, hi)
+    if blocks.tail:
+        yield array("I", [min(line_length(blocks.tail), LENGTH_MAX)])
+
+
+def _matching_lines(columns: Iterator[array], min_length: int, max_length: int,
+                    limit: int) -> Tuple[List[Tuple[int, int]], int]:
+    """
+    The first `limit` (line_no, length) with a length in [min_length, max_length], and the total
+    number of such lines. Each block is tested with `map` over a range's `__contains__` and
+    `itertools.compress`, so the column is filtered in C.
+    """
+    wanted = range(min_length, max_length + 1)
+    found: List[Tuple[int, int]] = []
+    total = 0
+    base = 0
+    for block in columns:
+        if len(found) < limit:
+            for i in islice(compress(range(len(block)), map(wanted.__contains__, block)), limit - len(found)):
+                found.append((base + i, block[i]))
+        total += sum(map(wanted.__contains__, block))
+        base += len(block)
+    return found, total
+
+
+def find_lines_by_length(file_name: str, min_length: int = 0, max_length: Optional[int] = None,
+                         limit: int = 100) -> Dict:
+    """
+    Returns the lines of a file whose length is within [min_length, max_length] (inclusive,
+    no upper bound if max_length is None), in file order: { file_name, min_length, max_length,
+    total, lines: [{ line_number, length, line }] } with at most `limit` lines listed.
+
+    Raises:
+        ValueError: If the file is not found.
+    """
+    row = _file_row(file_name)
+    storage = Storage.from_env()
+    if row["lengths_key"]:
+        columns = iter_lengths(storage, row["lengths_key"], version=_version(row))
+    else:
+        logger.info(f"No line-length column stored for '{file_name}', scanning the file.")
+        columns = _scanned_lengths(storage, row)
+    upper = LENGTH_MAX if max_length is None else max_length
+    found, total = _matching_lines(columns, min_length, upper, limit)
+
+    texts = read_lines(storage, row, [ln for ln, _ in found]) if found else {}
+    logger.info(f"Found {total} line(s) of '{file_name}' with length in [{min_length}, {upper}].")
+    return {
+        "file_name": row["filename"],
+        "min_length": min_length,
+        "max_length": max_length,
+        "total": total,
+        "lines": [{"line_number": ln + 1, "length": L, "line": texts[ln]} for ln, L in found],
+    }
@@ -1,13 +1,55 @@
-"""SQLite metadata store (file-level only)."""
+"""SQLite metadata store (file-level only).
+
+Each thread keeps one long-lived connection (see `get_conn`) in WAL mode, so readers never block
+the writer and statements stay prepared in the connection's statement cache between requests.
+"""
 import os
 import sqlite3
+import threading
+from datetime import datetime
+
+from config import settings
 
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "data.db")
 
+# Prepared statements kept per connection (the sqlite3 module's LRU statement cache).
+CACHED_STATEMENTS = 256
 
-def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+_local = threading.local()
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    # IMMEDIATE takes the write lock when a write transaction begins instead of upgrading a read
+    # lock later, which is the case where two writers cannot wait for each other and fail at once.
+    conn = sqlite3.connect(
+        path,
+        timeout=settings.DB_BUSY_TIMEOUT_MS / 1000,
+        isolation_level="IMMEDIATE",
+        cached_statements=CACHED_STATEMENTS,
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # durable at each WAL checkpoint, safe against corruption
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA cache_size=-{settings.DB_CACHE_KB}")
+    return conn
+
+
+def get_conn() -> sqlite3.Connection:
+    """
+    Returns this thread's pooled connection to `DB_PATH`, opening it on first use.
+    Use it as `with get_conn() as conn:` to commit (or roll back) a write; never close it.
+    A new connection is opened if `DB_PATH` changed or the process was forked.
+    """
+    key = (DB_PATH, os.getpid())
+    pooled = getattr(_local, "conn", None)
+    if pooled is not None:
+        if pooled[0] == key:
+            return pooled[1]
+        if pooled[0][1] == key[1]:
+            pooled[1].close()
+    conn = _connect(DB_PATH)
+    _local.conn = (key, conn)
     return conn
 
 
@@ -26,4 +68,147 @@ def init_db():
                 lines_per_chunk INTEGER NOT NULL
             )
             """
-        )
\ No newline at end of file
+        )
+        _add_column_if_missing(conn, "files", "longest_key", "TEXT")
+        _add_column_if_missing(conn, "files", "index_mode", "TEXT NOT NULL DEFAULT 'chunk'")
+        _add_column_if_missing(conn, "files", "compression", "TEXT NOT NULL DEFAULT 'none'")
+        _add_column_if_missing(conn, "files", "content_hash", "TEXT")
+        # Per-line length column (uint32) and its summary; NULL for files indexed without them.
+        _add_column_if_missing(conn, "files", "lengths_key", "TEXT")
+        _add_column_if_missing(conn, "files", "stats_key", "TEXT")
+        # Stored objects (content + index + sidecar), shared by every `files` row with the same
+        # content and index layout. `refcount` is the number of rows pointing at `object_key`.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS objects (
+                object_key TEXT PRIMARY KEY,
+                idx_key TEXT NOT NULL,
+                longest_key TEXT,
+                content_hash TEXT,
+                index_mode TEXT NOT NULL,
+                lines_per_chunk INTEGER NOT NULL,
+                compression TEXT NOT NULL,
+                refcount INTEGER NOT NULL
+            )
+            """
+        )
+        _add_column_if_missing(conn, "objects", "lengths_key", "TEXT")
+        _add_column_if_missing(conn, "objects", "stats_key", "TEXT")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS objects_by_content "
+            "ON objects(content_hash, index_mode, lines_per_chunk, compression)"
+        )
+        # Files uploaded before objects were tracked own their object alone.
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO objects(
+                object_key, idx_key, longest_key, content_hash, index_mode, lines_per_chunk, compression,
+                lengths_key, stats_key, refcount
+            )
+            SELECT object_key, idx_key, longest_key, content_hash, index_mode, lines_per_chunk, compression,
+                lengths_key, stats_key, 1
+            FROM files
+            """
+        )
+        # Keys of unreferenced objects, deleted once `delete_after` (Unix time) has passed so that
+        # requests still holding the old `files` row can finish reading them.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS object_deletions (
+                key TEXT PRIMARY KEY,
+                delete_after REAL NOT NULL
+            )
+            """
+        )
+        # Single-row counter bumped on every upload, so caches can cheaply tell whether `files` changed.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS corpus_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute("INSERT OR IGNORE INTO corpus_version(id, version) VALUES (1, 0)")
+        # When the version was last bumped (UTC, ISO 8601), served as Last-Modified.
+        _add_column_if_missing(conn, "corpus_version", "updated_at", "TEXT")
+        # Background ingest jobs (see api/models/job_model.py). `owner_pid` is the process
+        # running the job, so a restarted server can tell which unfinished jobs were orphaned.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                index_mode TEXT NOT NULL,
+                spool_path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                bytes_total INTEGER NOT NULL,
+                bytes_indexed INTEGER NOT NULL DEFAULT 0,
+                lines_indexed INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                owner_pid INTEGER,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+        _add_column_if_missing(conn, "jobs", "compression", "TEXT NOT NULL DEFAULT 'none'")
+        # Random per-process token next to owner_pid, so a restarted server that got the same pid
+        # (PID 1 in a container, or reuse) does not take the old process's jobs for its own.
+        _add_column_if_missing(conn, "jobs", "owner_token", "TEXT")
+        # Multipart uploads in progress (see api/models/multipart_model.py) and their received parts.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS multipart_uploads (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                index_mode TEXT NOT NULL,
+                part_size INTEGER NOT NULL,
+                data_path TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS upload_parts (
+                upload_id TEXT NOT NULL,
+                part_number INTEGER NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                num_newlines INTEGER NOT NULL,
+                first_newline INTEGER NOT NULL,
+                last_newline INTEGER NOT NULL,
+                newlines_path TEXT NOT NULL,
+                longest_key TEXT NOT NULL,
+                PRIMARY KEY (upload_id, part_number)
+            )
+            """
+        )
+        # 'open', or 'completing' while one request stitches and publishes the upload.
+        _add_column_if_missing(conn, "multipart_uploads", "status", "TEXT NOT NULL DEFAULT 'open'")
+
+
+def get_corpus_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT version FROM corpus_version WHERE id = 1").fetchone()["version"]
+
+
+def get_corpus_state(conn: sqlite3.Connection) -> sqlite3.Row:
+    """The corpus version and when it was last bumped (`updated_at`, None before the first upload)."""
+    return conn.execute("SELECT version, updated_at FROM corpus_version WHERE id = 1").fetchone()
+
+
+def bump_corpus_version(conn: sqlite3.Connection) -> int:
+    """Increments the corpus version inside the caller's transaction and returns the new value."""
+    conn.execute(
+        "UPDATE corpus_version SET version = version + 1, updated_at = ? WHERE id = 1",
+        (datetime.utcnow().isoformat(),),
+    )
+    return get_corpus_version(conn)
+
+
+def _add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, decl: str):
+    """Lightweight migration for databases created before `column` existed."""
+    cols = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""In-process cache of `files` rows for the random-line hot path.
+
+Rows are cached by filename, plus the most recently uploaded one, so picking a line usually
+needs only the single-row read of the corpus version instead of a `files` query. Every upload
+bumps that version, so a change by any process drops the cached rows on the next lookup; uploads
+handled by this process also clear the cache when they commit (`invalidate`).
+"""
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from api.utils import db
+from api.utils.metrics import DB_LOOKUP_SECONDS
+
+# Maximum number of cached rows (least recently used are dropped first).
+MAX_ENTRIES = 1024
+
+# Cache key of the most recently uploaded file; filenames are never empty.
+_LATEST = ""
+
+
+class FileRowCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._db_path: Optional[str] = None
+        self._version: Optional[int] = None  # corpus version the cached rows were read at
+        self._entries: "OrderedDict[str, sqlite3.Row]" = OrderedDict()
+        self._generation = 0  # bumped by `invalidate`
+        self.hits = 0
+        self.misses = 0
+
+    def _get_cached(self, key: str, version: int) -> Optional[sqlite3.Row]:
+        with self._lock:
+            if self._db_path != db.DB_PATH or self._version != version:
+                self._entries.clear()
+                self._db_path, self._version = db.DB_PATH, version
+            row = self._entries.get(key)
+            if row is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return row
+
+    def _put(self, key: str, row: sqlite3.Row, version: int, generation: int):
+        with self._lock:
+            # Skip rows read before an invalidation or version change that happened while we were querying.
+            if generation != self._generation or self._db_path != db.DB_PATH or self._version != version:
+                return
+            self._entries[key] = row
+            self._entries.move_to_end(key)
+            while len(self._entries) > MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def get(self, file_name: Optional[str] = None) -> Optional[sqlite3.Row]:
+        """The `files` row of `file_name`, or of the latest upload if None. None if there is no such row."""
+        key = file_name or _LATEST
+        generation = self._generation
+        conn = db.get_conn()
+        with DB_LOOKUP_SECONDS.time(("corpus_version",)):
+            version = db.get_corpus_version(conn)
+        row = self._get_cached(key, version)
+        if row is not None:
+            return row
+        with DB_LOOKUP_SECONDS.time(("file_row",)):
+            if file_name:
+                row = conn.execute("SELECT * FROM files WHERE filename = ?", (file_name,)).fetchone()
+            else:
+                row = conn.execute("SELECT * FROM files ORDER BY id DESC LIMIT 1").fetchone()
+        if row is not None:
+            self._put(key, row, version, generation)
+        return row
+
+    def invalidate(self):
+        """Drops every cached row; called after this process commits a change to `files`."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+file_rows = FileRowCache()
@@ -1,53 +1,638 @@
 """Chunk-based index builder.
 Records byte offsets for lines 0, K, 2K, ... while streaming input → output file.
+In dense mode, records the start offset of every line instead (40-bit packed, see `pack_offsets40`).
+In adaptive mode, records (line number, offset) checkpoints every K lines or N bytes, whichever
+comes first (see `Checkpoints`).
+Also keeps the top-N longest lines (length, line number, byte offset) for the longest-lines sidecar.
+Parts of a multipart upload are indexed on their own (`index_part`) and combined with `stitch_parts`.
+With compression, the output is a series of gzip members, one per index chunk (see `FrameWriter`).
+Optionally writes the length of every line as a uint32 column and summarizes it (see `LineStats`).
 """
-from dataclasses import dataclass
-from typing import List
-from dataclasses import dataclass
+import hashlib
+import heapq
+import re
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
 
 CHUNK_BYTES = 64 * 1024
 
+INDEX_MODES = ("chunk", "dense", "adaptive")
+
+# Storage formats: raw bytes, or one gzip member ("frame") per index chunk.
+COMPRESSIONS = ("none", "gzip")
+# zlib window bits selecting the gzip container.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Dense index entries are little-endian 40-bit offsets, enough for files up to 1 TB.
+DENSE_ENTRY_BYTES = 5
+DENSE_MAX_BYTES = 1 << (8 * DENSE_ENTRY_BYTES)
+
+# Line-length columns are little-endian uint32 entries; longer lines are clamped.
+LENGTH_ENTRY_BYTES = 4
+LENGTH_MAX = (1 << (8 * LENGTH_ENTRY_BYTES)) - 1
+# Percentiles reported in the line-length stats.
+STATS_PERCENTILES = (50, 90, 95, 99)
+
+
 @dataclass
 class IndexMeta:
     size_bytes: int
     num_lines: int
     offsets: List[int]
+    longest: List[Tuple[int, int, int]] = field(default_factory=list)
+    content_hash: Optional[str] = None
+    stats: Optional[dict] = None
+    # Adaptive index only: the line number starting at each of `offsets`.
+    checkpoint_lines: Optional[List[int]] = None
 
 
-def build_chunk_index(infile, outfile_path: str, lines_per_chunk: int) -> IndexMeta:
-    line = 0
-    byte_offset = 0
-    offsets = [0]  # line 0 starts at byte 0
+@dataclass
+class PartMeta:
+    """
+    Summary of one part of a multipart upload, computed without knowing the parts before it.
+    Newline positions are relative to the part (-1 if it has none). `longest` covers the lines
+    that start after the first newline and end at the last one, as (length, line_no, byte_offset)
+    with line 0 being the line after the first newline and absolute byte offsets.
+    """
+    size_bytes: int
+    num_newlines: int
+    first_newline: int
+    last_newline: int
+    longest: List[Tuple[int, int, int]] = field(default_factory=list)
 
-    with open(outfile_path, "wb") as out:
-        while True:
-            chunk = infile.read(CHUNK_BYTES)
-            if not chunk:
-                break
-            start = 0
-            while True:
-                idx = chunk.find(b"\n", start)
-                if idx == -1:
-                    out.write(chunk[start:])
-                    byte_offset += len(chunk) - start
-                    break
-                # write through the newline, next line begins at byte_offset + idx + 1
-                out.write(chunk[start: idx + 1])
-                line += 1
-                if line % lines_per_chunk == 0:
-                    offsets.append(byte_offset + idx + 1)
-                byte_offset += (idx + 1 - start)
-                start = idx + 1
-
-    # Determine size & total lines (handle final line without trailing \n)
-    size_bytes = byte_offset
-    if size_bytes == 0:
-        num_lines = 0
+
+def line_length(raw: bytes) -> int:
+    """Character length of a raw line, matching `len(raw.decode("utf-8", "replace"))`."""
+    if raw.isascii():
+        return len(raw)
+    return len(raw.decode("utf-8", "replace"))
+
+
+class LongestLines:
+    """
+    Bounded min-heap of the `capacity` longest lines seen while streaming a file.
+    Among lines of equal length the earliest one wins, as in the full scan.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._heap: List[Tuple[int, int, int]] = []  # (length, -line_no, byte_offset)
+
+    def threshold(self) -> int:
+        """Lines of at most this many characters cannot enter the heap."""
+        if self.capacity <= 0:
+            return sys.maxsize
+        if len(self._heap) < self.capacity:
+            return -1
+        return self._heap[0][0]
+
+    def push(self, length: int, line_no: int, byte_offset: int):
+        if self.capacity <= 0:
+            return
+        item = (length, -line_no, byte_offset)
+        if len(self._heap) < self.capacity:
+            heapq.heappush(self._heap, item)
+        elif length > self._heap[0][0]:
+            heapq.heapreplace(self._heap, item)
+
+    def entries(self) -> List[Tuple[int, int, int]]:
+        """(length, line_no, byte_offset) sorted longest first, then by line number."""
+        ordered = sorted(self._heap, key=lambda x: (-x[0], -x[1]))
+        return [(L, -neg_ln, off) for (L, neg_ln, off) in ordered]
+
+
+def line_lengths(buf: bytes, lo: int, hi: int) -> array:
+    """
+    Character lengths (as in `line_length`) of the complete lines in buf[lo:hi], which ends on a
+    newline, as an array('I'). The block is split once and measured in C, with no per-line Python work.
+    """
+    block = buf[lo:hi - 1]
+    if block.isascii():
+        parts = block.split(b"\n")
     else:
-        # we can infer final byte from out file without reopening the stream
-        with open(outfile_path, "rb") as fc:
-            fc.seek(max(0, size_bytes - 1))
-            tail = fc.read(1)
-        num_lines = line if tail == b"\n" else line + 1
+        # A newline is never part of a multi-byte sequence, so decoding the whole block
+        # gives every line the same characters as decoding it on its own.
+        parts = block.decode("utf-8", "replace").split("\n")
+    if hi - lo > LENGTH_MAX:
+        return array("I", (min(len(p), LENGTH_MAX) for p in parts))
+    return array("I", map(len, parts))
+
+
+class LineStats:
+    """
+    Collects per-line lengths while streaming a file: writes them to `out` (if given) as the
+    uint32 column, and keeps a count per distinct length, from which `summary` derives exact
+    min/max/mean, percentiles and a histogram with power-of-two buckets.
+    """
+
+    def __init__(self, out=None):
+        self._out = out
+        self.counts: Counter = Counter()
+
+    def add(self, lengths: array):
+        self.counts.update(lengths)
+        if self._out is not None:
+            if sys.byteorder == "big":
+                lengths = array("I", lengths)
+                lengths.byteswap()
+            self._out.write(lengths.tobytes())
+
+    def summary(self) -> dict:
+        num_lines = sum(self.counts.values())
+        stats = {"num_lines": num_lines, "min": 0, "max": 0, "mean": 0.0,
+                 "percentiles": {f"p{p}": 0 for p in STATS_PERCENTILES}, "histogram": []}
+        if not num_lines:
+            return stats
+        lengths = sorted(self.counts)
+        stats["min"], stats["max"] = lengths[0], lengths[-1]
+        stats["mean"] = round(sum(L * n for L, n in self.counts.items()) / num_lines, 3)
+
+        # Nearest-rank percentiles: the smallest length covering p% of the lines.
+        ranks = [(p, -(-p * num_lines // 100)) for p in STATS_PERCENTILES]
+        seen = 0
+        for L in lengths:
+            seen += self.counts[L]
+            while ranks and seen >= ranks[0][1]:
+                stats["percentiles"][f"p{ranks.pop(0)[0]}"] = L
+
+        # Bucket 0 holds empty lines, bucket k lengths 2^(k-1) .. 2^k - 1.
+        buckets: Counter = Counter()
+        for L, n in self.counts.items():
+            buckets[L.bit_length()] += n
+        stats["histogram"] = [
+            {"min": 0 if k == 0 else 1 << (k - 1), "max": (1 << k) - 1, "count": buckets[k]}
+            for k in sorted(buckets)
+        ]
+        return stats
+
+
+def line_stats_in_chunks(chunks: Iterable[bytes]) -> LineStats:
+    """Line-length counts of a stream of bytes, for files indexed without a length column."""
+    stats = LineStats()
+    blocks = LineBlocks(chunks)
+    for buf, lo, hi in blocks:
+        stats.add(line_lengths(buf, lo, hi))
+    if blocks.tail:
+        stats.add(array("I", [min(line_length(blocks.tail), LENGTH_MAX)]))
+    return stats
+
+
+class FrameWriter:
+    """
+    Writes a stream to `out` as consecutive gzip members ("frames") that can each be decompressed
+    on their own; together they form a valid multi-member .gz file. `offsets` holds the stored
+    offset of every frame start, and after `close()` a final entry equal to the stored size,
+    so frame m is `offsets[m]:offsets[m + 1]`.
+    """
+
+    def __init__(self, out, level: int = 6):
+        self._out = out
+        self._level = level
+        self._pos = 0
+        self._comp = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+        self.offsets = [0]
+
+    def _emit(self, data: bytes):
+        if data:
+            self._out.write(data)
+            self._pos += len(data)
+
+    def write(self, data):
+        if len(data):
+            self._emit(self._comp.compress(data))
+
+    def cut(self):
+        """Ends the current frame; what is written next starts a new one."""
+        self._emit(self._comp.flush())
+        self._comp = zlib.compressobj(self._level, zlib.DEFLATED, GZIP_WBITS)
+        self.offsets.append(self._pos)
+
+    def close(self):
+        self._emit(self._comp.flush())
+        self.offsets.append(self._pos)
+
+
+def pack_offsets40(offsets: array) -> bytes:
+    """Packs an array('Q') of offsets into 5-byte little-endian entries using strided copies."""
+    if sys.byteorder == "big":
+        offsets = array("Q", offsets)
+        offsets.byteswap()
+    raw = offsets.tobytes()
+    out = bytearray(DENSE_ENTRY_BYTES * len(offsets))
+    for k in range(DENSE_ENTRY_BYTES):
+        out[k::DENSE_ENTRY_BYTES] = raw[k::8]
+    return bytes(out)
+
+
+def unpack_offsets40(raw: bytes) -> array:
+    """Inverse of `pack_offsets40`: 5-byte little-endian entries into an array('Q')."""
+    n = len(raw) // DENSE_ENTRY_BYTES
+    wide = bytearray(8 * n)
+    for k in range(DENSE_ENTRY_BYTES):
+        wide[k::8] = raw[k:n * DENSE_ENTRY_BYTES:DENSE_ENTRY_BYTES]
+    offsets = array("Q")
+    offsets.frombytes(bytes(wide))
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    return offsets
+
+
+def _dense_offsets(buf: bytes, lo: int, hi: int, base: int) -> bytes:
+    """Packed start offsets of the lines following each newline in buf[lo:hi]."""
+    offsets = array("Q")
+    pos = buf.find(b"\n", lo, hi)
+    while pos != -1:
+        offsets.append(base + pos + 1 - lo)
+        pos = buf.find(b"\n", pos + 1, hi)
+    return pack_offsets40(offsets)
+
+
+@lru_cache(maxsize=None)
+def _skip_lines_pattern(n: int) -> "re.Pattern[bytes]":
+    """Matches exactly `n` lines (through their newline), so `.match(...).end()` lands on a line start."""
+    return re.compile(rb"(?:[^\n]*\n){%d}" % n)
+
+
+@lru_cache(maxsize=256)
+def _long_line_pattern(min_bytes: int) -> "re.Pattern[bytes]":
+    """Matches a newline followed by a line of at least `min_bytes` bytes.
+    Leading with a literal lets the regex engine jump between newlines instead of trying every byte."""
+    return re.compile(rb"\n[^\n]{%d,}" % min_bytes)
+
+
+def _record_checkpoints(buf: bytes, lo: int, hi: int, base: int, line: int, n_lines: int,
+                        lines_per_chunk: int, offsets: List[int]):
+    """Appends the offset after every K-th newline in buf[lo:hi], which holds lines `line` .. `line + n_lines - 1`."""
+    target = (line // lines_per_chunk + 1) * lines_per_chunk
+    last = line + n_lines
+    pos = lo
+    while target <= last:
+        pos = _skip_lines_pattern(target - line).match(buf, pos, hi).end()
+        offsets.append(base + pos - lo)
+        line = target
+        target += lines_per_chunk
+
+
+class Checkpoints:
+    """
+    (line number, byte offset) checkpoints of the adaptive index. A new checkpoint starts at the
+    first line that is `lines_per_chunk` lines, or begins at least `chunk_bytes` bytes, after the
+    previous one, whichever comes first. Reading a line from its checkpoint therefore touches at
+    most `chunk_bytes` bytes plus the line itself, however long the lines are.
+    The index is stored as all line numbers followed by all offsets (8-byte little-endian each).
+    """
+
+    def __init__(self, lines_per_chunk: int, chunk_bytes: int):
+        self.lines_per_chunk = lines_per_chunk
+        self.chunk_bytes = max(1, chunk_bytes)
+        self.lines = [0]  # line 0 starts at byte 0
+        self.offsets = [0]
+
+    def _targets(self) -> Tuple[int, int]:
+        return self.lines[-1] + self.lines_per_chunk, self.offsets[-1] + self.chunk_bytes
+
+    def scan(self, buf: bytes, lo: int, hi: int, base: int, line: int):
+        """Records the checkpoints among the line starts after each newline in buf[lo:hi], whose
+        first line is number `line` and starts at offset `base`."""
+        pos = lo
+        while True:
+            target_line, target_offset = self._targets()
+            # First line start at or after the byte target: the line after the next newline from there.
+            j = buf.find(b"\n", max(pos, lo + target_offset - 1 - base), hi)
+            need = target_line - line
+            if j != -1 and line + buf.count(b"\n", pos, j + 1) < target_line:
+                line += buf.count(b"\n", pos, j + 1)
+                pos = j + 1
+            elif buf.count(b"\n", pos, hi) >= need:
+                pos = _skip_lines_pattern(need).match(buf, pos, hi).end()
+                line = target_line
+            else:
+                return
+            self.lines.append(line)
+            self.offsets.append(base + pos - lo)
+
+    def scan_starts(self, starts: array, first_line: int):
+        """Records the checkpoints among `starts`, the start offsets of lines `first_line`, `first_line + 1`, ..."""
+        while True:
+            target_line, target_offset = self._targets()
+            j = min(target_line - first_line, bisect_left(starts, target_offset))
+            if j >= len(starts):
+                return
+            self.lines.append(first_line + j)
+            self.offsets.append(starts[j])
+
+
+def _track_longest(longest: LongestLines, buf: bytes, lo: int, hi: int, base: int, line: int):
+    """Feeds the complete lines in buf[lo:hi] (starting with line number `line`) to the tracker."""
+    pos = lo
+    # While the heap is still filling, every line is a candidate.
+    while pos < hi and longest.threshold() < 0:
+        j = buf.find(b"\n", pos, hi)
+        longest.push(line_length(buf[pos:j]), line, base + pos - lo)
+        line += 1
+        pos = j + 1
+    if pos >= hi or longest.capacity <= 0:
+        return
+
+    # The first line has no newline in front of it inside this block, check it directly.
+    nl = buf.find(b"\n", pos, hi)
+    if nl - pos > longest.threshold():
+        longest.push(line_length(buf[pos:nl]), line, base + pos - lo)
+    line += 1
+
+    # A line can never have more characters than bytes, so only lines with more bytes than
+    # the current threshold are candidates; the regex skips everything else in C.
+    for m in _long_line_pattern(longest.threshold() + 1).finditer(buf, nl, hi):
+        p = m.start()
+        line += buf.count(b"\n", nl + 1, p + 1)
+        nl = p
+        if m.end() - p - 1 > longest.threshold():
+            longest.push(line_length(buf[p + 1:m.end()]), line, base + p + 1 - lo)
+
+
+class LineBlocks:
+    """
+    Regroups a stream of byte chunks into blocks of whole lines. Iterating yields (buf, lo, hi)
+    where buf[lo:hi] holds one or more complete lines, each ending in a newline; the bytes after
+    the last newline of a chunk are carried over. After iteration, `tail` holds the final line
+    if it has no trailing newline (b"" otherwise).
+    """
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = chunks
+        self.tail = b""
+
+    def __iter__(self) -> Iterator[Tuple[bytes, int, int]]:
+        carry: List[bytes] = []  # bytes of the current line read so far
+        for chunk in self._chunks:
+            cut = chunk.rfind(b"\n")
+            if cut == -1:
+                carry.append(chunk)
+                continue
+            if carry:
+                carry.append(chunk[:cut + 1])
+                buf = b"".join(carry)
+                yield buf, 0, len(buf)
+            else:
+                yield chunk, 0, cut + 1
+            carry = [chunk[cut + 1:]] if cut + 1 < len(chunk) else []
+        self.tail = b"".join(carry)
+
+
+def longest_in_chunks(chunks: Iterable[bytes], capacity: int, start_offset: int = 0,
+                      first_line: int = 0) -> List[Tuple[int, int, int]]:
+    """
+    Top-`capacity` (length, line_no, byte_offset) of a stream of line-aligned bytes that starts
+    at `start_offset` with line `first_line`, without decoding lines that cannot make the cut.
+    Uses the same tracker and ordering as the sidecar built by `build_chunk_index`.
+    """
+    longest = LongestLines(capacity)
+    blocks = LineBlocks(chunks)
+    line, line_start = first_line, start_offset
+    for buf, lo, hi in blocks:
+        _track_longest(longest, buf, lo, hi, line_start, line)
+        line += buf.count(b"\n", lo, hi)
+        line_start += hi - lo
+    if blocks.tail and len(blocks.tail) > longest.threshold():
+        longest.push(line_length(blocks.tail), line, line_start)
+    return longest.entries()
+
+
+def _read_chunks(infile, read_bytes: int) -> Iterator[bytes]:
+    while True:
+        chunk = infile.read(read_bytes)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _hash_chunks(chunks: Iterable[bytes], hasher) -> Iterator[bytes]:
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+
+
+def content_hasher():
+    """The hash identifying upload contents (BLAKE2b, 256-bit)."""
+    return hashlib.blake2b(digest_size=32)
+
+
+def _tee_chunks(infile, out, read_bytes: int) -> Iterator[bytes]:
+    """Reads `infile` in `read_bytes` chunks, writing each one to `out` before yielding it."""
+    for chunk in _read_chunks(infile, read_bytes):
+        out.write(chunk)
+        yield chunk
+
+
+def _write_frames(frames: FrameWriter, buf: bytes, lo: int, hi: int, base: int, checkpoints: List[int]):
+    """Writes buf[lo:hi] (starting at offset `base`), ending a frame at each checkpoint offset."""
+    view = memoryview(buf)
+    pos = lo
+    for offset in checkpoints:
+        cut = lo + offset - base
+        frames.write(view[pos:cut])
+        frames.cut()
+        pos = cut
+    frames.write(view[pos:hi])
+
+
+def build_chunk_index(infile, outfile_path: Optional[str], lines_per_chunk: int, longest_top_n: int = 0,
+                      read_bytes: int = CHUNK_BYTES, dense_index_path: Optional[str] = None,
+                      progress: Optional[Callable[[int, int], None]] = None,
+                      compression: str = "none", compression_level: int = 6,
+                      hash_content: bool = False, lengths_path: Optional[str] = None,
+                      chunk_bytes: Optional[int] = None) -> IndexMeta:
+    """
+    Streams `infile` into `outfile_path` and builds the chunk index in a single pass.
+    With `outfile_path=None` the input is only indexed (it is already where it should be).
+
+    Each read is written out once. Newlines are counted with `bytes.count` and only every
+    K-th one is located (with a compiled regex), so there is no per-line Python work for
+    offsets. Lines are handled in blocks that end on a newline (see `LineBlocks`).
+
+    If `dense_index_path` is given, the start offset of every line (plus a final entry equal
+    to the file size) is written there as 40-bit entries instead, and `offsets` stays empty.
+    `progress(bytes_indexed, lines_indexed)` is called after every block if given.
+
+    With `compression="gzip"` (chunk index only), `outfile_path` receives one gzip frame per
+    index chunk and `offsets` holds the stored frame offsets plus a final entry equal to the
+    stored size. `size_bytes` and the longest-lines offsets still refer to the original bytes.
+
+    With `hash_content`, the input is also hashed in the same pass (`content_hasher`) and the
+    hex digest returned as `content_hash`.
+
+    With `lengths_path`, the character length of every line is written there as a uint32 column
+    (line i at byte 4*i) and `stats` holds its summary (see `LineStats`).
+
+    With `chunk_bytes` (adaptive index, uncompressed only), checkpoints are placed every K lines
+    or `chunk_bytes` bytes, whichever comes first, and `checkpoint_lines` holds their line numbers.
+    """
+    line = 0
+    offsets = [] if dense_index_path else [0]  # line 0 starts at byte 0
+    checkpoints = Checkpoints(lines_per_chunk, chunk_bytes) if chunk_bytes and not dense_index_path else None
+    longest = LongestLines(longest_top_n)
+    line_start = 0  # byte offset where the current (incomplete) line begins
+
+    with (open(outfile_path, "wb") if outfile_path else nullcontext()) as out, \
+            (open(dense_index_path, "wb") if dense_index_path else nullcontext()) as dense_out, \
+            (open(lengths_path, "wb") if lengths_path else nullcontext()) as lengths_out:
+        line_stats = LineStats(lengths_out) if lengths_out else None
+        if dense_out:
+            dense_out.write(pack_offsets40(array("Q", [0])))
+        frames = FrameWriter(out, compression_level) if out and compression == "gzip" else None
+        chunks = _tee_chunks(infile, out, read_bytes) if out and not frames else _read_chunks(infile, read_bytes)
+        hasher = content_hasher() if hash_content else None
+        blocks = LineBlocks(_hash_chunks(chunks, hasher) if hasher else chunks)
+        for buf, lo, hi in blocks:
+            n_lines = buf.count(b"\n", lo, hi)
+            if dense_out:
+                dense_out.write(_dense_offsets(buf, lo, hi, line_start))
+            elif checkpoints:
+                checkpoints.scan(buf, lo, hi, line_start, line)
+            else:
+                recorded = len(offsets)
+                _record_checkpoints(buf, lo, hi, line_start, line, n_lines, lines_per_chunk, offsets)
+                if frames:
+                    _write_frames(frames, buf, lo, hi, line_start, offsets[recorded:])
+            if longest.capacity > 0:
+                _track_longest(longest, buf, lo, hi, line_start, line)
+            if line_stats:
+                line_stats.add(line_lengths(buf, lo, hi))
+            line += n_lines
+            line_start += hi - lo
+            if progress:
+                progress(line_start, line)
+
+        tail = blocks.tail
+        size_bytes = line_start + len(tail)
+        if line_stats and tail:
+            line_stats.add(array("I", [min(line_length(tail), LENGTH_MAX)]))
+        if dense_out and tail:
+            dense_out.write(pack_offsets40(array("Q", [size_bytes])))
+        if frames:
+            frames.write(tail)
+            frames.close()
+            offsets = frames.offsets
+
+    # Handle final line without trailing \n
+    num_lines = line
+    if tail:
+        num_lines += 1
+        if len(tail) > longest.threshold():
+            longest.push(line_length(tail), line, line_start)
+    if progress:
+        progress(size_bytes, num_lines)
+
+    if dense_index_path and size_bytes >= DENSE_MAX_BYTES:
+        raise ValueError("File is too large for a dense index.")
+
+    return IndexMeta(size_bytes=size_bytes, num_lines=num_lines,
+                     offsets=checkpoints.offsets if checkpoints else offsets, longest=longest.entries(),
+                     content_hash=hasher.hexdigest() if hasher else None,
+                     stats=line_stats.summary() if line_stats else None,
+                     checkpoint_lines=checkpoints.lines if checkpoints else None)
+
+
+def index_part(infile, out, base_offset: int, dense_index_path: str, longest_top_n: int = 0,
+               read_bytes: int = CHUNK_BYTES) -> PartMeta:
+    """
+    Streams one part of a multipart upload into `out` (already positioned at `base_offset`) and
+    writes the absolute offset after each of its newlines to `dense_index_path` as 40-bit entries.
+    The bytes before the part's first newline and after its last one belong to lines that span
+    parts; `stitch_parts` measures those once all parts are known.
+    """
+    longest = LongestLines(longest_top_n)
+    first_newline = last_newline = -1
+    num_newlines = 0
+    line = 0  # local number of the first line in the block that starts after the first newline
+    pos = 0  # part-relative offset of the current block
+    with open(dense_index_path, "wb") as dense_out:
+        blocks = LineBlocks(_tee_chunks(infile, out, read_bytes))
+        for buf, lo, hi in blocks:
+            n_lines = buf.count(b"\n", lo, hi)
+            dense_out.write(_dense_offsets(buf, lo, hi, base_offset + pos))
+            start = lo
+            if first_newline < 0:
+                first_newline = pos + buf.find(b"\n", lo, hi) - lo
+                start = lo + first_newline - pos + 1
+                n_lines -= 1
+            if longest.capacity > 0 and start < hi:
+                _track_longest(longest, buf, start, hi, base_offset + pos + start - lo, line)
+            line += n_lines
+            num_newlines += buf.count(b"\n", lo, hi)
+            pos += hi - lo
+            last_newline = pos - 1
+        size_bytes = pos + len(blocks.tail)
+    return PartMeta(size_bytes=size_bytes, num_newlines=num_newlines, first_newline=first_newline,
+                    last_newline=last_newline, longest=longest.entries())
+
+
+def stitch_parts(parts: List[PartMeta], read_entries: Callable[[int], Iterable[bytes]],
+                 read_range: Callable[[int, int], bytes], lines_per_chunk: int, longest_top_n: int = 0,
+                 dense_out=None, chunk_bytes: Optional[int] = None) -> IndexMeta:
+    """
+    Combines consecutive, independently indexed parts into the index of the whole file, the same
+    one `build_chunk_index` would build, without reading the data again. Only the newline tables
+    of the parts are read (`read_entries(i)` yields part i's table in blocks of whole 5-byte
+    entries) plus, through `read_range(start, end)`, lines spanning a part boundary that are long
+    enough to make the longest-lines cut. With `dense_out`, the dense index is written there;
+    with `chunk_bytes`, the adaptive index is built (see `Checkpoints`).
+    """
+    offsets = [] if dense_out else [0]  # line 0 starts at byte 0
+    checkpoints = Checkpoints(lines_per_chunk, chunk_bytes) if chunk_bytes and not dense_out else None
+    longest = LongestLines(longest_top_n)
+    line = 0  # number of the line that is still open where the current part begins
+    line_start = 0  # and its byte offset
+    base = 0  # byte offset of the current part
+    if dense_out:
+        dense_out.write(pack_offsets40(array("Q", [0])))
+    for i, part in enumerate(parts):
+        if part.num_newlines:
+            # The open line ends at this part's first newline; it precedes all of the part's own lines.
+            end = base + part.first_newline
+            if end - line_start > longest.threshold():
+                longest.push(line_length(read_range(line_start, end)), line, line_start)
+            for length, local_line, offset in part.longest:
+                longest.push(length, line + 1 + local_line, offset)
+
+            newline = line  # global number of the part's first newline
+            for block in read_entries(i):
+                if dense_out:
+                    dense_out.write(block)
+                elif checkpoints:
+                    checkpoints.scan_starts(unpack_offsets40(block), newline + 1)
+                else:
+                    # Line K*m starts after newline K*m - 1.
+                    n_entries = len(block) // DENSE_ENTRY_BYTES
+                    for j in range(-(newline + 1) % lines_per_chunk, n_entries, lines_per_chunk):
+                        entry = block[j * DENSE_ENTRY_BYTES:(j + 1) * DENSE_ENTRY_BYTES]
+                        offsets.append(int.from_bytes(entry, "little"))
+                newline += len(block) // DENSE_ENTRY_BYTES
+            line += part.num_newlines
+            line_start = base + part.last_newline + 1
+        base += part.size_bytes
+
+    # Handle final line without trailing \n
+    size_bytes = base
+    num_lines = line
+    if line_start < size_bytes:
+        num_lines += 1
+        if size_bytes - line_start > longest.threshold():
+            longest.push(line_length(read_range(line_start, size_bytes)), line, line_start)
+        if dense_out:
+            dense_out.write(pack_offsets40(array("Q", [size_bytes])))
+
+    if dense_out and size_bytes >= DENSE_MAX_BYTES:
+        raise ValueError("File is too large for a dense index.")
 
-    return IndexMeta(size_bytes=size_bytes, num_lines=num_lines, offsets=offsets)
\ No newline at end of file
+    if checkpoints:
+        return IndexMeta(size_bytes=size_bytes, num_lines=num_lines, offsets=checkpoints.offsets,
+                         longest=longest.entries(), checkpoint_lines=checkpoints.lines)
+    return IndexMeta(size_bytes=size_bytes, num_lines=num_lines, offsets=offsets, longest=longest.entries())
@@ -0,0 +1,85 @@
+"""In-memory cumulative line counts over the `files` table.
+
+Maps a global line number (over all lines of all files) to (filename, local line) with
+`bisect`, so a uniformly random line across the corpus costs O(log F) per request.
+"""
+import bisect
+import random
+import sqlite3
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from api.utils import db
+
+
+class LineCatalog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._db_path: Optional[str] = None
+        self._version: Optional[int] = None
+        self._names: List[str] = []
+        self._counts: List[int] = []
+        self._ends = array("Q")  # _ends[i] = total lines in files 0..i
+        self._pos: Dict[str, int] = {}
+
+    def _set_rows(self, rows: List[Tuple[str, int]]):
+        self._names = [name for name, _ in rows]
+        self._counts = [count for _, count in rows]
+        self._pos = {name: i for i, name in enumerate(self._names)}
+        self._ends = array("Q")
+        total = 0
+        for count in self._counts:
+            total += count
+            self._ends.append(total)
+
+    def _refresh(self, conn: sqlite3.Connection):
+        """Reloads from the DB only if another connection (or process) changed the corpus."""
+        version = db.get_corpus_version(conn)
+        if self._db_path == db.DB_PATH and self._version == version:
+            return
+        rows = conn.execute("SELECT filename, num_lines FROM files ORDER BY id").fetchall()
+        self._set_rows([(r["filename"], r["num_lines"]) for r in rows])
+        self._db_path, self._version = db.DB_PATH, version
+
+    def apply_upload(self, filename: str, num_lines: int, version: int):
+        """
+        Applies a committed upload without re-reading the table. A new file is appended in O(1);
+        a re-uploaded file moves to the end, which rebuilds the cumulative array once.
+        Falls back to a full reload on the next pick if uploads were missed.
+        """
+        with self._lock:
+            if self._db_path != db.DB_PATH or self._version != version - 1:
+                self._version = None
+                return
+            if filename in self._pos:
+                rows = [(n, c) for n, c in zip(self._names, self._counts) if n != filename]
+                self._set_rows(rows + [(filename, num_lines)])
+            else:
+                self._pos[filename] = len(self._names)
+                self._names.append(filename)
+                self._counts.append(num_lines)
+                self._ends.append((self._ends[-1] if self._ends else 0) + num_lines)
+            self._version = version
+
+    def pick(self, conn: sqlite3.Connection) -> Optional[Tuple[str, int]]:
+        """Returns (filename, 0-based line) chosen uniformly over all lines, or None if there are no lines."""
+        picks = self.pick_many(conn, 1)
+        return picks[0] if picks else None
+
+    def pick_many(self, conn: sqlite3.Connection, count: int) -> List[Tuple[str, int]]:
+        """`count` independent uniform picks (with replacement); empty if there are no lines."""
+        with self._lock:
+            self._refresh(conn)
+            total = self._ends[-1] if self._ends else 0
+            if total == 0:
+                return []
+            picks = []
+            for _ in range(count):
+                g = random.randrange(total)
+                i = bisect.bisect_right(self._ends, g)
+                picks.append((self._names[i], g - (self._ends[i - 1] if i else 0)))
+            return picks
+
+
+catalog = LineCatalog()
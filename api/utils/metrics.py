@@ -0,0 +1,239 @@
+"""In-process counters and histograms, exported in the Prometheus text format at GET /metrics.
+
+Metrics are defined once below and updated from the hot paths. With `[metrics] enabled = false`
+every update returns after a single flag check and timers are a shared no-op context manager.
+Values are per process: scans run in worker processes (`[longest_lines] scan_workers`) and
+other server processes are not included.
+"""
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from config import settings
+
+# Latency buckets in seconds, from 100 µs to 10 s.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NOOP = nullcontext()
+_registry: List["_Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """(name suffix, formatted labels, value) for every exported sample."""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{suffix}{labels} {_format_value(value)}" for suffix, labels, value in self.samples())
+        return lines
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, labels: Tuple[str, ...] = ()):
+        if not settings.METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: Tuple[str, ...] = ()) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield "", _format_labels(self.labelnames, labels), value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()):
+        if not settings.METRICS_ENABLED:
+            return
+        i = bisect_left(self.buckets, value)  # first bucket with value <= bound, or +Inf
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def time(self, labels: Tuple[str, ...] = ()):
+        """Context manager observing the seconds spent inside it (a no-op when metrics are disabled)."""
+        if not settings.METRICS_ENABLED:
+            return _NOOP
+        return _Timer(self, labels)
+
+    def count(self, labels: Tuple[str, ...] = ()) -> int:
+        with self._lock:
+            entry = self._values.get(labels)
+            return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                yield "_bucket", _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"'), cumulative
+            yield "_sum", _format_labels(self.labelnames, labels), total
+            yield "_count", _format_labels(self.labelnames, labels), cumulative
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_start")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, self._labels)
+        return False
+
+
+def metered(items: Iterable, reader: str, size: Callable = len) -> Iterator:
+    """
+    Yields from `items` while adding the number of items, their total `size` and the time spent
+    producing them (not consuming them) to the scan counters under `reader`. Counts are recorded
+    when the iteration ends, also if the consumer stops early. Returns `items` unchanged when
+    metrics are disabled.
+    """
+    if not settings.METRICS_ENABLED:
+        return iter(items)
+    return _metered(iter(items), reader, size)
+
+
+def _metered(it: Iterator, reader: str, size: Callable) -> Iterator:
+    n = total = 0
+    busy = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                busy += time.perf_counter() - start
+                return
+            busy += time.perf_counter() - start
+            n += 1
+            total += size(item)
+            yield item
+    finally:
+        labels = (reader,)
+        SCAN_ITEMS.inc(n, labels)
+        SCAN_BYTES.inc(total, labels)
+        SCAN_SECONDS.inc(busy, labels)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Clears every recorded value."""
+    for metric in _registry:
+        metric.clear()
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time spent handling a request.", ("endpoint", "method", "status")
+)
+DB_LOOKUP_SECONDS = Histogram(
+    "db_lookup_duration_seconds", "Time spent querying file metadata in SQLite.", ("query",)
+)
+INDEX_LOAD_SECONDS = Histogram(
+    "index_load_duration_seconds", "Time spent loading a chunk index, by index cache result.", ("cache",)
+)
+LINE_SEEK_SECONDS = Histogram(
+    "line_seek_duration_seconds",
+    "Time spent reading from a chunk start and skipping newlines up to the requested line.", ("source",)
+)
+LINE_SKIPPED_NEWLINES = Counter(
+    "line_skipped_newlines_total", "Newlines skipped to reach requested lines from their chunk start."
+)
+BLOCK_CACHE_LOOKUPS = Counter(
+    "block_cache_lookups_total", "Object blocks looked up in the block cache, by result.", ("result",)
+)
+BLOCK_CACHE_FETCHED_BYTES = Counter(
+    "block_cache_fetched_bytes_total", "Bytes read from storage to fill the block cache."
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "response_cache_lookups_total",
+    "Cacheable read requests, by result: not_modified (304), hit or miss of the response cache.", ("result",)
+)
+SCAN_ITEMS = Counter("scan_items_total", "Items (chunks or lines) produced by sequential reads.", ("reader",))
+SCAN_BYTES = Counter(
+    "scan_bytes_total", "Bytes (chunks) or characters (lines) produced by sequential reads.", ("reader",)
+)
+SCAN_SECONDS = Counter("scan_seconds_total", "Time spent producing sequential reads.", ("reader",))
+INGEST_SECONDS = Histogram(
+    "ingest_duration_seconds", "Time spent indexing an upload.", ("index_mode",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0),
+)
+INGEST_BYTES = Counter("ingest_bytes_total", "Bytes of uploads indexed.")
+INGEST_LINES = Counter("ingest_lines_total", "Lines of uploads indexed.")
@@ -0,0 +1,50 @@
+"""Per-process cache of read-only memory maps for local storage objects.
+
+Maps are keyed by absolute path and validated against the file's (inode, mtime, size)
+on every lookup, so a file replaced by a new upload is transparently re-mapped.
+"""
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from config import settings
+
+_lock = threading.Lock()
+# path -> ((st_ino, st_mtime_ns, st_size), mmap)
+_maps: "OrderedDict[str, Tuple[Tuple[int, int, int], mmap.mmap]]" = OrderedDict()
+
+
+def get_map(path: str) -> Optional[mmap.mmap]:
+    """
+    Returns a shared read-only map of `path`, or None for empty files (which cannot be mapped).
+    Raises FileNotFoundError if the file does not exist.
+    """
+    st = os.stat(path)
+    version = (st.st_ino, st.st_mtime_ns, st.st_size)
+    with _lock:
+        cached = _maps.get(path)
+        if cached is not None and cached[0] == version:
+            _maps.move_to_end(path)
+            return cached[1]
+        if cached is not None:
+            # File was replaced; drop our reference, readers still holding the old map keep it alive.
+            del _maps[path]
+        if st.st_size == 0:
+            return None
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _maps[path] = (version, mm)
+        while len(_maps) > settings.MMAP_CACHE_SIZE:
+            _maps.popitem(last=False)
+        return mm
+
+
+def invalidate(path: Optional[str] = None):
+    """Drops the cached map for `path`, or every cached map if no path is given."""
+    with _lock:
+        if path is None:
+            _maps.clear()
+        else:
+            _maps.pop(path, None)
@@ -0,0 +1,88 @@
+"""Line-aligned partitioning of an uploaded file for parallel whole-file passes.
+
+The stored index already holds exact line-start offsets, so a file can be cut into byte
+ranges that begin on a line boundary with a known global line number, without reading it.
+Any pass that can be expressed per range (see `reader.iter_chunks` / `reader.iter_lines` with
+`start=, end=`) can then run the ranges concurrently via `workers.map_ordered` and combine
+results in range order.
+"""
+import bisect
+import sqlite3
+from dataclasses import dataclass
+from typing import List, Optional
+
+from api.utils.indexing import DENSE_ENTRY_BYTES
+from api.utils.reader import load_index, read_range
+from api.utils.storage import Storage
+
+# Ranges smaller than this are not worth a separate worker.
+MIN_RANGE_BYTES = 8 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class LineRange:
+    start: int  # byte offset of the first line in the range (of its frame, for compressed files)
+    end: int  # byte offset just past the range (start of the next range, or stored file size)
+    first_line: int  # 0-based line number of the line starting at `start`
+
+
+def _dense_offset(storage: Storage, idx_key: str, line_no: int) -> int:
+    raw = read_range(storage, idx_key, line_no * DENSE_ENTRY_BYTES, DENSE_ENTRY_BYTES)
+    return int.from_bytes(raw, "little")
+
+
+def _dense_boundary(storage: Storage, idx_key: str, num_lines: int, target: int) -> int:
+    """Smallest line number whose start offset is >= target (binary search over the dense index)."""
+    lo, hi = 0, num_lines
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _dense_offset(storage, idx_key, mid) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def split_file(storage: Storage, file_meta: sqlite3.Row, parts: int,
+               min_range_bytes: Optional[int] = None) -> List[LineRange]:
+    """
+    Splits a file (a `files` row) into at most `parts` line-aligned ranges of roughly equal
+    size, each at least `min_range_bytes` (default `MIN_RANGE_BYTES`, except when the file is smaller). Cut points are
+    the nearest index entries at or after each equal-size target, so global line numbers
+    stay exact.
+    """
+    size = file_meta["size_bytes"]
+    if file_meta["compression"] != "none":
+        # Cut on frame boundaries of the stored object; its index ends with the stored size.
+        size = load_index(storage, file_meta["idx_key"], version=(file_meta["id"], file_meta["uploaded_at"]))[-1]
+    if min_range_bytes is None:
+        min_range_bytes = MIN_RANGE_BYTES
+    parts = max(1, min(parts, size // max(1, min_range_bytes)))
+    if parts == 1:
+        return [LineRange(0, size, 0)]
+
+    cuts = [(0, 0)]  # (byte offset, line number)
+    if file_meta["index_mode"] == "dense":
+        for j in range(1, parts):
+            line = _dense_boundary(storage, file_meta["idx_key"], file_meta["num_lines"], size * j // parts)
+            if line < file_meta["num_lines"]:
+                cuts.append((_dense_offset(storage, file_meta["idx_key"], line), line))
+    else:
+        index = load_index(storage, file_meta["idx_key"], version=(file_meta["id"], file_meta["uploaded_at"]))
+        if file_meta["index_mode"] == "adaptive":
+            # All checkpoint line numbers, then all their offsets.
+            n = len(index) // 2
+            offsets, first_lines = index[n:], index[:n]
+        else:
+            offsets, first_lines = index, range(0, len(index) * file_meta["lines_per_chunk"], file_meta["lines_per_chunk"])
+        for j in range(1, parts):
+            k = bisect.bisect_left(offsets, size * j // parts)
+            if k < len(offsets) and offsets[k] < size:
+                cuts.append((offsets[k], first_lines[k]))
+
+    ranges = []
+    cuts = sorted(set(cuts))
+    for (start, first_line), (end, _) in zip(cuts, cuts[1:] + [(size, None)]):
+        if end > start:
+            ranges.append(LineRange(start, end, first_line))
+    return ranges
@@ -1,49 +1,329 @@
-from typing import List, Optional
-import struct, os
+from array import array
+from typing import Hashable, Iterator, List, Optional, Tuple
+import json, os, sys, time, zlib
 
-from api.utils.storage import Storage
+from api.utils.storage import Storage, unpack_longest
+from api.utils import mmap_cache
+from api.utils.cache import ByteLRU
+from api.utils.metrics import (
+    BLOCK_CACHE_FETCHED_BYTES,
+    BLOCK_CACHE_LOOKUPS,
+    INDEX_LOAD_SECONDS,
+    LINE_SEEK_SECONDS,
+    LINE_SKIPPED_NEWLINES,
+    metered,
+)
+from api.utils.indexing import DENSE_ENTRY_BYTES, GZIP_WBITS, LENGTH_ENTRY_BYTES
+from config import settings
 
 CHUNK_BYTES = 64 * 1024
 
-def load_index(storage: Storage, idx_key: str) -> List[int]:
-    """Load binary .idx (8-byte little-endian offsets)."""
-    if storage.kind == "r2":
+# Decoded chunk indexes, shared by all requests in this process.
+_index_cache = ByteLRU(settings.INDEX_CACHE_MB * 1024 * 1024)
+
+# CHUNK_BYTES-aligned blocks of objects read without a memory map, keyed by
+# (storage location, object key, version, block number). See `_stream_from_offset`.
+_block_cache = ByteLRU(settings.BLOCK_CACHE_MB * 1024 * 1024)
+
+def _decode_offsets(data: bytes) -> array:
+    """Decode 8-byte little-endian offsets into a compact array('Q')."""
+    offsets = array("Q")
+    offsets.frombytes(data)
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    return offsets
+
+def _use_mmap(storage: Storage) -> bool:
+    return storage.kind == "local" and settings.USE_MMAP
+
+def read_range(storage: Storage, object_key: str, start: int, length: int,
+               version: Optional[Hashable] = None) -> bytes:
+    """
+    Reads `length` bytes of an object starting at `start` with a single bounded read, or from
+    the block cache when a `version` is given (see `_stream_from_offset`).
+    """
+    if length <= 0:
+        return b""
+    if version is not None and not _use_mmap(storage) and _block_cache.max_bytes:
+        return b"".join(_cached_stream(storage, object_key, start, start + length, version))
+    if storage.kind == "s3":
+        resp = storage.client.get_object(
+            Bucket=storage.bucket, Key=object_key, Range=f"bytes={start}-{start + length - 1}"
+        )
+        return resp["Body"].read()
+    path = os.path.join(storage.base_dir, object_key)
+    if _use_mmap(storage):
+        mm = mmap_cache.get_map(path)
+        return mm[start:start + length] if mm is not None else b""
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+def read_dense_line(storage: Storage, idx_key: str, object_key: str, line_no: int,
+                    version: Optional[Hashable] = None) -> str:
+    """
+    Returns line `line_no` (without trailing \\n) using a dense index: one 10-byte read for the
+    line's start and the next line's start, then one bounded read of the line itself.
+    """
+    raw = read_range(storage, idx_key, line_no * DENSE_ENTRY_BYTES, 2 * DENSE_ENTRY_BYTES, version)
+    start = int.from_bytes(raw[:DENSE_ENTRY_BYTES], "little")
+    end = int.from_bytes(raw[DENSE_ENTRY_BYTES:], "little")
+    data = read_range(storage, object_key, start, end - start, version)
+    if data.endswith(b"\n"):
+        data = data[:-1]
+    return data.decode("utf-8", "replace")
+
+def load_index(storage: Storage, idx_key: str, version: Optional[Hashable] = None) -> array:
+    """
+    Load binary .idx (8-byte little-endian offsets) as an array('Q').
+
+    Decoded indexes are kept in a per-process LRU bounded by `index_cache_mb`, keyed by
+    storage location, `idx_key` and `version` (an upload id from the `files` row). Without a
+    version, local indexes are versioned by their file stat and remote ones are not cached.
+    """
+    started = time.perf_counter()
+    if storage.kind == "s3":
+        location = storage.bucket
+    else:
+        location = storage.base_dir
+        path = os.path.join(storage.base_dir, idx_key)
+        if version is None:
+            st = os.stat(path)
+            version = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cache_key = (location, idx_key, version)
+    if version is not None:
+        cached = _index_cache.get(cache_key)
+        if cached is not None:
+            INDEX_LOAD_SECONDS.observe(time.perf_counter() - started, ("hit",))
+            return cached
+
+    if storage.kind == "s3":
         obj = storage.client.get_object(Bucket=storage.bucket, Key=idx_key)
         data = obj["Body"].read()
     else:
-        path = os.path.join(storage.base_dir, idx_key)
         with open(path, "rb") as f:
             data = f.read()
-    out = []
-    for i in range(0, len(data), 8):
-        (off,) = struct.unpack("<Q", data[i:i+8])
-        out.append(off)
-    return out
+    offsets = _decode_offsets(data)
+    if version is not None:
+        _index_cache.put(cache_key, offsets, len(data))
+    INDEX_LOAD_SECONDS.observe(time.perf_counter() - started, ("miss",))
+    return offsets
+
+def load_longest(storage: Storage, longest_key: str) -> Optional[List[Tuple[int, int, int]]]:
+    """Load binary .longest sidecar ((length, line_no, byte_offset) as 3x 8-byte little-endian).
+    Returns None if the sidecar does not exist (files uploaded before it was introduced)."""
+    if storage.kind == "s3":
+        try:
+            obj = storage.client.get_object(Bucket=storage.bucket, Key=longest_key)
+        except storage.client.exceptions.NoSuchKey:
+            return None
+        data = obj["Body"].read()
+    else:
+        path = os.path.join(storage.base_dir, longest_key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+    return unpack_longest(data)
+
+def load_stats(storage: Storage, stats_key: str) -> Optional[dict]:
+    """Load a .stats sidecar (line-length summary as JSON). Returns None if it does not exist."""
+    if storage.kind == "s3":
+        try:
+            obj = storage.client.get_object(Bucket=storage.bucket, Key=stats_key)
+        except storage.client.exceptions.NoSuchKey:
+            return None
+        return json.loads(obj["Body"].read())
+    path = os.path.join(storage.base_dir, stats_key)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return json.loads(f.read())
+
+def iter_lengths(storage: Storage, lengths_key: str, version: Optional[Hashable] = None) -> Iterator[array]:
+    """The line-length column (little-endian uint32 per line) as consecutive array('I') blocks."""
+    carry = b""
+    for chunk in iter_chunks(storage, lengths_key, version=version):
+        if carry:
+            chunk = carry + chunk
+        cut = len(chunk) - len(chunk) % LENGTH_ENTRY_BYTES
+        carry = chunk[cut:]
+        block = array("I")
+        block.frombytes(chunk[:cut])
+        if sys.byteorder == "big":
+            block.byteswap()
+        yield block
+
+def _stream_from_offset(storage: Storage, object_key: str, start: int, end: Optional[int] = None,
+                        version: Optional[Hashable] = None):
+    """
+    Bytes of an object from `start` up to `end` (or EOF), in pieces of at most CHUNK_BYTES.
+
+    With a `version` (an upload id from the `files` row, which changes whenever the object
+    may have been rewritten), reads go through the per-process block cache bounded by
+    `[storage] block_cache_mb`; without one, or with a zero budget, storage is read directly.
+    """
+    if end is not None and end <= start:
+        return
+    if version is not None and _block_cache.max_bytes:
+        yield from _cached_stream(storage, object_key, start, end, version)
+    else:
+        yield from _fetch(storage, object_key, start, end)
 
-def _stream_from_offset(storage: Storage, object_key: str, start: int):
-    if storage.kind == "r2":
-        resp = storage.client.get_object(Bucket=storage.bucket, Key=object_key, Range=f"bytes={start}-")
+def _fetch(storage: Storage, object_key: str, start: int, end: Optional[int] = None):
+    if storage.kind == "s3":
+        byte_range = f"bytes={start}-{end - 1}" if end is not None else f"bytes={start}-"
+        resp = storage.client.get_object(Bucket=storage.bucket, Key=object_key, Range=byte_range)
         body = resp["Body"]
-        while True:
-            chunk = body.read(CHUNK_BYTES)
-            if not chunk:
-                break
-            yield chunk
+        try:
+            while True:
+                chunk = body.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()  # returns the connection to the pool, also when the reader stops early
     else:
         path = os.path.join(storage.base_dir, object_key)
+        remaining = end - start if end is not None else None
         with open(path, "rb") as f:
             f.seek(start)
-            while True:
-                chunk = f.read(CHUNK_BYTES)
+            while remaining is None or remaining > 0:
+                chunk = f.read(CHUNK_BYTES if remaining is None else min(CHUNK_BYTES, remaining))
                 if not chunk:
                     break
+                if remaining is not None:
+                    remaining -= len(chunk)
                 yield chunk
 
-def extract_line_from_offset(storage: Storage, object_key: str, start_offset: int, advance_newlines: int) -> str:
-    """Skip `advance_newlines` line breaks from start_offset, then return that line (without trailing \\n)."""
+def _cached_stream(storage: Storage, object_key: str, start: int, end: Optional[int], version: Hashable):
+    """
+    `_stream_from_offset` through the block cache. Cached blocks are served from memory; at the
+    first missing block, everything from there to `end` (rounded up to a whole block) is fetched
+    with one read and stored block by block as it streams in. A block shorter than CHUNK_BYTES
+    is the object's last one.
+    """
+    location = storage.bucket if storage.kind == "s3" else storage.base_dir
+    block = start // CHUNK_BYTES
+    while end is None or block * CHUNK_BYTES < end:
+        data = _block_cache.get((location, object_key, version, block))
+        if data is None:
+            BLOCK_CACHE_LOOKUPS.inc(labels=("miss",))
+            yield from _fill_blocks(storage, object_key, start, end, version, location, block)
+            return
+        BLOCK_CACHE_LOOKUPS.inc(labels=("hit",))
+        piece = _block_slice(data, block * CHUNK_BYTES, start, end)
+        if piece:
+            yield piece
+        if len(data) < CHUNK_BYTES:
+            return
+        block += 1
+
+def _fill_blocks(storage: Storage, object_key: str, start: int, end: Optional[int], version: Hashable,
+                 location: str, block: int):
+    fetch_end = None if end is None else -(-end // CHUNK_BYTES) * CHUNK_BYTES
+    buf = bytearray()
+    for chunk in _fetch(storage, object_key, block * CHUNK_BYTES, fetch_end):
+        BLOCK_CACHE_FETCHED_BYTES.inc(len(chunk))
+        buf += chunk
+        while len(buf) >= CHUNK_BYTES:
+            data = bytes(buf[:CHUNK_BYTES])
+            del buf[:CHUNK_BYTES]
+            _block_cache.put((location, object_key, version, block), data, len(data))
+            piece = _block_slice(data, block * CHUNK_BYTES, start, end)
+            if piece:
+                yield piece
+            block += 1
+    if fetch_end is None or block * CHUNK_BYTES < fetch_end:
+        # The read stopped short of the requested end: this is the last (possibly empty) block.
+        data = bytes(buf)
+        _block_cache.put((location, object_key, version, block), data, len(data))
+        piece = _block_slice(data, block * CHUNK_BYTES, start, end)
+        if piece:
+            yield piece
+
+def _block_slice(data: bytes, block_start: int, start: int, end: Optional[int]) -> bytes:
+    """The part of a block starting at `block_start` that lies in [start, end)."""
+    lo = max(0, start - block_start)
+    hi = len(data) if end is None else min(len(data), end - block_start)
+    if lo == 0 and hi == len(data):
+        return data
+    return data[lo:hi]
+
+def block_cache_stats() -> dict:
+    """Entries, bytes, budget, hits and misses of this process's block cache."""
+    return _block_cache.stats()
+
+def iter_chunks(storage: Storage, object_key: str, start: int = 0, end: Optional[int] = None,
+                compression: str = "none", version: Optional[Hashable] = None):
+    """
+    Raw bytes of the object from `start` up to `end` (or EOF), in pieces of at most CHUNK_BYTES.
+    For a compressed object, `start`/`end` are stored offsets on frame boundaries and the
+    decompressed bytes are yielded, frame by frame. Counted in the `chunks` scan metrics.
+    `version` enables the block cache for reads without a memory map (see `_stream_from_offset`).
+    """
+    return metered(_iter_chunks(storage, object_key, start, end, compression, version), "chunks")
+
+def _iter_chunks(storage: Storage, object_key: str, start: int = 0, end: Optional[int] = None,
+                 compression: str = "none", version: Optional[Hashable] = None):
+    if compression != "none":
+        yield from _inflate_frames(_iter_chunks(storage, object_key, start, end, version=version))
+        return
+    if _use_mmap(storage):
+        mm = mmap_cache.get_map(os.path.join(storage.base_dir, object_key))
+        if mm is None:
+            return
+        stop = len(mm) if end is None else min(end, len(mm))
+        for pos in range(start, stop, CHUNK_BYTES):
+            yield mm[pos:min(pos + CHUNK_BYTES, stop)]
+        return
+    yield from _stream_from_offset(storage, object_key, start, end, version)
+
+def _line_in_buffer(buf, start_offset: int, advance_newlines: int) -> str:
+    """The line `advance_newlines` line breaks after start_offset in an in-memory buffer (bytes or mmap)."""
+    pos = start_offset
+    for _ in range(advance_newlines):
+        j = buf.find(b"\n", pos)
+        if j == -1:
+            return ""
+        pos = j + 1
+    end = buf.find(b"\n", pos)
+    if end == -1:
+        end = len(buf)
+    return buf[pos:end].decode("utf-8", "replace")
+
+def _extract_line_mmap(path: str, start_offset: int, advance_newlines: int) -> str:
+    """mmap variant of `extract_line_from_offset`: only the target line is copied out of the map."""
+    mm = mmap_cache.get_map(path)
+    if mm is None:
+        return ""
+    return _line_in_buffer(mm, start_offset, advance_newlines)
+
+def extract_line_from_offset(storage: Storage, object_key: str, start_offset: int, advance_newlines: int,
+                             end: Optional[int] = None, version: Optional[Hashable] = None) -> str:
+    """
+    Skip `advance_newlines` line breaks from start_offset, then return that line (without trailing \\n).
+    `end` is the offset of the next index entry, if known: on object storage, the whole chunk
+    [start_offset, end) is then fetched with one ranged GET instead of streamed.
+    `version` enables the block cache (see `_stream_from_offset`).
+    """
+    LINE_SKIPPED_NEWLINES.inc(advance_newlines)
+    if _use_mmap(storage):
+        with LINE_SEEK_SECONDS.time(("mmap",)):
+            return _extract_line_mmap(os.path.join(storage.base_dir, object_key), start_offset, advance_newlines)
+    if storage.kind == "s3" and end is not None:
+        with LINE_SEEK_SECONDS.time(("range",)):
+            return _line_in_buffer(
+                read_range(storage, object_key, start_offset, end - start_offset, version), 0, advance_newlines
+            )
+    with LINE_SEEK_SECONDS.time(("stream",)):
+        return _extract_line_stream(storage, object_key, start_offset, advance_newlines, version)
+
+def _extract_line_stream(storage: Storage, object_key: str, start_offset: int, advance_newlines: int,
+                         version: Optional[Hashable] = None) -> str:
     buf = bytearray()
     pending = advance_newlines
-    for chunk in _stream_from_offset(storage, object_key, start_offset):
+    for chunk in _stream_from_offset(storage, object_key, start_offset, version=version):
         i = 0
         while i < len(chunk):
             if pending > 0:
@@ -66,38 +346,148 @@ def extract_line_from_offset(storage: Storage, object_key: str, start_offset: in
     # reached EOF without newline
     return buf.decode("utf-8", "replace")
 
-def iter_lines(storage: Storage, object_key: str):
+def _lines_in_buffer(buf, start_offset: int, advances: List[int]) -> List[str]:
+    """Batch form of `_line_in_buffer` for strictly ascending `advances`."""
+    size = len(buf)
+    out = []
+    pos, line = start_offset, 0
+    for target in advances:
+        while line < target and pos <= size:
+            j = buf.find(b"\n", pos)
+            pos = j + 1 if j != -1 else size + 1
+            line += 1
+        if pos > size:
+            out.append("")
+            continue
+        end = buf.find(b"\n", pos)
+        if end == -1:
+            end = size
+        out.append(buf[pos:end].decode("utf-8", "replace"))
+        pos, line = end + 1, target + 1
+    return out
+
+def _extract_lines_mmap(path: str, start_offset: int, advances: List[int]) -> List[str]:
+    """mmap variant of `extract_lines_from_offset`."""
+    mm = mmap_cache.get_map(path)
+    if mm is None:
+        return [""] * len(advances)
+    return _lines_in_buffer(mm, start_offset, advances)
+
+def extract_lines_from_offset(storage: Storage, object_key: str, start_offset: int, advances: List[int],
+                              end: Optional[int] = None, version: Optional[Hashable] = None) -> List[str]:
+    """
+    Batch form of `extract_line_from_offset`: returns the lines `advances` newlines past start_offset,
+    for strictly ascending `advances`, in one forward pass over the object.
+    """
+    if _use_mmap(storage):
+        return _extract_lines_mmap(os.path.join(storage.base_dir, object_key), start_offset, advances)
+    if storage.kind == "s3" and end is not None:
+        return _lines_in_buffer(read_range(storage, object_key, start_offset, end - start_offset, version), 0, advances)
+    out: List[str] = []
+    buf = bytearray()
+    line = 0
+    ti = 0
+    for chunk in _stream_from_offset(storage, object_key, start_offset, version=version):
+        i = 0
+        while i < len(chunk) and ti < len(advances):
+            j = chunk.find(b"\n", i)
+            if line < advances[ti]:
+                # skipping towards the next wanted line
+                if j == -1:
+                    break
+                line += 1
+                i = j + 1
+            elif j == -1:
+                buf += chunk[i:]
+                break
+            else:
+                buf += chunk[i:j]
+                out.append(buf.decode("utf-8", "replace"))
+                buf.clear()
+                line += 1
+                ti += 1
+                i = j + 1
+        if ti == len(advances):
+            return out
+    # reached EOF: a line being captured ends here, anything further does not exist
+    if line == advances[ti]:
+        out.append(buf.decode("utf-8", "replace"))
+        ti += 1
+    return out + [""] * (len(advances) - ti)
+
+def read_frame(storage: Storage, object_key: str, start: int, end: int, version: Optional[Hashable] = None) -> bytes:
+    """Decompressed contents of the gzip frame stored at [start, end) of a compressed object."""
+    if end <= start:
+        return b""
+    return zlib.decompress(read_range(storage, object_key, start, end - start, version), GZIP_WBITS)
+
+def extract_line_from_frame(storage: Storage, object_key: str, start: int, end: int, advance_newlines: int,
+                            version: Optional[Hashable] = None) -> str:
+    """Compressed counterpart of `extract_line_from_offset`: decompresses the one frame at [start, end)."""
+    LINE_SKIPPED_NEWLINES.inc(advance_newlines)
+    with LINE_SEEK_SECONDS.time(("frame",)):
+        return _line_in_buffer(read_frame(storage, object_key, start, end, version), 0, advance_newlines)
+
+def extract_lines_from_frame(storage: Storage, object_key: str, start: int, end: int, advances: List[int],
+                             version: Optional[Hashable] = None) -> List[str]:
+    """Compressed counterpart of `extract_lines_from_offset`."""
+    return _lines_in_buffer(read_frame(storage, object_key, start, end, version), 0, advances)
+
+def _inflate_frames(chunks) -> Iterator[bytes]:
+    """Decompresses a stream of consecutive gzip frames, yielding data as it is produced."""
+    inflater = zlib.decompressobj(GZIP_WBITS)
+    for chunk in chunks:
+        while chunk:
+            data = inflater.decompress(chunk)
+            if data:
+                yield data
+            if not inflater.eof:
+                break
+            chunk = inflater.unused_data
+            inflater = zlib.decompressobj(GZIP_WBITS)
+
+def iter_lines(storage: Storage, object_key: str, start: int = 0, end: Optional[int] = None,
+               compression: str = "none", version: Optional[Hashable] = None):
     """
-    Stream lines from the beginning of the object (local or R2).
+    Stream lines from the beginning of the object (local or S3), or from the line-aligned
+    byte range [start, end) of it (see `api.utils.partition`).
     Yields decoded UTF-8 strings without trailing newline.
+    Compressed objects are decompressed frame by frame (see `iter_chunks`).
+    Counted in the `lines` scan metrics (lines and characters).
+    `version` enables the block cache for reads without a memory map (see `_stream_from_offset`).
     """
-    if storage.kind == "r2":
-        resp = storage.client.get_object(Bucket=storage.bucket, Key=object_key, Range="bytes=0-")
-        body = resp["Body"]
+    return metered(_iter_lines(storage, object_key, start, end, compression, version), "lines")
+
+def _iter_lines(storage: Storage, object_key: str, start: int = 0, end: Optional[int] = None,
+                compression: str = "none", version: Optional[Hashable] = None):
+    if compression != "none":
         rem = b""
-        while True:
-            chunk = body.read(CHUNK_BYTES)
-            if not chunk:
-                break
-            data = rem + chunk
-            parts = data.split(b"\n")
+        for data in _iter_chunks(storage, object_key, start, end, compression=compression, version=version):
+            parts = (rem + data).split(b"\n")
             for line in parts[:-1]:
                 yield line.decode("utf-8", "replace")
             rem = parts[-1]
         if rem:
             yield rem.decode("utf-8", "replace")
+    elif _use_mmap(storage):
+        mm = mmap_cache.get_map(os.path.join(storage.base_dir, object_key))
+        if mm is None:
+            return
+        size = len(mm) if end is None else min(end, len(mm))
+        pos = start
+        while pos < size:
+            j = mm.find(b"\n", pos, size)
+            if j == -1:
+                j = size
+            yield mm[pos:j].decode("utf-8", "replace")
+            pos = j + 1
     else:
-        path = os.path.join(storage.base_dir, object_key)
         rem = b""
-        with open(path, "rb") as f:
-            while True:
-                chunk = f.read(CHUNK_BYTES)
-                if not chunk:
-                    break
-                data = rem + chunk
-                parts = data.split(b"\n")
-                for line in parts[:-1]:
-                    yield line.decode("utf-8", "replace")
-                rem = parts[-1]
+        for chunk in _stream_from_offset(storage, object_key, start, end, version):
+            data = rem + chunk
+            parts = data.split(b"\n")
+            for line in parts[:-1]:
+                yield line.decode("utf-8", "replace")
+            rem = parts[-1]
         if rem:
             yield rem.decode("utf-8", "replace")
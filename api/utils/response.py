@@ -1,5 +1,8 @@
-from typing import Optional, Union, List, Dict
-from flask import Request
+import hashlib
+from datetime import datetime
+from functools import partial
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+from flask import Request, Response, current_app
 
 def negotiate_content_type(req: Request) -> str:
     """
@@ -13,25 +16,135 @@ def negotiate_content_type(req: Request) -> str:
         return "application/xml"
     return "application/json"
 
-def to_xml(obj: Union[Dict, List[Dict]], root="response", item_name="item") -> str:
+def make_etag(*parts) -> str:
+    """A strong entity tag for the representation identified by `parts` (version, query, content type)."""
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=12).hexdigest()
+
+def is_not_modified(req: Request, etag: str, last_modified: Optional[datetime]) -> bool:
     """
-    Serializes a dictionary or a list of dictionaries to an XML string.
+    Whether a GET may be answered with 304: If-None-Match matches `etag`, or, only when that header
+    is absent, nothing changed since If-Modified-Since (RFC 9110, section 13.2.2).
+    """
+    if "If-None-Match" in req.headers:
+        return req.if_none_match.contains_weak(etag)
+    since = req.if_modified_since
+    return since is not None and last_modified is not None and last_modified.replace(microsecond=0) <= since
+
+def with_validators(resp: Response, etag: str, last_modified: Optional[datetime]) -> Response:
+    """Adds ETag/Last-Modified and asks clients to revalidate (the body varies with Accept)."""
+    resp.set_etag(etag)
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    resp.vary.add("Accept")
+    resp.cache_control.no_cache = True
+    return resp
+
+# Responses are streamed in chunks of about this many characters, so time to first byte and
+# buffered memory do not grow with the number of items.
+STREAM_CHUNK_CHARS = 64 * 1024
+
+def escape_xml(value: Any) -> str:
+    """
+    Escapes the five XML special characters. Each check is a C-level scan and only characters
+    that occur are replaced, so the common case (no special characters) does not copy the text.
     """
-    def esc(x: any) -> str:
-        return str(x).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;").replace("'", "&apos;")
+    s = value if isinstance(value, str) else str(value)
+    if "&" in s:
+        s = s.replace("&", "&amp;")
+    if "<" in s:
+        s = s.replace("<", "&lt;")
+    if ">" in s:
+        s = s.replace(">", "&gt;")
+    if '"' in s:
+        s = s.replace('"', "&quot;")
+    if "'" in s:
+        s = s.replace("'", "&apos;")
+    return s
 
-    def dict_to_xml_parts(d: Dict, indent: str) -> List[str]:
-        parts = []
+def _xml_lines(obj: Union[Dict, Iterable[Dict]], root: str, item_name: str) -> Iterator[str]:
+    def dict_to_xml_lines(d: Dict, indent: str) -> Iterator[str]:
         for k, v in d.items():
-            parts.append(f"{indent}<{k}/>" if v is None else f"{indent}<{k}>{esc(v)}</{k}>")
-        return parts
+            if isinstance(v, dict):
+                # Nested objects become child elements
+                yield f"{indent}<{k}>"
+                yield from dict_to_xml_lines(v, indent + "  ")
+                yield f"{indent}</{k}>"
+            elif isinstance(v, list):
+                yield f"{indent}<{k}>"
+                for item in v:
+                    yield f"{indent}  <{item_name}>"
+                    yield from dict_to_xml_lines(item, indent + "    ")
+                    yield f"{indent}  </{item_name}>"
+                yield f"{indent}</{k}>"
+            else:
+                yield f"{indent}<{k}/>" if v is None else f"{indent}<{k}>{escape_xml(v)}</{k}>"
 
-    parts = [f"<{root}>"]
-    if isinstance(obj, list):
+    yield f"<{root}>"
+    if isinstance(obj, dict):
+        yield from dict_to_xml_lines(obj, indent="  ")
+    else:
         for item_dict in obj:
-            parts.extend([f"  <{item_name}>", *dict_to_xml_parts(item_dict, indent="    "), f"  </{item_name}>"])
-    elif isinstance(obj, dict):
-        parts.extend(dict_to_xml_parts(obj, indent="  "))
+            yield f"  <{item_name}>"
+            yield from dict_to_xml_lines(item_dict, indent="    ")
+            yield f"  </{item_name}>"
+    yield f"</{root}>"
+
+def to_xml(obj: Union[Dict, List[Dict]], root="response", item_name="item") -> str:
+    """
+    Serializes a dictionary or a list of dictionaries to an XML string.
+    Nested dictionaries become child elements; nested lists of dictionaries hold one
+    `item_name` element per entry.
+    """
+    return "\n".join(_xml_lines(obj, root, item_name))
+
+def iter_xml(obj: Union[Dict, Iterable[Dict]], root="response", item_name="item") -> Iterator[str]:
+    """`to_xml` as a sequence of fragments; `obj` may be any iterable of dictionaries."""
+    lines = _xml_lines(obj, root, item_name)
+    yield next(lines)
+    for line in lines:
+        yield "\n" + line
+
+def iter_json(items: Iterable) -> Iterator[str]:
+    """
+    A JSON array of `items` as a sequence of fragments, encoded one item at a time with the
+    app's JSON provider, so it matches `jsonify` (compact, sorted keys, trailing newline).
+    """
+    dumps = partial(current_app.json.dumps, separators=(",", ":"))  # bound now: needs the app context
+
+    def fragments() -> Iterator[str]:
+        sep = "["
+        for item in items:
+            yield sep + dumps(item)
+            sep = ","
+        yield "[]\n" if sep == "[" else "]\n"
+
+    return fragments()
+
+def iter_text(lines: Iterable[str]) -> Iterator[str]:
+    """`lines` joined by newlines, as a sequence of fragments."""
+    sep = ""
+    for line in lines:
+        yield sep + line
+        sep = "\n"
+
+def iter_chunks(fragments: Iterable[str], chunk_chars: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Groups string fragments into UTF-8 chunks of about `chunk_chars` (default `STREAM_CHUNK_CHARS`),
+    to avoid one write per fragment.
+    """
+    chunk_chars = chunk_chars or STREAM_CHUNK_CHARS
+    buf: List[str] = []
+    size = 0
+    for fragment in fragments:
+        buf.append(fragment)
+        size += len(fragment)
+        if size >= chunk_chars:
+            yield "".join(buf).encode("utf-8")
+            buf = []
+            size = 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
 
-    parts.append(f"</{root}>")
-    return "\n".join(parts)
+def stream_response(fragments: Iterable[str], mimetype: str) -> Response:
+    """A streamed response whose body is `fragments`, sent in chunks as they are produced."""
+    return Response(iter_chunks(fragments), mimetype=mimetype)
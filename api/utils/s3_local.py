@@ -0,0 +1,173 @@
+"""Filesystem-backed stand-in for an S3 client, for running the S3 storage backend offline.
+
+`LocalS3Client` implements the subset of the boto3 S3 client API the app uses (ranged
+`get_object`, `put_object`, `delete_object`, `head_object` and the multipart upload calls)
+on a directory: each bucket is a subdirectory (the empty bucket name is the directory itself)
+and each key a file in it. Requests are counted
+in `calls` so tests can check how storage is accessed. Select it with `[storage] backend = s3-local`.
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import Counter
+from typing import Optional
+
+_RANGE = re.compile(r"bytes=(\d+)-(\d*)$")
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class NoSuchUpload(Exception):
+    pass
+
+
+class _Exceptions:
+    NoSuchKey = NoSuchKey
+    NoSuchUpload = NoSuchUpload
+
+
+class _Body:
+    """Streaming body of a `get_object` response, reading at most `length` bytes from `offset`."""
+
+    def __init__(self, path: str, offset: int, length: int):
+        self._f = open(path, "rb")
+        self._f.seek(offset)
+        self._remaining = length
+
+    def read(self, n: Optional[int] = None) -> bytes:
+        if self._remaining <= 0:
+            return b""
+        n = self._remaining if n is None or n < 0 else min(n, self._remaining)
+        data = self._f.read(n)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._f.close()
+
+    def __del__(self):
+        try:
+            self._f.close()
+        except Exception:
+            pass
+
+
+class LocalS3Client:
+    exceptions = _Exceptions
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.calls: Counter = Counter()  # operation name -> number of requests
+        self.ranged_gets = 0
+        self._lock = threading.Lock()
+
+    def _count(self, op: str):
+        with self._lock:
+            self.calls[op] += 1
+
+    def _path(self, bucket: str, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.join(os.path.normpath(os.path.join(self.root, bucket)), "")):
+            raise ValueError(f"Invalid key: {key}")
+        return path
+
+    def _write(self, path: str, writer):
+        """Writes an object atomically, so concurrent readers see the old or the new content."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".partial")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    # ── objects ──
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None) -> dict:
+        self._count("get_object")
+        path = self._path(Bucket, Key)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            raise NoSuchKey(Key) from None
+        start, end = 0, size - 1
+        if Range is not None:
+            m = _RANGE.match(Range)
+            if not m:
+                raise ValueError(f"Unsupported range: {Range}")
+            with self._lock:
+                self.ranged_gets += 1
+            start = int(m.group(1))
+            if m.group(2):
+                end = min(end, int(m.group(2)))
+        length = max(0, end - start + 1)
+        return {"Body": _Body(path, start, length), "ContentLength": length}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes) -> dict:
+        self._count("put_object")
+        data = Body if isinstance(Body, (bytes, bytearray)) else Body.read()
+        self._write(self._path(Bucket, Key), lambda f: f.write(data))
+        return {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        self._count("head_object")
+        try:
+            return {"ContentLength": os.path.getsize(self._path(Bucket, Key))}
+        except FileNotFoundError:
+            raise NoSuchKey(Key) from None
+
+    def delete_object(self, Bucket: str, Key: str) -> dict:
+        self._count("delete_object")
+        try:
+            os.unlink(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+    # ── multipart uploads ──
+    def _upload_dir(self, bucket: str, upload_id: str) -> str:
+        return os.path.join(self.root, ".multipart", bucket, os.path.basename(upload_id))
+
+    def create_multipart_upload(self, Bucket: str, Key: str) -> dict:
+        self._count("create_multipart_upload")
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._upload_dir(Bucket, upload_id))
+        return {"UploadId": upload_id, "Key": Key}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes) -> dict:
+        self._count("upload_part")
+        upload_dir = self._upload_dir(Bucket, UploadId)
+        if not os.path.isdir(upload_dir):
+            raise NoSuchUpload(UploadId)
+        data = Body if isinstance(Body, (bytes, bytearray)) else Body.read()
+        with open(os.path.join(upload_dir, f"{PartNumber:05d}"), "wb") as f:
+            f.write(data)
+        return {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict) -> dict:
+        self._count("complete_multipart_upload")
+        upload_dir = self._upload_dir(Bucket, UploadId)
+        if not os.path.isdir(upload_dir):
+            raise NoSuchUpload(UploadId)
+
+        def concatenate(out):
+            for part in sorted(MultipartUpload["Parts"], key=lambda p: p["PartNumber"]):
+                with open(os.path.join(upload_dir, f"{part['PartNumber']:05d}"), "rb") as src:
+                    shutil.copyfileobj(src, out, 1024 * 1024)
+
+        self._write(self._path(Bucket, Key), concatenate)
+        shutil.rmtree(upload_dir)
+        return {"Key": Key}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str) -> dict:
+        self._count("abort_multipart_upload")
+        shutil.rmtree(self._upload_dir(Bucket, UploadId), ignore_errors=True)
+        return {}
@@ -1,7 +1,60 @@
-"""Storage abstraction: local filesystem."""
+"""Storage abstraction: local filesystem, or an S3-compatible object store (`S3Storage`)."""
+import errno
+import json
 import os
+import shutil
 import struct
-from typing import Optional, List
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Tuple
+
+from config import settings
+
+_client_lock = threading.Lock()
+_s3_client = None  # shared by every S3Storage of this process, see `_get_s3_client`
+
+
+def pack_longest(entries: List[Tuple[int, int, int]]) -> bytes:
+    """(length, line_no, byte_offset) records as three little-endian unsigned long longs (24 bytes each)."""
+    return b"".join(struct.pack("<QQQ", *entry) for entry in entries)
+
+
+def unpack_longest(data: bytes) -> List[Tuple[int, int, int]]:
+    return [struct.unpack_from("<QQQ", data, i) for i in range(0, len(data), 24)]
+
+
+def _copy_file(src, dst):
+    """
+    Copies `src` to `dst` (both binary file objects at offset 0) inside the kernel with
+    `os.copy_file_range` or `os.sendfile` where available, else through user-space buffers.
+    """
+    size = os.fstat(src.fileno()).st_size
+    for kernel_copy in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+        if kernel_copy is None:
+            continue
+        copied = 0
+        try:
+            while copied < size:
+                if kernel_copy is os.sendfile:
+                    n = kernel_copy(dst.fileno(), src.fileno(), copied, size - copied)
+                else:
+                    n = kernel_copy(src.fileno(), dst.fileno(), size - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            # Unsupported for this pair of files; start over with the next method.
+            os.lseek(dst.fileno(), 0, os.SEEK_SET)
+            os.ftruncate(dst.fileno(), 0)
+            os.lseek(src.fileno(), 0, os.SEEK_SET)
+            continue
+        if copied == size:
+            return
+        os.lseek(src.fileno(), copied, os.SEEK_SET)
+        os.lseek(dst.fileno(), copied, os.SEEK_SET)
+        break
+    shutil.copyfileobj(src, dst, 1024 * 1024)
 
 
 class Storage:
@@ -13,20 +66,71 @@ class Storage:
 
     @classmethod
     def from_env(cls) -> "Storage":
-        """Creates a Storage instance. In this version, it always uses local storage."""
+        """
+        Creates the Storage configured by `[storage] backend`: local disk, or an S3 bucket.
+        Raises RuntimeError if `backend = s3` has no `s3_bucket`.
+        """
+        if settings.STORAGE_BACKEND == "s3" and not settings.S3_BUCKET:
+            raise RuntimeError("[storage] backend = s3 requires s3_bucket to be set.")
+        if settings.STORAGE_BACKEND in ("s3", "s3-local"):
+            return S3Storage(_get_s3_client(), settings.S3_BUCKET)
         return cls()
 
+    # ── staged writes ──
+    def new_staging_file(self, suffix: str = "") -> str:
+        """
+        Creates an empty file under `<base_dir>/.staging` and returns its path. Content written
+        there is on the same filesystem as its final location, so `commit_staged` is a rename.
+        """
+        staging_dir = os.path.join(self.base_dir, ".staging")
+        os.makedirs(staging_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=staging_dir, suffix=suffix)
+        os.close(fd)
+        return path
+
+    def commit_staged(self, staged_path: str, object_key: str):
+        """
+        Moves a staged file into place as `object_key` with an atomic `os.replace`; the staged
+        path no longer exists afterwards. Falls back to a copy if the rename crosses filesystems.
+        """
+        dest = os.path.join(self.base_dir, os.path.normpath(object_key))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        try:
+            os.replace(staged_path, dest)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            self.upload_file(staged_path, object_key)
+            os.unlink(staged_path)
+
     # ── file upload ──
     def upload_file(self, local_path: str, object_key: str):
-        """Copies a file from a local path to the storage destination."""
+        """
+        Copies a file from a local path to the storage destination.
+        The copy is written next to the destination and swapped in with `os.replace`, so an
+        existing object is never truncated under readers that still have it memory-mapped.
+        """
         dest = os.path.join(self.base_dir, os.path.normpath(object_key))
         os.makedirs(os.path.dirname(dest), exist_ok=True)
-        with open(local_path, "rb") as src, open(dest, "wb") as dst:
-            while True:
-                b = src.read(64 * 1024)
-                if not b:
-                    break
-                dst.write(b)
+        fd, partial = tempfile.mkstemp(dir=os.path.dirname(dest), suffix=".partial")
+        try:
+            with open(local_path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                _copy_file(src, dst)
+            os.replace(partial, dest)
+        except BaseException:
+            try:
+                os.unlink(partial)
+            except FileNotFoundError:
+                pass
+            raise
+
+    # ── removal ──
+    def delete_object(self, object_key: str):
+        """Removes an object if it exists. Readers that already opened or mapped it keep their copy."""
+        try:
+            os.unlink(os.path.join(self.base_dir, os.path.normpath(object_key)))
+        except FileNotFoundError:
+            pass
 
     # ── index upload ──
     def put_index(self, offsets: List[int], object_key: str):
@@ -37,3 +141,120 @@ class Storage:
         os.makedirs(os.path.dirname(dest), exist_ok=True)
         with open(dest, "wb") as f:
             f.write(data)
+
+    # ── longest-lines sidecar upload ──
+    def put_longest(self, entries: List[Tuple[int, int, int]], object_key: str):
+        """Packs (length, line_no, byte_offset) records into a binary sidecar next to the index."""
+        data = pack_longest(entries)
+        dest = os.path.join(self.base_dir, os.path.normpath(object_key))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, "wb") as f:
+            f.write(data)
+
+    # ── line-length stats sidecar upload ──
+    def put_stats(self, stats: dict, object_key: str):
+        """Saves a file's line-length summary as JSON next to its index."""
+        dest = os.path.join(self.base_dir, os.path.normpath(object_key))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, "w", encoding="utf-8") as f:
+            json.dump(stats, f)
+
+
+def _get_s3_client():
+    """
+    The process-wide S3 client. Its connection pool (`[storage] s3_max_connections`) is reused by
+    every request; boto3 clients are thread-safe once created. With `backend = s3-local`, the
+    filesystem-backed `LocalS3Client` under `s3_local_root` is used instead.
+    """
+    global _s3_client
+    with _client_lock:
+        if _s3_client is None:
+            if settings.STORAGE_BACKEND == "s3-local":
+                from api.utils.s3_local import LocalS3Client
+
+                _s3_client = LocalS3Client(settings.S3_LOCAL_ROOT)
+            else:
+                try:
+                    import boto3
+                    from botocore.config import Config
+                except ImportError as e:
+                    raise RuntimeError("[storage] backend = s3 requires the boto3 package.") from e
+                _s3_client = boto3.client(
+                    "s3",
+                    endpoint_url=settings.S3_ENDPOINT_URL or None,
+                    region_name=settings.S3_REGION or None,
+                    config=Config(
+                        max_pool_connections=settings.S3_MAX_CONNECTIONS,
+                        retries={"max_attempts": 3, "mode": "standard"},
+                    ),
+                )
+        return _s3_client
+
+
+class S3Storage(Storage):
+    """
+    Objects, indexes and sidecars live in an S3-compatible bucket (AWS S3, Cloudflare R2, MinIO),
+    under the same keys as on local disk. Uploads are still staged on local disk under
+    `<base_dir>/.staging`; committing one uploads it, in parallel multipart PUTs when it is larger
+    than one part. Reads use ranged GETs (see `api.utils.reader`).
+    """
+
+    def __init__(self, client, bucket: str, base_dir: Optional[str] = None,
+                 part_bytes: Optional[int] = None, upload_workers: Optional[int] = None):
+        super().__init__(base_dir)
+        self.kind = "s3"
+        self.client = client
+        self.bucket = bucket
+        self.part_bytes = part_bytes or settings.S3_PART_BYTES
+        self.upload_workers = upload_workers or settings.S3_UPLOAD_WORKERS
+
+    def commit_staged(self, staged_path: str, object_key: str):
+        """Uploads a staged file as `object_key` and removes the local copy."""
+        self.upload_file(staged_path, object_key)
+        os.unlink(staged_path)
+
+    def upload_file(self, local_path: str, object_key: str):
+        """
+        Uploads a local file. Files larger than one part (`[storage] s3_part_mb`) are sent as a
+        multipart upload whose parts are read with `os.pread` and PUT by `s3_upload_workers` threads.
+        """
+        size = os.path.getsize(local_path)
+        if size <= self.part_bytes:
+            with open(local_path, "rb") as f:
+                self.client.put_object(Bucket=self.bucket, Key=object_key, Body=f.read())
+            return
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=object_key)["UploadId"]
+        fd = os.open(local_path, os.O_RDONLY)
+        try:
+            def put_part(number: int) -> dict:
+                body = os.pread(fd, self.part_bytes, (number - 1) * self.part_bytes)
+                resp = self.client.upload_part(
+                    Bucket=self.bucket, Key=object_key, UploadId=upload_id, PartNumber=number, Body=body
+                )
+                return {"ETag": resp["ETag"], "PartNumber": number}
+
+            n_parts = -(-size // self.part_bytes)
+            with ThreadPoolExecutor(max_workers=max(1, min(self.upload_workers, n_parts))) as pool:
+                parts = list(pool.map(put_part, range(1, n_parts + 1)))
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=object_key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=object_key, UploadId=upload_id)
+            raise
+        finally:
+            os.close(fd)
+
+    def delete_object(self, object_key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=object_key)
+
+    def put_index(self, offsets: List[int], object_key: str):
+        data = b"".join(struct.pack("<Q", off) for off in offsets)
+        self.client.put_object(Bucket=self.bucket, Key=object_key, Body=data)
+
+    def put_longest(self, entries: List[Tuple[int, int, int]], object_key: str):
+        self.client.put_object(Bucket=self.bucket, Key=object_key, Body=pack_longest(entries))
+
+    def put_stats(self, stats: dict, object_key: str):
+        self.client.put_object(Bucket=self.bucket, Key=object_key, Body=json.dumps(stats).encode("utf-8"))
@@ -1,7 +1,42 @@
 from collections import Counter
+from typing import Iterable, List, Union
 
+_ASCII_LOWER = b"abcdefghijklmnopqrstuvwxyz"
+_ASCII_UPPER = _ASCII_LOWER.upper()
+# Lowercases ASCII letters; `translate(_TO_LOWER, _NON_LETTERS)` keeps only the letters.
+_TO_LOWER = bytes.maketrans(_ASCII_UPPER, _ASCII_LOWER)
+_NON_LETTERS = bytes(b for b in range(256) if b not in _ASCII_LOWER + _ASCII_UPPER)
+# Single-letter needles for `bytes.count`, with the letter they stand for.
+_NEEDLES = [(bytes([b]), chr(b)) for b in _ASCII_LOWER]
 
-def most_frequent_letter(text: str) -> str:
+
+def _most_frequent_ascii(raw: bytes) -> str:
+    """`most_frequent_letter` for ASCII input: 26 `bytes.count` calls over the letters only."""
+    letters = raw.translate(_TO_LOWER, _NON_LETTERS)
+    if not letters:
+        return "N/A"
+    counts = [(letters.count(needle), needle, letter) for needle, letter in _NEEDLES]
+    counts = [c for c in counts if c[0]]
+    top = max(n for n, _, _ in counts)
+    if len(counts) > 1 and all(n == top for n, _, _ in counts):
+        return "Tie"
+    # Among equally frequent letters the one seen first wins, as with Counter.most_common.
+    return min((letters.find(needle), letter) for n, needle, letter in counts if n == top)[1]
+
+
+def _most_frequent_unicode(text: str) -> str:
+    letters = [char.lower() for char in text if char.isalpha()]
+    if not letters:
+        return "N/A"
+
+    counts = Counter(letters)
+    if len(counts) > 1 and len(set(counts.values())) == 1:
+        return "Tie"
+
+    return counts.most_common(1)[0][0]
+
+
+def most_frequent_letter(text: Union[str, bytes]) -> str:
     """
     Finds the most frequent letter in a string, with special handling for
     ties and strings without letters.
@@ -10,14 +45,30 @@ def most_frequent_letter(text: str) -> str:
     - If no letters are present, returns "N/A".
     - If all present letters occur with the same frequency (and there's more
       than one type of letter), returns "Tie".
-    - Otherwise, returns the most frequent letter.
+    - Otherwise, returns the most frequent letter (the first one seen if several are).
+
+    Accepts a str or raw UTF-8 bytes. ASCII input is counted on bytes in C; anything else
+    goes through the Unicode path, so non-ASCII letters count as before.
     """
-    letters = [char.lower() for char in text if char.isalpha()]
-    if not letters:
-        return "N/A"
+    if isinstance(text, str):
+        if text.isascii():
+            return _most_frequent_ascii(text.encode("ascii"))
+        return _most_frequent_unicode(text)
+    if text.isascii():
+        return _most_frequent_ascii(text)
+    return _most_frequent_unicode(text.decode("utf-8", "replace"))
 
-    counts = Counter(letters)
-    if len(counts) > 1 and len(set(counts.values())) == 1:
-        return "Tie"
 
-    return counts.most_common(1)[0][0]
\ No newline at end of file
+def most_frequent_letters(texts: Iterable[Union[str, bytes]]) -> List[str]:
+    """
+    Batch form of `most_frequent_letter`, in input order. Each distinct line is still counted on
+    its own (the same cost as single calls); repeated lines are only counted once.
+    """
+    seen = {}
+    out = []
+    for text in texts:
+        result = seen.get(text)
+        if result is None:
+            result = seen[text] = most_frequent_letter(text)
+        out.append(result)
+    return out
@@ -0,0 +1,45 @@
+"""Shared process pool for CPU-bound work that should not run on the request thread."""
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence
+
+_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_size = 0
+
+
+def get_process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Returns the process-wide pool, (re)creating it if the requested size changed.
+    Workers are spawned rather than forked, since the web server process is multi-threaded.
+    """
+    global _pool, _pool_size
+    with _lock:
+        if _pool is None or _pool_size != max_workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_size = max_workers
+        return _pool
+
+
+@atexit.register
+def _shutdown():
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+
+
+def map_ordered(fn: Callable, arg_tuples: Sequence[tuple], workers: int) -> List[Any]:
+    """
+    Calls `fn(*args)` for every tuple, in the process pool when `workers > 0` and there is
+    more than one task, otherwise inline. Results are returned in input order.
+    `fn` and its arguments must be picklable for the pooled case.
+    """
+    if workers > 0 and len(arg_tuples) > 1:
+        pool = get_process_pool(workers)
+        futures = [pool.submit(fn, *args) for args in arg_tuples]
+        return [f.result() for f in futures]
+    return [fn(*args) for args in arg_tuples]
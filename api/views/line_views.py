@@ -2,20 +2,74 @@
 import logging
 from flask import Blueprint, request, Response, jsonify
 from typing import Optional
-from api.models.line_model import fetch_line
-from api.utils.response import negotiate_content_type, to_xml
-from api.utils.textutils import most_frequent_letter
+from api.models.line_model import fetch_line, fetch_lines
+from api.utils.response import iter_json, iter_text, iter_xml, negotiate_content_type, stream_response, to_xml
+from api.utils.textutils import most_frequent_letter, most_frequent_letters
 
 lines_bp = Blueprint("lines", __name__)
 logger = logging.getLogger(__name__)
 
+# Which files a random line is drawn from when no file_name is given.
+SCOPES = ("latest", "all")
+# Upper bound for `count` on the batch form of the random-line endpoints.
+MAX_COUNT = 1000
+
+
+def _parse_count() -> Optional[int]:
+    """Returns the `count` query parameter capped at MAX_COUNT, or None for the single-line form.
+    Raises ValueError if it is not a positive integer."""
+    raw = request.args.get("count")
+    if raw is None:
+        return None
+    count = int(raw)
+    if count < 1:
+        raise ValueError(f"count must be at least 1, got {count}")
+    return min(MAX_COUNT, count)
+
+
+def _forward_payload(result: dict, letter: Optional[str] = None) -> dict:
+    # Strip whitespace/newlines from the line for cleaner structured output
+    line_content = result["line"].strip()
+    return {
+        "file_name": result["file_name"],
+        "line_number": result["line_number"],
+        "line": line_content,
+        "most_frequent_letter": most_frequent_letter(line_content) if letter is None else letter,
+    }
+
+
+def _backwards_payload(result: dict, letter: Optional[str] = None) -> dict:
+    line_content = result["line"].strip()
+    return {
+        "file_name": result["file_name"],
+        "line_number": result["line_number"],
+        "line_reversed": line_content[::-1],
+        "most_frequent_letter": most_frequent_letter(line_content) if letter is None else letter,
+    }
+
+
+def _letters(results: list) -> list:
+    """Most frequent letter of every line in a batch, computed in one call."""
+    return most_frequent_letters(r["line"].strip() for r in results)
+
+
 @lines_bp.get("/lines/random")
 def get_line():
     ctype = negotiate_content_type(request)
     file_name = request.args.get("file_name")
+    scope = request.args.get("scope", "latest")
+    if scope not in SCOPES:
+        return jsonify({"detail": f"Invalid scope '{scope}'. Expected one of: {', '.join(SCOPES)}."}), 400
+    try:
+        count = _parse_count()
+    except ValueError:
+        return jsonify({"detail": "count must be a positive integer."}), 400
 
     try:
-        result = fetch_line(file_name=file_name)
+        if count is None:
+            result = fetch_line(file_name=file_name, scope=scope)
+        else:
+            results = fetch_lines(count, file_name=file_name, scope=scope)
     except ValueError as ve:
         logger.warning(f"Could not fetch line: {ve}")
         return jsonify({"detail": str(ve)}), 404
@@ -23,19 +77,22 @@ def get_line():
         logger.exception("An unhandled error occurred while fetching a random line.")
         return jsonify({"detail": "Internal server error"}), 500
 
+    if count is not None:
+        # Batch form: text/plain is one line per row, structured types are a list of items,
+        # serialized while the body is streamed
+        if ctype == "text/plain":
+            return stream_response(iter_text(r["line"] for r in results), "text/plain")
+        items = (_forward_payload(r, letter) for r, letter in zip(results, _letters(results)))
+        if ctype == "application/xml":
+            return stream_response(iter_xml(items, root="random_lines", item_name="line_item"), "application/xml")
+        return stream_response(iter_json(items), "application/json")
+
     # Plain text → return just the line
     if ctype == "text/plain":
         return Response(result["line"], mimetype="text/plain")
 
     # application/json or application/xml → include metadata
-    # Strip whitespace/newlines from the line for cleaner structured output
-    line_content = result["line"].strip()
-    payload = {
-        "file_name": result["file_name"],
-        "line_number": result["line_number"],
-        "line": line_content,
-        "most_frequent_letter": most_frequent_letter(line_content),
-    }
+    payload = _forward_payload(result)
     if ctype == "application/xml":
         return Response(to_xml(payload, root="random_line"), mimetype="application/xml")
     return jsonify(payload)
@@ -46,9 +103,19 @@ def get_line_backwards():
     """Returns a random line from a file, with the line content reversed."""
     ctype = negotiate_content_type(request)
     file_name = request.args.get("file_name")
+    scope = request.args.get("scope", "latest")
+    if scope not in SCOPES:
+        return jsonify({"detail": f"Invalid scope '{scope}'. Expected one of: {', '.join(SCOPES)}."}), 400
+    try:
+        count = _parse_count()
+    except ValueError:
+        return jsonify({"detail": "count must be a positive integer."}), 400
 
     try:
-        result = fetch_line(file_name=file_name)
+        if count is None:
+            result = fetch_line(file_name=file_name, scope=scope)
+        else:
+            results = fetch_lines(count, file_name=file_name, scope=scope)
     except ValueError as ve:
         logger.warning(f"Could not fetch backwards line: {ve}")
         return jsonify({"detail": str(ve)}), 404
@@ -56,18 +123,20 @@ def get_line_backwards():
         logger.exception("An unhandled error occurred while fetching a backwards line.")
         return jsonify({"detail": "Internal server error"}), 500
 
-    line_content = result["line"].strip()
-    reversed_line = line_content[::-1]
+    if count is not None:
+        if ctype == "text/plain":
+            return stream_response(iter_text(r["line"].strip()[::-1] for r in results), "text/plain")
+        items = (_backwards_payload(r, letter) for r, letter in zip(results, _letters(results)))
+        if ctype == "application/xml":
+            return stream_response(
+                iter_xml(items, root="random_lines_backwards", item_name="line_item"), "application/xml"
+            )
+        return stream_response(iter_json(items), "application/json")
 
     if ctype == "text/plain":
-        return Response(reversed_line, mimetype="text/plain")
+        return Response(result["line"].strip()[::-1], mimetype="text/plain")
 
-    payload = {
-        "file_name": result["file_name"],
-        "line_number": result["line_number"],
-        "line_reversed": reversed_line,
-        "most_frequent_letter": most_frequent_letter(line_content),
-    }
+    payload = _backwards_payload(result)
     if ctype == "application/xml":
         return Response(to_xml(payload, root="random_line_backwards"), mimetype="application/xml")
     return jsonify(payload)
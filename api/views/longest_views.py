@@ -1,13 +1,30 @@
 # api/views/longest_views.py
 import logging
 from flask import Blueprint, request, Response, jsonify
-from typing import Optional
-from api.models.longest_model import get_longest_lines
-from api.utils.response import negotiate_content_type, to_xml
+from typing import Hashable, Iterable, Iterator
+from api.models.longest_model import corpus_state, iter_longest_lines
+from api.utils import db
+from api.utils.cache import ByteLRU
+from api.utils.metrics import RESPONSE_CACHE_LOOKUPS
+from api.utils.response import (
+    is_not_modified,
+    iter_chunks,
+    iter_json,
+    iter_text,
+    iter_xml,
+    make_etag,
+    negotiate_content_type,
+    with_validators,
+)
+from config import settings
 
 longest_bp = Blueprint("longest", __name__)
 logger = logging.getLogger(__name__)
 
+# Rendered bodies, (body chunks, mimetype), by (database, corpus version, file_name, limit, content type).
+# Results only change with the corpus version, so entries never need invalidating.
+_responses = ByteLRU(settings.RESPONSE_CACHE_MB * 1024 * 1024)
+
 @longest_bp.get("/lines/longest")
 def longest_lines():
     ctype = negotiate_content_type(request)
@@ -23,10 +40,24 @@ def longest_lines():
         # If parsing fails (e.g., limit="abc"), use the default
         limit = default_limit
 
+    # Clamp the final limit to the allowed range
+    limit = max(1, min(1000, limit))
+
     try:
-        # Clamp the final limit to the allowed range
-        limit = max(1, min(1000, limit))
-        items = get_longest_lines(limit=limit, file_name=file_name)
+        version, last_modified = corpus_state()
+        key = (db.DB_PATH, version, file_name, limit, ctype)
+        etag = make_etag(*key)
+        if is_not_modified(request, etag, last_modified):
+            RESPONSE_CACHE_LOOKUPS.inc(labels=("not_modified",))
+            return with_validators(Response(status=304), etag, last_modified)
+
+        cached = _responses.get(key)
+        if cached is not None:
+            RESPONSE_CACHE_LOOKUPS.inc(labels=("hit",))
+            chunks, mimetype = cached
+            return with_validators(Response(chunks, mimetype=mimetype), etag, last_modified)
+        RESPONSE_CACHE_LOOKUPS.inc(labels=("miss",))
+        items = iter_longest_lines(limit=limit, file_name=file_name)
     except ValueError as ve:
         # Not found / no files -> 404 style response
         logger.warning(f"Could not get longest lines: {ve}")
@@ -35,14 +66,44 @@ def longest_lines():
         logger.exception("An unhandled error occurred while getting longest lines.")
         return jsonify({"detail": "Internal server error"}), 500
 
+    # The lines are read and serialized while the body is sent; the ranking already ran above.
+    chunks = _cached(iter_chunks(_render(items, ctype)), key, version, ctype)
+    return with_validators(Response(chunks, mimetype=ctype), etag, last_modified)
+
+
+def _render(items: Iterable[dict], ctype: str) -> Iterator[str]:
     # text/plain: return just the lines joined by '\n'
     if ctype == "text/plain":
-        body = "\n".join(item["line"] for item in items)
-        return Response(body, mimetype="text/plain")
+        return iter_text(item["line"] for item in items)
 
     # application/xml or application/json: include metadata
     if ctype == "application/xml":
-        return Response(to_xml(items, root="longest_lines", item_name="line_item"), mimetype="application/xml")
+        return iter_xml(items, root="longest_lines", item_name="line_item")
 
     # default JSON
-    return jsonify(items)
\ No newline at end of file
+    return iter_json(items)
+
+
+def _cached(chunks: Iterator[bytes], key: Hashable, version: int, mimetype: str) -> Iterator[bytes]:
+    """
+    Yields `chunks` and, once the whole body was sent, stores them in the response cache as they
+    are (no joined copy). Bodies larger than the cache budget stop being buffered, so with the
+    cache disabled nothing is kept beyond the chunk being sent.
+    """
+    buf = []
+    size = 0
+    try:
+        for chunk in chunks:
+            yield chunk
+            if buf is not None:
+                buf.append(chunk)
+                size += len(chunk)
+                if size > _responses.max_bytes:
+                    buf = None
+    except Exception:
+        # Headers are already sent: the client sees a truncated body.
+        logger.exception("An unhandled error occurred while streaming longest lines.")
+        raise
+    # An upload that landed during the scan may be reflected in the body; such a body is not cached.
+    if buf is not None and corpus_state()[0] == version:
+        _responses.put(key, (tuple(buf), mimetype), size)
@@ -0,0 +1,19 @@
+# api/views/metrics_views.py
+import logging
+from flask import Blueprint, Response, jsonify
+from api.utils import metrics
+from config import settings
+
+metrics_bp = Blueprint("metrics", __name__)
+logger = logging.getLogger(__name__)
+
+# Content type of the Prometheus text exposition format.
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@metrics_bp.get("/metrics")
+def get_metrics():
+    """Returns this process's counters and histograms in the Prometheus text format."""
+    if not settings.METRICS_ENABLED:
+        return jsonify({"detail": "Metrics are disabled."}), 404
+    return Response(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,78 @@
+# api/views/stats_views.py
+import logging
+from flask import Blueprint, request, Response, jsonify
+from typing import Optional
+from api.models.stats_model import find_lines_by_length, get_file_stats
+from api.utils.response import negotiate_content_type, to_xml
+
+stats_bp = Blueprint("stats", __name__)
+logger = logging.getLogger(__name__)
+
+# Upper bound for `limit` on length-range queries.
+MAX_LIMIT = 1000
+
+
+def _parse_length(name: str) -> Optional[int]:
+    """Returns a non-negative integer query parameter, or None if absent. Raises ValueError otherwise."""
+    raw = request.args.get(name)
+    if raw is None:
+        return None
+    value = int(raw)
+    if value < 0:
+        raise ValueError
+    return value
+
+
+@stats_bp.get("/files/<name>/stats")
+def file_stats(name: str):
+    """Returns the line-length summary of one file."""
+    ctype = negotiate_content_type(request)
+    try:
+        stats = get_file_stats(name)
+    except ValueError as ve:
+        logger.warning(f"Could not get file stats: {ve}")
+        return jsonify({"detail": str(ve)}), 404
+    except Exception:
+        logger.exception("An unhandled error occurred while getting file stats.")
+        return jsonify({"detail": "Internal server error"}), 500
+
+    if ctype == "text/plain":
+        body = "\n".join(
+            [f"{k}: {stats[k]}" for k in ("file_name", "num_lines", "min", "max", "mean")]
+            + [f"{k}: {v}" for k, v in stats["percentiles"].items()]
+        )
+        return Response(body, mimetype="text/plain")
+    if ctype == "application/xml":
+        return Response(to_xml(stats, root="file_stats", item_name="bucket"), mimetype="application/xml")
+    return jsonify(stats)
+
+
+@stats_bp.get("/files/<name>/lines")
+def lines_by_length(name: str):
+    """Returns the lines of one file with a length in [min_length, max_length]."""
+    ctype = negotiate_content_type(request)
+    try:
+        min_length = _parse_length("min_length") or 0
+        max_length = _parse_length("max_length")
+        limit = _parse_length("limit")
+    except ValueError:
+        return jsonify({"detail": "min_length, max_length and limit must be non-negative integers."}), 400
+    if max_length is not None and max_length < min_length:
+        return jsonify({"detail": "max_length must not be less than min_length."}), 400
+    limit = max(1, min(MAX_LIMIT, 100 if limit is None else limit))
+
+    try:
+        result = find_lines_by_length(name, min_length=min_length, max_length=max_length, limit=limit)
+    except ValueError as ve:
+        logger.warning(f"Could not get lines by length: {ve}")
+        return jsonify({"detail": str(ve)}), 404
+    except Exception:
+        logger.exception("An unhandled error occurred while getting lines by length.")
+        return jsonify({"detail": "Internal server error"}), 500
+
+    # text/plain: just the matching lines, one per row
+    if ctype == "text/plain":
+        return Response("\n".join(item["line"] for item in result["lines"]), mimetype="text/plain")
+    if ctype == "application/xml":
+        return Response(to_xml(result, root="lines_by_length", item_name="line_item"), mimetype="application/xml")
+    return jsonify(result)
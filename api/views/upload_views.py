@@ -1,12 +1,36 @@
 import os
 import logging
+from typing import Optional, Tuple
 from flask import Blueprint, request, jsonify
 from api.models.file_model import handle_upload
+from api.models.job_model import submit_upload, get_job
+from api.models.multipart_model import (
+    UploadNotFound,
+    abort_upload,
+    complete_upload,
+    create_upload,
+    describe_upload,
+    upload_part,
+)
 from config import settings
 
 upload_bp = Blueprint("upload", __name__)
 logger = logging.getLogger(__name__)
 
+def _check_filename(raw: str) -> Tuple[str, Optional[str]]:
+    """Returns the sanitized file name and, if it cannot be accepted, the reason why."""
+    # Sanitize filename to prevent path traversal attacks
+    filename = os.path.basename(raw)
+    if not filename:
+        return filename, "Invalid filename provided"
+
+    # Validate file extension
+    if settings.ALLOWED_EXTENSIONS:
+        _, ext = os.path.splitext(filename)
+        if ext not in settings.ALLOWED_EXTENSIONS:
+            return filename, f"File extension '{ext}' is not allowed."
+    return filename, None
+
 @upload_bp.post("/files")
 def upload_file():
     """API View: receives multipart, parses, validates, then delegates to model."""
@@ -14,19 +38,28 @@ def upload_file():
     if not f or not f.filename:
         return jsonify({"detail": "No file provided"}), 400
 
-    # Sanitize filename to prevent path traversal attacks
-    filename = os.path.basename(f.filename)
-    if not filename:
-        return jsonify({"detail": "Invalid filename provided"}), 400
+    filename, error = _check_filename(f.filename)
+    if error:
+        return jsonify({"detail": error}), 400
 
-    # Validate file extension
-    if settings.ALLOWED_EXTENSIONS:
-        _, ext = os.path.splitext(filename)
-        if ext not in settings.ALLOWED_EXTENSIONS:
-            return jsonify({"detail": f"File extension '{ext}' is not allowed."}), 400
+    raw_async = request.form.get("async")
+    run_async = settings.ASYNC_INGEST if raw_async is None else raw_async.lower() in ("1", "true", "yes")
 
     try:
-        result = handle_upload(file_storage=f, filename=filename)
+        if run_async:
+            job = submit_upload(
+                file_storage=f,
+                filename=filename,
+                index_mode=request.form.get("index_mode"),
+                compression=request.form.get("compression"),
+            )
+            return jsonify(job), 202, {"Location": f"/files/jobs/{job['job_id']}"}
+        result = handle_upload(
+            file_storage=f,
+            filename=filename,
+            index_mode=request.form.get("index_mode"),
+            compression=request.form.get("compression"),
+        )
         return jsonify(result), 200
     except ValueError as ve:
         logger.warning(f"Validation error during upload: {ve}")
@@ -34,3 +67,89 @@ def upload_file():
     except Exception:
         logger.exception("An unhandled error occurred during file upload.")
         return jsonify({"detail": "Internal server error"}), 500
+
+
+@upload_bp.get("/files/jobs/<job_id>")
+def get_upload_job(job_id: str):
+    """API View: reports the status and progress of an asynchronous upload."""
+    try:
+        return jsonify(get_job(job_id)), 200
+    except ValueError as ve:
+        return jsonify({"detail": str(ve)}), 404
+    except Exception:
+        logger.exception("An unhandled error occurred while fetching an upload job.")
+        return jsonify({"detail": "Internal server error"}), 500
+
+
+@upload_bp.post("/files/<name>/uploads")
+def start_multipart_upload(name: str):
+    """API View: starts a resumable multipart upload; optional `index_mode` and `part_size` (bytes)."""
+    filename, error = _check_filename(name)
+    if error or filename != name:
+        return jsonify({"detail": error or "Invalid filename provided"}), 400
+    try:
+        raw_part_size = request.values.get("part_size")
+        part_size = int(raw_part_size) if raw_part_size is not None else None
+        upload = create_upload(filename, index_mode=request.values.get("index_mode"), part_size=part_size)
+        return jsonify(upload), 201
+    except ValueError as ve:
+        logger.warning(f"Validation error while starting a multipart upload: {ve}")
+        return jsonify({"detail": str(ve)}), 400
+    except Exception:
+        logger.exception("An unhandled error occurred while starting a multipart upload.")
+        return jsonify({"detail": "Internal server error"}), 500
+
+
+@upload_bp.get("/files/<name>/uploads/<upload_id>")
+def get_multipart_upload(name: str, upload_id: str):
+    """API View: lists the parts received so far, so an interrupted client can resume."""
+    try:
+        return jsonify(describe_upload(name, upload_id)), 200
+    except UploadNotFound as e:
+        return jsonify({"detail": str(e)}), 404
+    except Exception:
+        logger.exception("An unhandled error occurred while fetching a multipart upload.")
+        return jsonify({"detail": "Internal server error"}), 500
+
+
+@upload_bp.put("/files/<name>/uploads/<upload_id>/parts/<int:part_number>")
+def put_multipart_part(name: str, upload_id: str, part_number: int):
+    """API View: stores one part; the request body is the part's raw bytes."""
+    try:
+        return jsonify(upload_part(name, upload_id, part_number, request.stream)), 200
+    except UploadNotFound as e:
+        return jsonify({"detail": str(e)}), 404
+    except ValueError as ve:
+        logger.warning(f"Validation error during part upload: {ve}")
+        return jsonify({"detail": str(ve)}), 400
+    except Exception:
+        logger.exception("An unhandled error occurred during part upload.")
+        return jsonify({"detail": "Internal server error"}), 500
+
+
+@upload_bp.post("/files/<name>/uploads/<upload_id>/complete")
+def complete_multipart_upload(name: str, upload_id: str):
+    """API View: assembles the parts into the file; responds like POST /files."""
+    try:
+        return jsonify(complete_upload(name, upload_id)), 200
+    except UploadNotFound as e:
+        return jsonify({"detail": str(e)}), 404
+    except ValueError as ve:
+        logger.warning(f"Validation error while completing a multipart upload: {ve}")
+        return jsonify({"detail": str(ve)}), 400
+    except Exception:
+        logger.exception("An unhandled error occurred while completing a multipart upload.")
+        return jsonify({"detail": "Internal server error"}), 500
+
+
+@upload_bp.delete("/files/<name>/uploads/<upload_id>")
+def abort_multipart_upload(name: str, upload_id: str):
+    """API View: discards an unfinished multipart upload."""
+    try:
+        abort_upload(name, upload_id)
+        return "", 204
+    except UploadNotFound as e:
+        return jsonify({"detail": str(e)}), 404
+    except Exception:
+        logger.exception("An unhandled error occurred while aborting a multipart upload.")
+        return jsonify({"detail": "Internal server error"}), 500
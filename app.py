@@ -1,12 +1,18 @@
 import logging
 import os
+import time
 from logging.handlers import RotatingFileHandler
 
-from flask import Flask, request
+from flask import Flask, g, request
 
 from api.views.upload_views import upload_bp
 from api.views.line_views import lines_bp
 from api.views.longest_views import longest_bp
+from api.views.stats_views import stats_bp
+from api.views.metrics_views import metrics_bp
+from api.models.job_model import resume_jobs
+from api.utils.metrics import HTTP_REQUEST_SECONDS
+from config import settings
 
 # --- Logging Setup ---
 # Ensure log directory exists
@@ -31,6 +37,29 @@ logging.getLogger("werkzeug").addHandler(file_handler)
 app.register_blueprint(upload_bp)
 app.register_blueprint(lines_bp)
 app.register_blueprint(longest_bp)
+app.register_blueprint(stats_bp)
+app.register_blueprint(metrics_bp)
+
+
+@app.before_request
+def _start_timer():
+    if settings.METRICS_ENABLED:
+        g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _observe_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        # Labelled by route rule rather than raw path, so file names do not create new series.
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started, (endpoint, request.method, str(response.status_code))
+        )
+    return response
+
+# Pick up background ingest jobs left unfinished by a previous server process.
+resume_jobs()
 
 if __name__ == "__main__":
     app.logger.info("Application starting up...")
@@ -18,5 +18,34 @@ class AppConfig:
         self.ALLOWED_EXTENSIONS = {ext.strip() for ext in allowed_ext_str.split(",") if ext.strip()}
         self.MAX_UPLOAD_MB = parser.getint("app", "max_upload_mb", fallback=100)
         self.INDEX_LINES_PER_CHUNK = parser.getint("file_processing", "index_lines_per_chunk", fallback=1000)
+        self.INDEX_MODE = parser.get("file_processing", "index_mode", fallback="chunk")
+        self.INDEX_CHUNK_BYTES = parser.getint("file_processing", "index_chunk_kb", fallback=64) * 1024
+        self.INDEX_READ_BYTES = parser.getint("file_processing", "index_read_kb", fallback=128) * 1024
+        self.ASYNC_INGEST = parser.getboolean("file_processing", "async_ingest", fallback=False)
+        self.INGEST_WORKERS = parser.getint("file_processing", "ingest_workers", fallback=2)
+        self.MULTIPART_PART_BYTES = parser.getint("file_processing", "multipart_part_mb", fallback=64) * 1024 * 1024
+        self.LONGEST_LINES_TOP_N = parser.getint("file_processing", "longest_lines_top_n", fallback=1000)
+        self.LONGEST_SCAN_WORKERS = parser.getint("longest_lines", "scan_workers", fallback=0)
+        self.RESPONSE_CACHE_MB = parser.getint("longest_lines", "response_cache_mb", fallback=16)
+        self.DB_BUSY_TIMEOUT_MS = parser.getint("database", "busy_timeout_ms", fallback=5000)
+        self.DB_CACHE_KB = parser.getint("database", "cache_kb", fallback=8192)
+        self.COMPRESSION = parser.get("storage", "compression", fallback="none")
+        self.COMPRESSION_LEVEL = parser.getint("storage", "compression_level", fallback=6)
+        self.DEDUP = parser.getboolean("storage", "dedup", fallback=True)
+        self.ORPHAN_GRACE_S = parser.getint("storage", "orphan_grace_s", fallback=300)
+        self.LINE_STATS = parser.getboolean("storage", "line_stats", fallback=True)
+        self.USE_MMAP = parser.getboolean("storage", "use_mmap", fallback=True)
+        self.MMAP_CACHE_SIZE = parser.getint("storage", "mmap_cache_size", fallback=64)
+        self.INDEX_CACHE_MB = parser.getint("storage", "index_cache_mb", fallback=64)
+        self.BLOCK_CACHE_MB = parser.getint("storage", "block_cache_mb", fallback=64)
+        self.STORAGE_BACKEND = parser.get("storage", "backend", fallback="local")
+        self.S3_BUCKET = parser.get("storage", "s3_bucket", fallback="")
+        self.S3_ENDPOINT_URL = parser.get("storage", "s3_endpoint_url", fallback="")
+        self.S3_REGION = parser.get("storage", "s3_region", fallback="")
+        self.S3_MAX_CONNECTIONS = parser.getint("storage", "s3_max_connections", fallback=32)
+        self.S3_PART_BYTES = max(5, parser.getint("storage", "s3_part_mb", fallback=16)) * 1024 * 1024
+        self.S3_UPLOAD_WORKERS = parser.getint("storage", "s3_upload_workers", fallback=4)
+        self.S3_LOCAL_ROOT = parser.get("storage", "s3_local_root", fallback="s3-local")
+        self.METRICS_ENABLED = parser.getboolean("metrics", "enabled", fallback=True)
 
 settings = AppConfig()
\ No newline at end of file
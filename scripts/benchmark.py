@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+benchmark.py — reproducible performance benchmark for the API.
+
+Generates seeded corpora with make_big_files.py, runs them through the Flask test client
+against a throwaway database and storage directory, and measures:
+  - upload throughput (MB/s per file and overall)
+  - random-line latency (p50/p99) per content type
+  - /lines/longest wall time, per file and across all files, with the response cache cold
+    (cleared before every run) and warm (served from it)
+
+Results are written as JSON. With --baseline, they are compared to a stored result and the
+script exits with status 1 if any metric regressed by more than --tolerance.
+
+Usage:
+  python scripts/benchmark.py
+  python scripts/benchmark.py --sizes 20MB,20MB --shape lognormal --output results.json
+  python scripts/benchmark.py --output new.json --baseline scripts/benchmark_baseline.json
+  python scripts/benchmark.py --output scripts/benchmark_baseline.json   # record a new baseline
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPTS_DIR))
+
+from make_big_files import SHAPES, human, parse_names_csv, parse_sizes_csv, write_one_file  # noqa: E402
+from config import settings  # noqa: E402  (reads config.ini from the working directory)
+
+CONTENT_TYPES = ("application/json", "application/xml", "text/plain")
+
+# Metrics ending in this are throughputs, where larger is better; all others are latencies/durations.
+THROUGHPUT_SUFFIX = "mb_per_s"
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """Nearest-rank percentile of `samples`."""
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return ordered[int(rank) - 1]
+
+
+def timed(fn) -> float:
+    """Seconds until `fn`'s response body was fully read. List endpoints stream their body, so
+    reading it is where lines are fetched from storage and serialized."""
+    start = time.perf_counter()
+    rv = fn()
+    rv.get_data()
+    elapsed = time.perf_counter() - start
+    if rv.status_code >= 400:
+        raise SystemExit(f"request failed with {rv.status_code}: {rv.data[:200]!r}")
+    return elapsed
+
+
+def make_client(workdir: str):
+    """A Flask test client using a database and storage directory under `workdir`."""
+    from api.utils import db
+    from api.utils.storage import Storage
+
+    db.DB_PATH = os.path.join(workdir, "bench.db")
+    uploads = os.path.join(workdir, "uploads")
+    Storage.from_env = classmethod(lambda cls: cls(base_dir=uploads))
+    cwd = os.getcwd()
+    os.chdir(workdir)  # app.py writes its log files relative to the working directory
+    try:
+        from app import app
+    finally:
+        os.chdir(cwd)
+    app.config["TESTING"] = True
+    return app.test_client()
+
+
+def bench_uploads(client, paths: List[str]) -> Dict:
+    per_file = {}
+    total_bytes = 0
+    total_s = 0.0
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        name = os.path.basename(path)
+        elapsed = timed(lambda: client.post("/files", data={"file": (io.BytesIO(data), name)}))
+        per_file[name] = round(len(data) / 1024 ** 2 / elapsed, 2)
+        total_bytes += len(data)
+        total_s += elapsed
+    return {"mb_per_s": round(total_bytes / 1024 ** 2 / total_s, 2), "per_file_mb_per_s": per_file}
+
+
+def bench_random_lines(client, requests: int) -> Dict:
+    out = {}
+    for ctype in CONTENT_TYPES:
+        headers = {"Accept": ctype}
+        for _ in range(min(20, requests)):  # warm caches and maps
+            client.get("/lines/random?scope=all", headers=headers)
+        samples = [timed(lambda: client.get("/lines/random?scope=all", headers=headers)) for _ in range(requests)]
+        out[ctype] = {
+            "p50_ms": round(percentile(samples, 50) * 1000, 3),
+            "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        }
+    return out
+
+
+def bench_longest(client, names: List[str], repeats: int) -> Dict:
+    """
+    `cold`: the response cache is cleared before every run, so each one ranks and reads the lines.
+    `warm`: after one priming request, i.e. served from the response cache.
+    """
+    from api.views.longest_views import _responses
+
+    def best_of(url: str, cold: bool) -> float:
+        def run() -> float:
+            if cold:
+                _responses.clear()
+            return timed(lambda: client.get(url))
+
+        if not cold:
+            run()
+        return round(min(run() for _ in range(repeats)) * 1000, 3)
+
+    def measure(cold: bool) -> Dict:
+        return {
+            "global_ms": best_of("/lines/longest?limit=100", cold),
+            "per_file_ms": {name: best_of(f"/lines/longest?file_name={name}", cold) for name in names},
+        }
+
+    return {"cold": measure(cold=True), "warm": measure(cold=False)}
+
+
+def flatten(results: Dict) -> Dict[str, float]:
+    """Comparable metrics as dotted keys, e.g. `random_line.text/plain.p99_ms`."""
+    flat = {}
+
+    def walk(prefix: str, node):
+        for key, value in node.items():
+            path = f"{prefix}.{key}" if prefix else key
+            if isinstance(value, dict):
+                walk(path, value)
+            elif isinstance(value, (int, float)):
+                flat[path] = value
+
+    walk("", results["results"])
+    return flat
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[Tuple[str, float, float, float, bool]]:
+    """(metric, baseline, current, relative change, regressed) for metrics present in both."""
+    rows = []
+    now, before = flatten(current), flatten(baseline)
+    for key in sorted(now.keys() & before.keys()):
+        old, new = before[key], now[key]
+        if not old:
+            continue
+        change = (new - old) / old
+        higher_better = key.endswith(THROUGHPUT_SUFFIX)
+        regressed = change < -tolerance if higher_better else change > tolerance
+        rows.append((key, old, new, change, regressed))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark uploads, random lines and longest lines.")
+    ap.add_argument("--sizes", default="8MB,8MB", help="Comma-separated corpus file sizes. Default: 8MB,8MB")
+    ap.add_argument("--names", default=None, help="Comma-separated file names. Default: bench1.txt, bench2.txt, ...")
+    ap.add_argument("--seed", type=int, default=42, help="Random seed for the corpora (default: 42)")
+    ap.add_argument("--shape", choices=SHAPES, default="uniform", help="Line-length distribution (default: uniform)")
+    ap.add_argument("--min-len", type=int, default=40, help="Minimum line length (default: 40)")
+    ap.add_argument("--max-len", type=int, default=200, help="Maximum line length (default: 200)")
+    ap.add_argument("--long-line-every", type=int, default=400, help="Very long line every N lines (default: 400)")
+    ap.add_argument("--very-long-len", type=int, default=6000, help="Length of very long lines (default: 6000)")
+    ap.add_argument("--requests", type=int, default=500, help="Random-line requests per content type (default: 500)")
+    ap.add_argument("--repeats", type=int, default=5, help="Runs per longest-lines query, best is kept (default: 5)")
+    ap.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    ap.add_argument("--baseline", default=None, help="JSON results to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.2,
+                    help="Allowed relative slowdown before a metric counts as regressed (default: 0.2)")
+    args = ap.parse_args()
+
+    sizes = parse_sizes_csv(args.sizes)
+    names = parse_names_csv(args.names) if args.names else [f"bench{i + 1}.txt" for i in range(len(sizes))]
+    if len(sizes) != len(names):
+        raise SystemExit("sizes and names must have the same number of items")
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        rng = random.Random(args.seed)
+        paths = []
+        for name, size in zip(names, sizes):
+            path = os.path.join(workdir, "corpus", name)
+            write_one_file(path, size, rng, min_len=args.min_len, max_len=args.max_len,
+                           long_line_every=args.long_line_every, very_long_len=args.very_long_len, shape=args.shape)
+            paths.append(path)
+
+        client = make_client(workdir)
+        print("→ Uploading")
+        uploads = bench_uploads(client, paths)
+        print(f"→ Random lines ({args.requests} per content type)")
+        random_lines = bench_random_lines(client, args.requests)
+        print(f"→ Longest lines (best of {args.repeats}, response cache cold, then warm)")
+        longest = bench_longest(client, names, args.repeats)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": {
+                "seed": args.seed, "shape": args.shape, "files": dict(zip(names, (human(s) for s in sizes))),
+                "min_len": args.min_len, "max_len": args.max_len,
+                "long_line_every": args.long_line_every, "very_long_len": args.very_long_len,
+            },
+            "config": {
+                "index_mode": settings.INDEX_MODE, "index_lines_per_chunk": settings.INDEX_LINES_PER_CHUNK,
+                "compression": settings.COMPRESSION, "use_mmap": settings.USE_MMAP,
+                "scan_workers": settings.LONGEST_SCAN_WORKERS, "metrics_enabled": settings.METRICS_ENABLED,
+                "response_cache_mb": settings.RESPONSE_CACHE_MB,
+            },
+        },
+        "results": {"upload": uploads, "random_line": random_lines, "longest": longest},
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"✔ Wrote {args.output}")
+    print("  Timings include reading the whole (streamed) body. The server's http_request_duration_seconds")
+    print("  histogram stops when a streamed response's headers are sent, so it reads lower.")
+    for key, value in flatten(results).items():
+        print(f"  {key:<48} {value}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["meta"]["corpus"] != results["meta"]["corpus"]:
+            print("! Baseline was measured on a different corpus; the comparison may not be meaningful.")
+        rows = compare(results, baseline, args.tolerance)
+        print(f"→ Compared with {args.baseline} (tolerance {args.tolerance:.0%})")
+        for key, old, new, change, regressed in rows:
+            print(f"  {'✘' if regressed else ' '} {key:<46} {old:>10} → {new:<10} ({change:+.1%})")
+        regressions = [row for row in rows if row[4]]
+        if regressions:
+            raise SystemExit(f"{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}")
+        print("✔ No regressions")
+
+
+if __name__ == "__main__":
+    main()
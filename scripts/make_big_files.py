@@ -6,9 +6,11 @@ Usage:
   python make_big_files.py
   python make_big_files.py --sizes 50MB,80MB,120MB --names big1.txt,big2.txt,big3.txt
   python make_big_files.py --sizes 200MB,200MB,200MB --seed 123 --long-line-every 500 --very-long-len 8000
+  python make_big_files.py --sizes 20MB --names skewed.txt --shape lognormal
 """
 
 import argparse
+import math
 import os
 import random
 import string
@@ -19,6 +21,12 @@ DEFAULT_NAMES = ["big1.txt", "big2.txt", "big3.txt"]
 
 ALPHABET = string.ascii_letters + "     "  # spaces to create word-like text
 
+# Line-length distributions for regular (not "very long") lines:
+#   uniform:   uniform between min_len and max_len
+#   lognormal: median halfway between min_len and max_len with a long right tail,
+#              clipped to [min_len, very_long_len]
+SHAPES = ("uniform", "lognormal")
+
 
 def parse_size(s: str) -> int:
     s = s.strip().upper()
@@ -51,8 +59,15 @@ def human(n: int) -> str:
     return f"{n:.2f}B"
 
 
-def random_line(rng: random.Random, min_len: int, max_len: int) -> str:
-    L = rng.randint(min_len, max_len)
+def line_length(rng: random.Random, shape: str, min_len: int, max_len: int, very_long_len: int) -> int:
+    if shape == "lognormal":
+        L = int(rng.lognormvariate(math.log((min_len + max_len) / 2), 1.0))
+        return max(min_len, min(L, very_long_len))
+    return rng.randint(min_len, max_len)
+
+
+def random_line(rng: random.Random, min_len: int, max_len: int, length: int = None) -> str:
+    L = rng.randint(min_len, max_len) if length is None else length
     # Make it word-ish: chunks separated by spaces
     return "".join(rng.choice(ALPHABET) for _ in range(L))
 
@@ -65,10 +80,12 @@ def write_one_file(
     max_len: int = 200,
     long_line_every: int = 400,
     very_long_len: int = 6000,
-) -> None:
+    shape: str = "uniform",
+) -> int:
     """
     Stream lines until we reach (or slightly exceed) target_bytes.
     Every `long_line_every` lines, write a very long line to help test longest-lines.
+    Other line lengths follow `shape` (see SHAPES). Returns the number of lines written.
     """
     os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
     bytes_written = 0
@@ -83,8 +100,10 @@ def write_one_file(
                 prefix = f"LONG{line_no:08d}: "
                 filler_len = max(very_long_len - len(prefix), 0)
                 line = prefix + ("X" * filler_len)
-            else:
+            elif shape == "uniform":
                 line = random_line(rng, min_len, max_len)
+            else:
+                line = random_line(rng, min_len, max_len, line_length(rng, shape, min_len, max_len, very_long_len))
 
             # Always end with \n so your parser sees clean line boundaries
             data = line + "\n"
@@ -92,6 +111,7 @@ def write_one_file(
             bytes_written += len(data.encode("utf-8"))
 
     print(f"✔ Wrote {path}  (~{human(bytes_written)}) lines={line_no}")
+    return line_no
 
 
 def main():
@@ -127,6 +147,12 @@ def main():
         default=6000,
         help="Length of the very long line (default: 6000 characters)",
     )
+    ap.add_argument(
+        "--shape",
+        choices=SHAPES,
+        default="uniform",
+        help="Line-length distribution of regular lines (default: uniform)",
+    )
 
     args = ap.parse_args()
     sizes = parse_sizes_csv(args.sizes)
@@ -146,6 +172,7 @@ def main():
             max_len=args.max_len,
             long_line_every=args.long_line_every,
             very_long_len=args.very_long_len,
+            shape=args.shape,
         )
 
 
@@ -1,9 +1,11 @@
 import io
+import threading
 import pytest
 import xml.etree.ElementTree as ET
 
 from app import app
-from api.utils.db import init_db
+from api.utils.db import bump_corpus_version, get_conn, init_db
+from api.utils.file_cache import file_rows
 from api.utils.storage import Storage
 
 
@@ -103,6 +105,20 @@ def test_most_frequent_letter_edge_cases(client):
     assert rv_tie.get_json()["most_frequent_letter"] == "Tie"
 
 
+def test_most_frequent_letter_ascii_and_unicode():
+    """Tests that the byte-level ASCII path and the Unicode path agree, including tie-breaking."""
+    from api.utils.textutils import most_frequent_letter, most_frequent_letters
+
+    cases = {
+        "": "N/A", "12 34!": "N/A", "abc": "Tie", "AaBb": "Tie", "xyz x": "x",
+        "bbaac": "b", "ABab c": "a", "Éée a": "é", "ÉÉ aa": "Tie", "naïve nn": "n",
+    }
+    for text, expected in cases.items():
+        assert most_frequent_letter(text) == expected, text
+        assert most_frequent_letter(text.encode()) == expected, text
+    assert most_frequent_letters(list(cases) + ["bbaac"]) == list(cases.values()) + ["b"]
+
+
 def test_get_line_from_empty_file(client):
     """Test behavior when the source file is empty."""
     setup_file(client, "empty.txt", b"")
@@ -134,4 +150,357 @@ def test_get_line_backwards(client):
     rv_xml = client.get("/lines/random/backwards", headers={"Accept": "application/xml"})
     assert rv_xml.status_code == 200
     root = ET.fromstring(rv_xml.data)
-    assert root.find("line_reversed").text == "dlrow olleh"
\ No newline at end of file
+    assert root.find("line_reversed").text == "dlrow olleh"
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_get_line_after_reupload(client, monkeypatch, use_mmap):
+    """Test that a replaced file is re-read (and re-mapped) instead of served from a stale map."""
+    monkeypatch.setattr("config.settings.USE_MMAP", use_mmap)
+    setup_file(client, "same.txt", b"old line")
+    rv = client.get("/lines/random?file_name=same.txt", headers={"Accept": "text/plain"})
+    assert rv.data == b"old line"
+
+    setup_file(client, "same.txt", b"a brand new line")
+    rv = client.get("/lines/random?file_name=same.txt", headers={"Accept": "text/plain"})
+    assert rv.data == b"a brand new line"
+
+
+def test_get_line_index_not_stale_after_reupload(client, monkeypatch):
+    """Test that the cached chunk index is not reused once a file is replaced."""
+    monkeypatch.setattr("config.settings.INDEX_LINES_PER_CHUNK", 1)
+    monkeypatch.setattr("random.randint", lambda a, b: b)  # always pick the last line
+
+    setup_file(client, "idx.txt", b"aa\nbb\ncc")
+    rv = client.get("/lines/random?file_name=idx.txt", headers={"Accept": "text/plain"})
+    assert rv.data == b"cc"
+
+    setup_file(client, "idx.txt", b"a\nbbbb\nzz")
+    rv = client.get("/lines/random?file_name=idx.txt", headers={"Accept": "text/plain"})
+    assert rv.data == b"zz"
+
+
+def test_get_every_line_with_small_reads(client, monkeypatch):
+    """Test that checkpoints stay exact when lines and K-line chunks straddle read boundaries."""
+    monkeypatch.setattr("config.settings.INDEX_LINES_PER_CHUNK", 3)
+    monkeypatch.setattr("config.settings.INDEX_READ_BYTES", 7)
+    lines = [f"line {i} " + "x" * (i % 5) for i in range(20)]
+    setup_file(client, "every.txt", "\n".join(lines).encode())
+
+    for i, expected in enumerate(lines):
+        monkeypatch.setattr("random.randint", lambda a, b, i=i: i)
+        rv = client.get("/lines/random?file_name=every.txt", headers={"Accept": "text/plain"})
+        assert rv.data.decode() == expected
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_get_every_line_dense_index(client, monkeypatch, use_mmap):
+    """Test that every line, including empty and unterminated ones, is read back from a dense index."""
+    monkeypatch.setattr("config.settings.USE_MMAP", use_mmap)
+    monkeypatch.setattr("config.settings.INDEX_READ_BYTES", 5)
+    lines = ["first", "", "späte zeile", "x" * 17, "last"]
+    client.post("/files", data={"file": (io.BytesIO("\n".join(lines).encode()), "d.txt"), "index_mode": "dense"})
+
+    for i, expected in enumerate(lines):
+        monkeypatch.setattr("random.randint", lambda a, b, i=i: i)
+        rv = client.get("/lines/random?file_name=d.txt", headers={"Accept": "application/json"})
+        assert rv.get_json()["line"] == expected
+        assert rv.get_json()["line_number"] == i + 1
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_get_every_line_adaptive_index(client, monkeypatch, use_mmap):
+    """Test that checkpoints every K lines or N bytes find every line, whatever the line lengths."""
+    monkeypatch.setattr("config.settings.USE_MMAP", use_mmap)
+    monkeypatch.setattr("config.settings.INDEX_LINES_PER_CHUNK", 4)
+    monkeypatch.setattr("config.settings.INDEX_CHUNK_BYTES", 64)
+    monkeypatch.setattr("config.settings.INDEX_READ_BYTES", 7)
+    lines = [f"{i}:" + "w" * (200 if i % 9 == 0 else i % 3) for i in range(50)]
+    rv = client.post("/files", data={"file": (io.BytesIO("\n".join(lines).encode()), "a.txt"), "index_mode": "adaptive"})
+    assert rv.get_json()["index_mode"] == "adaptive"
+
+    for i, expected in enumerate(lines):
+        monkeypatch.setattr("random.randint", lambda a, b, i=i: i)
+        rv = client.get("/lines/random?file_name=a.txt", headers={"Accept": "text/plain"})
+        assert rv.data.decode() == expected
+    rv = client.get("/lines/random?file_name=a.txt&count=50", headers={"Accept": "text/plain"})
+    assert rv.data.decode().split("\n") == [lines[49]] * 50
+
+    # A checkpoint starts at the first line that is 4 lines or 64 bytes past the previous one.
+    from api.utils.reader import load_index
+    with get_conn() as conn:
+        row = conn.execute("SELECT * FROM files WHERE filename = 'a.txt'").fetchone()
+    index = load_index(Storage.from_env(), row["idx_key"])
+    n = len(index) // 2
+    starts = [0]
+    for line in lines[:-1]:
+        starts.append(starts[-1] + len(line) + 1)
+    expected = [0]
+    for i in range(1, len(lines)):
+        if i - expected[-1] >= 4 or starts[i] - starts[expected[-1]] >= 64:
+            expected.append(i)
+    assert list(index[:n]) == expected
+    assert list(index[n:]) == [starts[i] for i in expected]
+
+
+def test_block_cache(client, monkeypatch, tmp_path):
+    """Test that reads through the block cache match the stored bytes and that repeats are hits."""
+    from api.utils import reader
+
+    monkeypatch.setattr("config.settings.USE_MMAP", False)
+    monkeypatch.setattr("config.settings.INDEX_LINES_PER_CHUNK", 3)
+    monkeypatch.setattr(reader, "CHUNK_BYTES", 16)
+    lines = [f"line {i} " + "x" * (i * 7 % 23) for i in range(40)]
+    content = "\n".join(lines).encode()
+    setup_file(client, "blocks.txt", content)
+
+    for _ in range(2):
+        for i, expected in enumerate(lines):
+            monkeypatch.setattr("random.randint", lambda a, b, i=i: i)
+            rv = client.get("/lines/random?file_name=blocks.txt", headers={"Accept": "text/plain"})
+            assert rv.data.decode() == expected
+    stats = reader.block_cache_stats()
+    assert stats["hits"] > 0 and stats["entries"] > 0
+
+    storage = Storage(base_dir=str(tmp_path / "uploads"))
+    with get_conn() as conn:
+        key = conn.execute("SELECT object_key FROM files WHERE filename = 'blocks.txt'").fetchone()[0]
+    hits = stats["hits"]
+    for start, end in [(0, None), (5, 6), (15, 17), (16, 32), (30, len(content) + 50), (len(content) - 1, None)]:
+        got = b"".join(reader._stream_from_offset(storage, key, start, end, version="v"))
+        assert got == content[start:end]
+    assert reader.block_cache_stats()["hits"] > hits
+
+    # A new version never sees the blocks cached for the old one.
+    (tmp_path / "uploads" / key).write_bytes(b"replaced")
+    assert b"".join(reader._stream_from_offset(storage, key, 0, version="v2")) == b"replaced"
+
+
+def test_get_line_across_all_files(client, monkeypatch):
+    """Test that scope=all maps a global line number onto (file, local line), skipping empty files."""
+    setup_file(client, "a.txt", b"a0")
+    setup_file(client, "empty.txt", b"")
+    setup_file(client, "b.txt", b"b0\nb1\nb2")
+    setup_file(client, "a.txt", b"a0\na1")  # re-upload moves a.txt after b.txt
+
+    expected = [("b.txt", 1, "b0"), ("b.txt", 2, "b1"), ("b.txt", 3, "b2"), ("a.txt", 1, "a0"), ("a.txt", 2, "a1")]
+    for g, (fname, line_number, line) in enumerate(expected):
+        monkeypatch.setattr("random.randrange", lambda n, g=g: g)
+        rv = client.get("/lines/random?scope=all", headers={"Accept": "application/json"})
+        data = rv.get_json()
+        assert (data["file_name"], data["line_number"], data["line"]) == (fname, line_number, line)
+
+
+def test_get_line_across_all_files_invalid_scope(client):
+    setup_file(client, "a.txt", b"a0")
+    rv = client.get("/lines/random?scope=everything")
+    assert rv.status_code == 400
+
+
+def test_get_lines_batch(client, monkeypatch):
+    """Test the batch form returns `count` lines in sampling order for every content type."""
+    monkeypatch.setattr("config.settings.INDEX_LINES_PER_CHUNK", 2)
+    setup_file(client, "batch.txt", b"l0\nl1\nl2\nl3\nl4")
+    picks = iter([4, 0, 3, 0] * 3)
+    monkeypatch.setattr("random.randint", lambda a, b: next(picks))
+
+    rv = client.get("/lines/random?count=4", headers={"Accept": "application/json"})
+    assert rv.status_code == 200
+    assert [(d["line"], d["line_number"]) for d in rv.get_json()] == [("l4", 5), ("l0", 1), ("l3", 4), ("l0", 1)]
+
+    rv = client.get("/lines/random?count=4", headers={"Accept": "text/plain"})
+    assert rv.data == b"l4\nl0\nl3\nl0"
+
+    rv = client.get("/lines/random/backwards?count=4", headers={"Accept": "application/xml"})
+    root = ET.fromstring(rv.data)
+    assert root.tag == "random_lines_backwards"
+    assert [item.find("line_reversed").text for item in root.findall("line_item")] == ["4l", "0l", "3l", "0l"]
+
+
+def test_get_lines_batch_across_files(client):
+    """Test the batch form with scope=all and its count validation."""
+    setup_file(client, "a.txt", b"a0\na1")
+    setup_file(client, "b.txt", b"b0")
+    rv = client.get("/lines/random?scope=all&count=50", headers={"Accept": "application/json"})
+    data = rv.get_json()
+    assert len(data) == 50
+    assert {(d["file_name"], d["line"]) for d in data} <= {("a.txt", "a0"), ("a.txt", "a1"), ("b.txt", "b0")}
+
+    assert client.get("/lines/random?count=abc").status_code == 400
+    for bad in ("0", "-5"):
+        rv = client.get(f"/lines/random?count={bad}")
+        assert rv.status_code == 400
+        assert rv.get_json()["detail"] == "count must be a positive integer."
+        assert client.get(f"/lines/random/backwards?count={bad}").status_code == 400
+    assert len(client.get("/lines/random?count=5000").get_json()) == 1000
+
+
+def test_get_line_uses_cached_file_row(client):
+    """Test that repeated lookups are served from the row cache and uploads invalidate it."""
+    setup_file(client, "c1.txt", b"one")
+    client.get("/lines/random", headers={"Accept": "text/plain"})
+    client.get("/lines/random?file_name=c1.txt", headers={"Accept": "text/plain"})
+
+    queries = []
+    get_conn().set_trace_callback(queries.append)
+    try:
+        hits = file_rows.hits
+        rv = client.get("/lines/random?file_name=c1.txt", headers={"Accept": "text/plain"})
+        assert rv.data == b"one"
+        rv = client.get("/lines/random", headers={"Accept": "text/plain"})
+        assert rv.data == b"one"
+        assert file_rows.hits == hits + 2
+    finally:
+        get_conn().set_trace_callback(None)
+    assert queries and all("FROM corpus_version" in q for q in queries)
+
+    setup_file(client, "c2.txt", b"two")
+    rv = client.get("/lines/random", headers={"Accept": "text/plain"})
+    assert rv.data == b"two"
+
+
+def test_cached_file_row_follows_corpus_version(client):
+    """Test that a row cached before another process's upload is dropped once the corpus version moves."""
+    setup_file(client, "v.txt", b"a\nb\nc\n")
+    assert file_rows.get("v.txt")["num_lines"] == 3
+    # Another process re-uploads v.txt: its row and the corpus version change, this cache is not told.
+    with get_conn() as conn:
+        conn.execute("UPDATE files SET num_lines = 1 WHERE filename = 'v.txt'")
+        bump_corpus_version(conn)
+    assert file_rows.get("v.txt")["num_lines"] == 1
+
+
+def test_pooled_connection_per_thread(client):
+    """Test that each thread reuses one WAL-mode connection."""
+    conn = get_conn()
+    assert get_conn() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    other = []
+    t = threading.Thread(target=lambda: other.append(get_conn()))
+    t.start()
+    t.join()
+    assert other[0] is not conn
+
+
+def test_get_every_line_compressed(client, monkeypatch):
+    """Test that single and batch reads decompress the right frame of a gzip upload."""
+    monkeypatch.setattr("config.settings.INDEX_LINES_PER_CHUNK", 3)
+    monkeypatch.setattr("config.settings.INDEX_READ_BYTES", 7)
+    lines = [f"zeile {i} " + "ü" * (i % 4) for i in range(14)]
+    client.post("/files", data={"file": (io.BytesIO("\n".join(lines).encode()), "gz.txt"), "compression": "gzip"})
+
+    with monkeypatch.context() as m:
+        for i, expected in enumerate(lines):
+            m.setattr("random.randint", lambda a, b, i=i: i)
+            rv = client.get("/lines/random?file_name=gz.txt", headers={"Accept": "text/plain"})
+            assert rv.data.decode() == expected
+
+    rv = client.get("/lines/random?file_name=gz.txt&count=50", headers={"Accept": "application/json"})
+    for item in rv.get_json():
+        assert item["line"] == lines[item["line_number"] - 1].strip()
+
+
+STATS_CONTENT = "a\nbbb\n\ncccccc\nddddddddd\néé\nee".encode()
+
+
+def test_file_stats(client, tmp_path):
+    """Tests that the upload's line-length summary is stored next to its index and served."""
+    setup_file(client, "stats.txt", STATS_CONTENT)
+    with get_conn() as conn:
+        lengths_key = conn.execute("SELECT lengths_key FROM files WHERE filename = 'stats.txt'").fetchone()[0]
+    col = (tmp_path / "uploads" / lengths_key).read_bytes()
+    assert [int.from_bytes(col[i:i + 4], "little") for i in range(0, len(col), 4)] == [1, 3, 0, 6, 9, 2, 2]
+
+    rv = client.get("/files/stats.txt/stats")
+    assert rv.status_code == 200
+    stats = rv.get_json()
+    assert (stats["file_name"], stats["num_lines"], stats["min"], stats["max"]) == ("stats.txt", 7, 0, 9)
+    assert stats["mean"] == round(23 / 7, 3)
+    assert stats["percentiles"]["p50"] == 2 and stats["percentiles"]["p99"] == 9
+    assert [(b["min"], b["max"], b["count"]) for b in stats["histogram"]] == [(0, 0, 1), (1, 1, 1), (2, 3, 3), (4, 7, 1), (8, 15, 1)]
+
+    root = ET.fromstring(client.get("/files/stats.txt/stats", headers={"Accept": "application/xml"}).data)
+    assert root.find("percentiles/p50").text == "2"
+    assert len(root.findall("histogram/bucket")) == 5
+    assert client.get("/files/missing.txt/stats").status_code == 404
+
+
+def test_reader_of_replaced_file(client):
+    """Tests that a request still holding a re-uploaded file's old row can read the old object."""
+    from api.models.line_model import read_lines
+
+    setup_file(client, "r.txt", b"old 1\nold 2\n")
+    old_row = file_rows.get("r.txt")
+    setup_file(client, "r.txt", b"new\n")
+    assert read_lines(Storage.from_env(), old_row, [1]) == {1: "old 2"}
+
+
+@pytest.mark.parametrize("form", [{}, {"compression": "gzip"}, {"index_mode": "dense"}])
+def test_lines_by_length(client, form):
+    """Tests length-range queries served from the length column."""
+    data = {"file": (io.BytesIO(STATS_CONTENT), "ranges.txt"), **form}
+    assert client.post("/files", data=data, content_type="multipart/form-data").status_code == 200
+
+    body = client.get("/files/ranges.txt/lines?min_length=3").get_json()
+    assert body["total"] == 3
+    assert [(x["line_number"], x["length"], x["line"]) for x in body["lines"]] == [
+        (2, 3, "bbb"), (4, 6, "cccccc"), (5, 9, "ddddddddd")
+    ]
+    body = client.get("/files/ranges.txt/lines?min_length=1&max_length=2&limit=2").get_json()
+    assert body["total"] == 3
+    assert [x["line"] for x in body["lines"]] == ["a", "éé"]
+    rv = client.get("/files/ranges.txt/lines?min_length=6", headers={"Accept": "text/plain"})
+    assert rv.data.decode() == "cccccc\nddddddddd"
+
+
+def test_lines_by_length_without_column(client, monkeypatch):
+    """Tests that files indexed without a length column are scanned and give the same answers."""
+    monkeypatch.setattr("config.settings.LINE_STATS", False)
+    setup_file(client, "old.txt", STATS_CONTENT)
+    body = client.get("/files/old.txt/lines?min_length=3").get_json()
+    assert [x["line_number"] for x in body["lines"]] == [2, 4, 5]
+    assert client.get("/files/old.txt/stats").get_json()["percentiles"]["p50"] == 2
+
+
+def test_lines_by_length_invalid(client):
+    setup_file(client, "inv.txt", b"a\n")
+    assert client.get("/files/inv.txt/lines?min_length=x").status_code == 400
+    assert client.get("/files/inv.txt/lines?min_length=-1").status_code == 400
+    assert client.get("/files/inv.txt/lines?min_length=5&max_length=2").status_code == 400
+    assert client.get("/files/nope.txt/lines?min_length=1").status_code == 404
+
+
+def test_metrics_endpoint(client):
+    """Tests that hot-path timings are recorded and exported in the Prometheus text format."""
+    from api.utils import metrics
+
+    metrics.reset()
+    setup_file(client, "metrics.txt", b"one\ntwo\nthree\n")
+    client.get("/lines/random?file_name=metrics.txt")
+    assert metrics.INGEST_LINES.value() == 3
+    assert metrics.INDEX_LOAD_SECONDS.count(("miss",)) + metrics.INDEX_LOAD_SECONDS.count(("hit",)) == 1
+    assert metrics.LINE_SEEK_SECONDS.count(("mmap",)) == 1
+
+    client.get("/lines/longest")
+    assert metrics.DB_LOOKUP_SECONDS.count(("files_to_scan",)) == 1
+    assert metrics.LINE_SEEK_SECONDS.count(("mmap",)) == 4  # the three winners are read back by offset
+
+    rv = client.get("/metrics")
+    assert rv.status_code == 200
+    assert rv.content_type.startswith("text/plain; version=0.0.4")
+    text = rv.data.decode()
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    assert 'http_request_duration_seconds_count{endpoint="/lines/random",method="GET",status="200"} 1' in text
+    assert 'ingest_duration_seconds_bucket{index_mode="chunk",le="+Inf"} 1' in text
+    assert "ingest_lines_total 3" in text
+
+
+def test_metrics_disabled(client, monkeypatch):
+    from api.utils import metrics
+
+    metrics.reset()
+    monkeypatch.setattr("config.settings.METRICS_ENABLED", False)
+    setup_file(client, "quiet.txt", b"one\ntwo\n")
+    client.get("/lines/random?file_name=quiet.txt")
+    assert metrics.INGEST_LINES.value() == 0
+    assert metrics.LINE_SEEK_SECONDS.count(("mmap",)) == 0
+    assert client.get("/metrics").status_code == 404
@@ -3,8 +3,11 @@ import pytest
 import xml.etree.ElementTree as ET
  
 from app import app
-from api.utils.db import init_db
+from api.utils.cache import ByteLRU
+from api.utils.db import get_conn, init_db
 from api.utils.storage import Storage
+from api.utils.partition import split_file
+from api.utils.reader import iter_lines
 
 
 @pytest.fixture
@@ -18,6 +21,8 @@ def client(tmp_path, monkeypatch):
         return Storage(base_dir=str(tmp_path / "uploads"))
 
     monkeypatch.setattr("api.utils.storage.Storage.from_env", mock_storage_from_env)
+    # Every request computes its result, unless a test turns the response cache back on.
+    monkeypatch.setattr("api.views.longest_views._responses", ByteLRU(0))
 
     app.config["TESTING"] = True
     with app.test_client() as test_client:
@@ -111,4 +116,184 @@ def test_get_longest_lines_defaults(client):
     # 2. File specified, no limit -> should default to 20
     rv_file = client.get("/lines/longest?file_name=test.txt", headers={"Accept": "application/json"})
     assert rv_file.status_code == 200
-    assert len(rv_file.get_json()) == 20
\ No newline at end of file
+    assert len(rv_file.get_json()) == 20
+
+def test_get_longest_lines_uses_sidecar(client, tmp_path):
+    """Test that uploads write a longest-lines sidecar and results are hydrated from it."""
+    setup_file(client, "u.txt", "ééééé\nabcdef\nxyz\n".encode())
+    with get_conn() as conn:
+        longest_key = conn.execute("SELECT longest_key FROM files WHERE filename = 'u.txt'").fetchone()[0]
+    assert (tmp_path / "uploads" / longest_key).exists()
+
+    rv = client.get("/lines/longest?limit=2", headers={"Accept": "application/json"})
+    data = rv.get_json()
+    # Character length, not byte length: "ééééé" is 10 bytes but only 5 characters
+    assert [(d["line"], d["length"], d["line_number"]) for d in data] == [("abcdef", 6, 2), ("ééééé", 5, 1)]
+
+
+def test_get_longest_lines_without_sidecar(client):
+    """Test that files uploaded before the sidecar existed are still scanned."""
+    setup_file(client, "legacy.txt", b"short\nthe longest line\nmid line")
+    with get_conn() as conn:
+        conn.execute("UPDATE files SET longest_key = NULL")
+
+    rv = client.get("/lines/longest?limit=2", headers={"Accept": "text/plain"})
+    assert rv.data.decode().split("\n") == ["the longest line", "mid line"]
+
+
+def test_get_longest_lines_parallel_scan(client, monkeypatch):
+    """Test that scanning files in worker processes gives the same result as a sequential scan."""
+    setup_file(client, "p1.txt", b"aaaa\nbb\ncccccc\nd")
+    setup_file(client, "p2.txt", b"eeeee\nffffffff\ng")
+    setup_file(client, "p3.txt", b"hhh\niiiiiii")
+    with get_conn() as conn:
+        conn.execute("UPDATE files SET longest_key = NULL")
+
+    rv_seq = client.get("/lines/longest?limit=4", headers={"Accept": "application/json"})
+    monkeypatch.setattr("config.settings.LONGEST_SCAN_WORKERS", 2)
+    rv_par = client.get("/lines/longest?limit=4", headers={"Accept": "application/json"})
+    assert rv_par.get_json() == rv_seq.get_json()
+    assert [d["line"] for d in rv_par.get_json()] == ["ffffffff", "iiiiiii", "cccccc", "eeeee"]
+
+
+@pytest.mark.parametrize("index_mode", ["chunk", "dense", "adaptive"])
+def test_split_file_ranges_cover_file(client, monkeypatch, index_mode):
+    """Test that line-aligned ranges reproduce the file's lines with exact global line numbers."""
+    monkeypatch.setattr("config.settings.INDEX_LINES_PER_CHUNK", 2)
+    monkeypatch.setattr("config.settings.INDEX_CHUNK_BYTES", 10)
+    lines = [f"{i}:" + "z" * (i * 7 % 11) for i in range(23)]
+    client.post("/files", data={"file": (io.BytesIO("\n".join(lines).encode()), "r.txt"), "index_mode": index_mode})
+    storage = Storage.from_env()
+    with get_conn() as conn:
+        row = conn.execute("SELECT * FROM files WHERE filename = 'r.txt'").fetchone()
+
+    ranges = split_file(storage, row, parts=4, min_range_bytes=1)
+    assert len(ranges) > 1
+    seen = []
+    for r in ranges:
+        chunk = list(iter_lines(storage, row["object_key"], start=r.start, end=r.end))
+        assert chunk[0] == lines[r.first_line]
+        seen.extend(chunk)
+    assert seen == lines
+
+
+def test_get_longest_lines_split_single_file(client, monkeypatch):
+    """Test that one large file scanned as several ranges in worker processes matches the sequential scan."""
+    monkeypatch.setattr("config.settings.INDEX_LINES_PER_CHUNK", 3)
+    monkeypatch.setattr("api.utils.partition.MIN_RANGE_BYTES", 1)
+    content = "\n".join(f"{i}:" + "q" * (i * 13 % 29) for i in range(60)).encode()
+    setup_file(client, "big.txt", content)
+    with get_conn() as conn:
+        conn.execute("UPDATE files SET longest_key = NULL")
+
+    rv_seq = client.get("/lines/longest?file_name=big.txt&limit=10", headers={"Accept": "application/json"})
+    monkeypatch.setattr("config.settings.LONGEST_SCAN_WORKERS", 3)
+    rv_par = client.get("/lines/longest?file_name=big.txt&limit=10", headers={"Accept": "application/json"})
+    assert rv_par.get_json() == rv_seq.get_json()
+    for item in rv_par.get_json():
+        assert item["line"].startswith(f"{item['line_number'] - 1}:")
+
+
+def test_get_longest_lines_scan_counts_characters(client):
+    """Test that the raw-byte scan ranks non-ASCII lines by characters, not bytes."""
+    content = "ééééé\nabcdef\nxyz\nüü\n".encode()
+    setup_file(client, "utf.txt", content)
+    with get_conn() as conn:
+        conn.execute("UPDATE files SET longest_key = NULL")
+
+    rv = client.get("/lines/longest?file_name=utf.txt&limit=2", headers={"Accept": "application/json"})
+    data = rv.get_json()
+    assert [(d["line"], d["length"], d["line_number"]) for d in data] == [("abcdef", 6, 2), ("ééééé", 5, 1)]
+
+
+@pytest.mark.parametrize("sidecar", [True, False])
+def test_get_longest_lines_compressed(client, monkeypatch, sidecar):
+    """Test that longest lines of a gzip upload are found and read back through its frames."""
+    monkeypatch.setattr("config.settings.INDEX_LINES_PER_CHUNK", 4)
+    monkeypatch.setattr("api.utils.partition.MIN_RANGE_BYTES", 1)
+    content = "\n".join(f"{i}:" + "é" * (i * 11 % 23) for i in range(50)).encode()
+    setup_file(client, "plain.txt", content)
+    client.post("/files", data={"file": (io.BytesIO(content), "packed.txt"), "compression": "gzip"})
+    if not sidecar:
+        with get_conn() as conn:
+            conn.execute("UPDATE files SET longest_key = NULL")
+        monkeypatch.setattr("config.settings.LONGEST_SCAN_WORKERS", 2)
+
+    plain = client.get("/lines/longest?file_name=plain.txt&limit=8", headers={"Accept": "application/json"})
+    packed = client.get("/lines/longest?file_name=packed.txt&limit=8", headers={"Accept": "application/json"})
+    strip = lambda items: [(d["length"], d["line_number"], d["line"]) for d in items]
+    assert strip(packed.get_json()) == strip(plain.get_json())
+
+
+def test_get_longest_lines_conditional_requests(client):
+    """Test ETag/Last-Modified validators and 304 answers until the next upload."""
+    setup_file(client, "a.txt", b"short\nthe longest line\n")
+    rv = client.get("/lines/longest?limit=1", headers={"Accept": "text/plain"})
+    assert rv.status_code == 200 and rv.data == b"the longest line"
+    etag, last_modified = rv.headers["ETag"], rv.headers["Last-Modified"]
+    assert "no-cache" in rv.headers["Cache-Control"] and "Accept" in rv.headers["Vary"]
+
+    rv = client.get("/lines/longest?limit=1", headers={"Accept": "text/plain", "If-None-Match": etag})
+    assert rv.status_code == 304 and rv.data == b"" and rv.headers["ETag"] == etag
+    rv = client.get("/lines/longest?limit=1", headers={"Accept": "text/plain", "If-Modified-Since": last_modified})
+    assert rv.status_code == 304
+
+    # Another representation of the same result has its own tag.
+    rv = client.get("/lines/longest?limit=1", headers={"Accept": "application/json", "If-None-Match": etag})
+    assert rv.status_code == 200 and rv.headers["ETag"] != etag
+    rv = client.get("/lines/longest?limit=2", headers={"Accept": "text/plain", "If-None-Match": etag})
+    assert rv.status_code == 200
+
+    # An upload changes the version, so the old tag no longer matches.
+    setup_file(client, "b.txt", b"an even longer line than before\n")
+    rv = client.get("/lines/longest?limit=1", headers={"Accept": "text/plain", "If-None-Match": etag})
+    assert rv.status_code == 200 and rv.data == b"an even longer line than before"
+    assert rv.headers["ETag"] != etag
+
+
+def test_get_longest_lines_response_cache(client, monkeypatch):
+    """Test that repeated requests are served from the response cache until the next upload."""
+    from api.models import longest_model
+
+    monkeypatch.setattr("api.views.longest_views._responses", ByteLRU(1 << 20))
+    setup_file(client, "a.txt", b"x\nyyy\nzz\n")
+    calls = []
+    compute = longest_model.iter_longest_lines
+    monkeypatch.setattr("api.views.longest_views.iter_longest_lines", lambda **kw: calls.append(kw) or compute(**kw))
+
+    for _ in range(3):
+        rv = client.get("/lines/longest?limit=2", headers={"Accept": "application/xml"})
+        assert ET.fromstring(rv.data).find("line_item/line").text == "yyy"
+    assert len(calls) == 1
+    client.get("/lines/longest?limit=2", headers={"Accept": "application/json"})
+    assert len(calls) == 2
+
+    setup_file(client, "b.txt", b"wwwww\n")
+    rv = client.get("/lines/longest?limit=2", headers={"Accept": "application/json"})
+    assert [item["line"] for item in rv.get_json()] == ["wwwww", "yyy"]
+    assert len(calls) == 3
+
+
+def test_get_longest_lines_streamed(client, monkeypatch):
+    """Test that bodies are streamed in chunks and match the buffered serializers."""
+    from flask import jsonify
+    from api.models.longest_model import get_longest_lines
+    from api.utils.response import to_xml
+
+    monkeypatch.setattr("api.utils.response.STREAM_CHUNK_CHARS", 256)
+    lines = [f"<{i}> & \"quoted\" 'line' {'x' * (i % 50)}" for i in range(200)]
+    setup_file(client, "a.txt", "\n".join(lines).encode())
+    expected = get_longest_lines(limit=150)
+
+    rv = client.get("/lines/longest?limit=150", headers={"Accept": "application/xml"}, buffered=False)
+    assert rv.is_streamed
+    chunks = list(rv.response)
+    assert len(chunks) > 1
+    assert b"".join(chunks).decode() == to_xml(expected, root="longest_lines", item_name="line_item")
+    rv.close()
+
+    rv = client.get("/lines/longest?limit=150", headers={"Accept": "application/json"})
+    with app.app_context():
+        assert rv.data == jsonify(expected).data
+    rv = client.get("/lines/longest?limit=150", headers={"Accept": "text/plain"})
+    assert rv.data.decode() == "\n".join(item["line"] for item in expected)
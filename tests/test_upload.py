@@ -1,7 +1,14 @@
+import errno
+import gzip
 import io
+import os
+import subprocess
+import sys
+import time
 import pytest
 from app import app
-from api.utils.db import init_db
+from api.models.job_model import resume_jobs
+from api.utils.db import get_conn, init_db
 from api.utils.storage import Storage
 
 
@@ -25,6 +32,12 @@ def client(tmp_path, monkeypatch):
         yield test_client
 
 
+def _key(filename, column="object_key"):
+    """Storage key of an uploaded file's object (or of the sidecar in `column`)."""
+    with get_conn() as conn:
+        return conn.execute(f"SELECT {column} FROM files WHERE filename = ?", (filename,)).fetchone()[0]
+
+
 def test_upload_ok(client):
     data = {"file": (io.BytesIO(b"hello\nworld\n"), "ok.txt")}
     rv = client.post("/files", data=data, content_type="multipart/form-data")
@@ -85,4 +98,507 @@ def test_reupload_replaces_metadata(client, monkeypatch):
     rv = client.post("/files", data={"file": (io.BytesIO(b"version2"), "overwrite.txt")})
     assert rv.status_code == 200
     body = rv.get_json()
-    assert body["size_bytes"] == 8
\ No newline at end of file
+    assert body["size_bytes"] == 8
+
+def test_upload_dense_index_mode(client, tmp_path):
+    """Tests that a dense upload stores a 5-byte offset per line plus an end entry."""
+    data = {"file": (io.BytesIO(b"one\ntwo\nthree"), "dense.txt"), "index_mode": "dense"}
+    rv = client.post("/files", data=data, content_type="multipart/form-data")
+    assert rv.status_code == 200
+    body = rv.get_json()
+    assert body["index_mode"] == "dense"
+    assert body["lines_per_chunk"] == 1
+    idx = (tmp_path / "uploads" / _key("dense.txt", "idx_key")).read_bytes()
+    assert [int.from_bytes(idx[i:i + 5], "little") for i in range(0, len(idx), 5)] == [0, 4, 8, 13]
+
+
+def test_upload_invalid_index_mode(client):
+    data = {"file": (io.BytesIO(b"a\n"), "bad.txt"), "index_mode": "sparse"}
+    rv = client.post("/files", data=data, content_type="multipart/form-data")
+    assert rv.status_code == 400
+
+
+def test_upload_is_moved_from_staging(client, tmp_path):
+    """Tests that the upload is written once into the storage root and renamed into place."""
+    rv = client.post("/files", data={"file": (io.BytesIO(b"a\nb\n"), "staged.txt")})
+    assert rv.status_code == 200
+    assert (tmp_path / "uploads" / _key("staged.txt")).read_bytes() == b"a\nb\n"
+    assert list((tmp_path / "uploads" / ".staging").iterdir()) == []
+
+
+def test_commit_staged_across_filesystems(tmp_path, monkeypatch):
+    """Tests that a staged file is copied into place when it cannot be renamed."""
+    storage = Storage(base_dir=str(tmp_path / "uploads"))
+    staged = storage.new_staging_file()
+    with open(staged, "wb") as f:
+        f.write(b"x" * 100_000)
+
+    real_replace = os.replace
+
+    def replace(src, dst):
+        if src == staged:
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        real_replace(src, dst)
+
+    monkeypatch.setattr("os.replace", replace)
+    storage.commit_staged(staged, "moved.txt")
+    assert (tmp_path / "uploads" / "moved.txt").read_bytes() == b"x" * 100_000
+    assert not os.path.exists(staged)
+
+
+def _wait_for_job(client, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/files/jobs/{job_id}").get_json()
+        if job["status"] in ("done", "failed") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
+
+
+def test_async_upload_returns_job(client):
+    """Tests that an async upload is accepted with 202 and indexed in the background."""
+    data = {"file": (io.BytesIO(b"one\ntwo\nthree\n"), "bg.txt"), "async": "true"}
+    rv = client.post("/files", data=data, content_type="multipart/form-data")
+    assert rv.status_code == 202
+    job_id = rv.get_json()["job_id"]
+    assert rv.headers["Location"] == f"/files/jobs/{job_id}"
+
+    job = _wait_for_job(client, job_id)
+    assert job["status"] == "done"
+    assert job["bytes_indexed"] == job["bytes_total"] == 14
+    assert job["lines_indexed"] == 3
+    assert job["result"]["num_lines"] == 3
+    rv = client.get("/lines/random?file_name=bg.txt", headers={"Accept": "text/plain"})
+    assert rv.data.decode() in ("one", "two", "three")
+
+
+def test_async_upload_invalid_index_mode(client):
+    data = {"file": (io.BytesIO(b"a\n"), "bad.txt"), "async": "1", "index_mode": "sparse"}
+    rv = client.post("/files", data=data, content_type="multipart/form-data")
+    assert rv.status_code == 400
+
+
+def test_upload_job_not_found(client):
+    rv = client.get("/files/jobs/nope")
+    assert rv.status_code == 404
+
+
+def test_resume_orphaned_job(client, tmp_path):
+    """Tests that a job left unfinished by a dead process is picked up again on startup."""
+    storage = Storage(base_dir=str(tmp_path / "uploads"))
+    spool = storage.new_staging_file(suffix=".spool")
+    with open(spool, "wb") as f:
+        f.write(b"x\ny\n")
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    with get_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO jobs(id, filename, index_mode, spool_path, status, bytes_total, bytes_indexed,
+                             owner_pid, created_at, updated_at)
+            VALUES ('orphan', 'orphan.txt', 'chunk', ?, 'running', 4, 2, ?, '', '')
+            """,
+            (spool, dead.pid),
+        )
+
+    assert resume_jobs() == 1
+    assert resume_jobs() == 0
+    job = _wait_for_job(client, "orphan")
+    assert job["status"] == "done"
+    assert job["result"]["num_lines"] == 2
+
+
+def test_resume_orphaned_job_with_same_pid(client, tmp_path):
+    """Tests that a job left by an earlier process that had this process's pid is resumed too."""
+    storage = Storage(base_dir=str(tmp_path / "uploads"))
+    spool = storage.new_staging_file(suffix=".spool")
+    with open(spool, "wb") as f:
+        f.write(b"x\ny\n")
+    with get_conn() as conn:
+        conn.execute(
+            """
+            INSERT INTO jobs(id, filename, index_mode, spool_path, status, bytes_total, bytes_indexed,
+                             owner_pid, owner_token, created_at, updated_at)
+            VALUES ('restarted', 'restarted.txt', 'chunk', ?, 'running', 4, 2, ?, 'previous-boot', '', '')
+            """,
+            (spool, os.getpid()),
+        )
+
+    assert resume_jobs() == 1
+    assert resume_jobs() == 0  # now owned by this process
+    job = _wait_for_job(client, "restarted")
+    assert job["status"] == "done"
+    assert job["result"]["num_lines"] == 2
+
+
+def test_async_upload_survives_progress_errors(client, monkeypatch):
+    """Tests that a failing progress write is logged and skipped instead of failing the ingest."""
+    import sqlite3
+    from api.models import job_model
+
+    monkeypatch.setattr("api.models.job_model.PROGRESS_INTERVAL", 0)
+    monkeypatch.setattr("config.settings.INDEX_READ_BYTES", 16)
+    update = job_model._update
+    failed = []
+
+    def flaky_update(job_id, **fields):
+        if "status" not in fields:
+            failed.append(fields)
+            raise sqlite3.OperationalError("database is locked")
+        update(job_id, **fields)
+
+    monkeypatch.setattr("api.models.job_model._update", flaky_update)
+    content = b"".join(b"line %d\n" % i for i in range(50))
+    data = {"file": (io.BytesIO(content), "flaky.txt"), "async": "true"}
+    job_id = client.post("/files", data=data, content_type="multipart/form-data").get_json()["job_id"]
+    job = _wait_for_job(client, job_id)
+    assert failed
+    assert job["status"] == "done" and job["result"]["num_lines"] == 50
+
+
+@pytest.mark.parametrize("index_mode", ["chunk", "dense", "adaptive"])
+def test_multipart_upload_matches_single_upload(client, tmp_path, monkeypatch, index_mode):
+    """Tests that parts sent out of order are stitched into the same index as a single upload."""
+    monkeypatch.setattr("config.settings.INDEX_LINES_PER_CHUNK", 3)
+    monkeypatch.setattr("config.settings.INDEX_CHUNK_BYTES", 40)
+    monkeypatch.setattr("config.settings.LONGEST_LINES_TOP_N", 4)
+    content = "".join(f"{i}:" + "é" * (i * 7 % 13) + "\n" for i in range(40)).encode() + b"no newline"
+    client.post("/files", data={"file": (io.BytesIO(content), "single.txt"), "index_mode": index_mode})
+
+    rv = client.post("/files/multi.txt/uploads", data={"part_size": "37", "index_mode": index_mode})
+    assert rv.status_code == 201
+    upload_id = rv.get_json()["upload_id"]
+    parts = [content[i:i + 37] for i in range(0, len(content), 37)]
+    for n in reversed(range(len(parts))):
+        rv = client.put(f"/files/multi.txt/uploads/{upload_id}/parts/{n + 1}", data=parts[n])
+        assert rv.status_code == 200
+    assert len(client.get(f"/files/multi.txt/uploads/{upload_id}").get_json()["parts"]) == len(parts)
+
+    rv = client.post(f"/files/multi.txt/uploads/{upload_id}/complete")
+    assert rv.status_code == 200
+    body = rv.get_json()
+    assert (body["size_bytes"], body["num_lines"], body["index_mode"]) == (len(content), 41, index_mode)
+
+    uploads = tmp_path / "uploads"
+    assert (uploads / _key("multi.txt")).read_bytes() == content
+    for column in ("idx_key", "longest_key"):
+        assert (uploads / _key("multi.txt", column)).read_bytes() == (uploads / _key("single.txt", column)).read_bytes()
+    assert list((uploads / ".staging").iterdir()) == []
+    assert client.get(f"/files/multi.txt/uploads/{upload_id}").status_code == 404
+
+
+def test_multipart_upload_resend_part(client, tmp_path):
+    """Tests that a re-sent part replaces the earlier one, including a shorter last part."""
+    upload_id = client.post("/files/re.txt/uploads", data={"part_size": "4"}).get_json()["upload_id"]
+    client.put(f"/files/re.txt/uploads/{upload_id}/parts/1", data=b"ab\nc")
+    client.put(f"/files/re.txt/uploads/{upload_id}/parts/2", data=b"dddd")
+    client.put(f"/files/re.txt/uploads/{upload_id}/parts/2", data=b"d\n")
+    body = client.post(f"/files/re.txt/uploads/{upload_id}/complete").get_json()
+    assert (body["size_bytes"], body["num_lines"]) == (6, 2)
+    assert (tmp_path / "uploads" / _key("re.txt")).read_bytes() == b"ab\ncd\n"
+
+
+def test_multipart_upload_failed_resend(client, tmp_path):
+    """Tests that a rejected re-send leaves its part missing instead of indexed from overwritten bytes."""
+    upload_id = client.post("/files/fr.txt/uploads", data={"part_size": "8"}).get_json()["upload_id"]
+    client.put(f"/files/fr.txt/uploads/{upload_id}/parts/1", data=b"abc\ndefg")
+    client.put(f"/files/fr.txt/uploads/{upload_id}/parts/2", data=b"\nhi\n")
+    assert client.put(f"/files/fr.txt/uploads/{upload_id}/parts/1", data=b"X" * 10).status_code == 400
+    rv = client.post(f"/files/fr.txt/uploads/{upload_id}/complete")
+    assert rv.status_code == 400
+    assert "Missing part(s): 1" in rv.get_json()["detail"]
+
+    client.put(f"/files/fr.txt/uploads/{upload_id}/parts/1", data=b"abc\ndefg")
+    body = client.post(f"/files/fr.txt/uploads/{upload_id}/complete").get_json()
+    assert (body["size_bytes"], body["num_lines"]) == (12, 3)
+    assert (tmp_path / "uploads" / _key("fr.txt")).read_bytes() == b"abc\ndefg\nhi\n"
+
+
+def test_multipart_upload_complete_is_claimed(client):
+    """Tests that a claimed upload rejects a second complete and new parts, and failing releases it."""
+    upload_id = client.post("/files/cl.txt/uploads", data={"part_size": "4"}).get_json()["upload_id"]
+    client.put(f"/files/cl.txt/uploads/{upload_id}/parts/2", data=b"b\n")
+    assert client.post(f"/files/cl.txt/uploads/{upload_id}/complete").status_code == 400  # part 1 missing
+    client.put(f"/files/cl.txt/uploads/{upload_id}/parts/1", data=b"aaa\n")
+
+    with get_conn() as conn:
+        conn.execute("UPDATE multipart_uploads SET status = 'completing' WHERE id = ?", (upload_id,))
+    rv = client.post(f"/files/cl.txt/uploads/{upload_id}/complete")
+    assert rv.status_code == 400
+    assert "already being completed" in rv.get_json()["detail"]
+    assert client.put(f"/files/cl.txt/uploads/{upload_id}/parts/2", data=b"c\n").status_code == 400
+
+    with get_conn() as conn:
+        conn.execute("UPDATE multipart_uploads SET status = 'open' WHERE id = ?", (upload_id,))
+    assert client.post(f"/files/cl.txt/uploads/{upload_id}/complete").status_code == 200
+
+
+def test_multipart_upload_errors(client):
+    assert client.post("/files/bad.log/uploads").status_code == 400
+    assert client.post("/files/e.txt/uploads", data={"part_size": "x"}).status_code == 400
+    assert client.put("/files/e.txt/uploads/nope/parts/1", data=b"a").status_code == 404
+
+    upload_id = client.post("/files/e.txt/uploads", data={"part_size": "4"}).get_json()["upload_id"]
+    assert client.put(f"/files/e.txt/uploads/{upload_id}/parts/1", data=b"12345").status_code == 400
+    assert client.put(f"/files/e.txt/uploads/{upload_id}/parts/0", data=b"1").status_code == 400
+    assert client.post(f"/files/e.txt/uploads/{upload_id}/complete").status_code == 400  # no parts
+    client.put(f"/files/e.txt/uploads/{upload_id}/parts/2", data=b"12")
+    rv = client.post(f"/files/e.txt/uploads/{upload_id}/complete")
+    assert rv.status_code == 400
+    assert "Missing part(s): 1" in rv.get_json()["detail"]
+    client.put(f"/files/e.txt/uploads/{upload_id}/parts/1", data=b"12")
+    assert client.post(f"/files/e.txt/uploads/{upload_id}/complete").status_code == 400  # short part 1
+    assert client.delete(f"/files/e.txt/uploads/{upload_id}").status_code == 204
+    assert client.delete(f"/files/e.txt/uploads/{upload_id}").status_code == 404
+
+
+def test_upload_compressed(client, tmp_path):
+    """Tests that a gzip upload is stored as one gzip member per chunk with frame offsets in the index."""
+    content = b"".join(b"line %d repeated text\n" % i for i in range(3000))
+    data = {"file": (io.BytesIO(content), "z.txt"), "compression": "gzip"}
+    rv = client.post("/files", data=data, content_type="multipart/form-data")
+    assert rv.status_code == 200
+    body = rv.get_json()
+    assert (body["compression"], body["size_bytes"], body["num_lines"]) == ("gzip", len(content), 3000)
+    stored = (tmp_path / "uploads" / _key("z.txt")).read_bytes()
+    assert gzip.decompress(stored) == content
+    assert len(stored) < len(content) // 4
+    idx = (tmp_path / "uploads" / _key("z.txt", "idx_key")).read_bytes()
+    frames = [int.from_bytes(idx[i:i + 8], "little") for i in range(0, len(idx), 8)]
+    assert frames[0] == 0 and frames[-1] == len(stored)
+    assert len(frames) == 3000 // 1000 + 2  # one frame per chunk, including the empty one after the last newline
+
+
+def test_upload_compressed_invalid(client):
+    data = {"file": (io.BytesIO(b"a\n"), "bad.txt"), "compression": "lz4"}
+    assert client.post("/files", data=data, content_type="multipart/form-data").status_code == 400
+    data = {"file": (io.BytesIO(b"a\n"), "bad.txt"), "compression": "gzip", "index_mode": "dense"}
+    assert client.post("/files", data=data, content_type="multipart/form-data").status_code == 400
+
+
+def test_async_upload_compressed(client, tmp_path):
+    data = {"file": (io.BytesIO(b"one\ntwo\n"), "bgz.txt"), "async": "true", "compression": "gzip"}
+    job_id = client.post("/files", data=data, content_type="multipart/form-data").get_json()["job_id"]
+    job = _wait_for_job(client, job_id)
+    assert job["status"] == "done" and job["compression"] == "gzip"
+    assert gzip.decompress((tmp_path / "uploads" / _key("bgz.txt")).read_bytes()) == b"one\ntwo\n"
+    assert list((tmp_path / "uploads" / ".staging").iterdir()) == []
+
+
+def _objects(tmp_path):
+    with get_conn() as conn:
+        refs = {r["object_key"]: r["refcount"] for r in conn.execute("SELECT * FROM objects")}
+        keys = {r["filename"]: r["object_key"] for r in conn.execute("SELECT * FROM files")}
+    return refs, keys
+
+
+def test_upload_duplicate_content_is_stored_once(client, tmp_path):
+    """Tests that identical content under another name shares one stored object and index."""
+    content = b"same\ncontent\n"
+    client.post("/files", data={"file": (io.BytesIO(content), "a.txt")})
+    rv = client.post("/files", data={"file": (io.BytesIO(content), "b.txt")})
+    assert rv.status_code == 200 and rv.get_json()["deduplicated"] is True
+    refs, keys = _objects(tmp_path)
+    assert keys["a.txt"].startswith("a.txt.") and keys["b.txt"] == keys["a.txt"] and refs == {keys["a.txt"]: 2}
+    assert sorted(p.name for p in (tmp_path / "uploads").iterdir() if p.is_file()) == [keys["a.txt"]]
+    assert list((tmp_path / "uploads" / ".staging").iterdir()) == []
+    assert client.get("/lines/random?file_name=b.txt", headers={"Accept": "text/plain"}).status_code == 200
+
+    # Same content under the same name again does not add a reference.
+    client.post("/files", data={"file": (io.BytesIO(content), "b.txt")})
+    assert _objects(tmp_path)[0] == {keys["a.txt"]: 2}
+
+
+def test_reupload_of_shared_object(client, tmp_path):
+    """
+    Tests that replacing a shared file keeps the other file's content, and that unreferenced
+    objects are deleted by a later upload once their grace period has passed.
+    """
+    client.post("/files", data={"file": (io.BytesIO(b"v1\n"), "a.txt")})
+    client.post("/files", data={"file": (io.BytesIO(b"v1\n"), "b.txt")})
+    original = _objects(tmp_path)[1]["a.txt"]
+    rv = client.post("/files", data={"file": (io.BytesIO(b"v2\n"), "a.txt")})
+    assert rv.get_json()["deduplicated"] is False
+    refs, keys = _objects(tmp_path)
+    assert keys["b.txt"] == original and keys["a.txt"] != original
+    assert (tmp_path / "uploads" / original).read_bytes() == b"v1\n"
+    assert (tmp_path / "uploads" / keys["a.txt"]).read_bytes() == b"v2\n"
+
+    # b.txt was the last reference to the original object, which stays readable for now.
+    client.post("/files", data={"file": (io.BytesIO(b"v3\n"), "b.txt")})
+    refs, keys = _objects(tmp_path)
+    assert original not in refs and refs == {keys["a.txt"]: 1, keys["b.txt"]: 1}
+    assert (tmp_path / "uploads" / original).read_bytes() == b"v1\n"
+    client.post("/files", data={"file": (io.BytesIO(b"v4\n"), "c.txt")})
+    assert (tmp_path / "uploads" / original).exists()
+
+    with get_conn() as conn:
+        conn.execute("UPDATE object_deletions SET delete_after = 0")  # the grace period is over
+    client.post("/files", data={"file": (io.BytesIO(b"v5\n"), "c.txt")})
+    assert not (tmp_path / "uploads" / original).exists()
+    assert not (tmp_path / "uploads" / "indexes" / f"{original}.idx").exists()
+    assert not (tmp_path / "uploads" / "indexes" / f"{original}.longest").exists()
+    assert not (tmp_path / "uploads" / "indexes" / f"{original}.len").exists()
+
+
+@pytest.fixture
+def s3_client(tmp_path, monkeypatch):
+    """Like `client`, but with the S3 backend running against a LocalS3Client with 64 KB parts."""
+    from api.utils.s3_local import LocalS3Client
+    from api.utils.storage import S3Storage
+
+    monkeypatch.setattr("api.utils.db.DB_PATH", str(tmp_path / "test.db"))
+    init_db()
+    fake = LocalS3Client(str(tmp_path / "s3"))
+    monkeypatch.setattr(
+        "api.utils.storage.Storage.from_env",
+        lambda: S3Storage(fake, "bucket", base_dir=str(tmp_path / "uploads"), part_bytes=64 * 1024, upload_workers=3),
+    )
+    app.config["TESTING"] = True
+    with app.test_client() as test_client:
+        yield test_client, fake
+
+
+def test_s3_local_backend_with_default_config(tmp_path, monkeypatch):
+    """Tests `backend = s3-local` with the shipped (empty) `s3_bucket`, and that `s3` requires one."""
+    from config import settings
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("api.utils.db.DB_PATH", str(tmp_path / "test.db"))
+    monkeypatch.setattr("api.utils.storage._s3_client", None)
+    monkeypatch.setattr(settings, "STORAGE_BACKEND", "s3-local")
+    monkeypatch.setattr(settings, "S3_LOCAL_ROOT", str(tmp_path / "s3-local"))
+    assert settings.S3_BUCKET == ""
+    init_db()
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        rv = client.post("/files", data={"file": (io.BytesIO(b"a\nbb\n"), "s.txt")})
+        assert rv.status_code == 200 and rv.get_json()["storage"] == "s3"
+        assert (tmp_path / "s3-local" / _key("s.txt")).read_bytes() == b"a\nbb\n"
+        monkeypatch.setattr("api.models.line_model.random.randint", lambda lo, hi: 1 if hi else 0)
+        assert client.get("/lines/random?file_name=s.txt", headers={"Accept": "text/plain"}).data == b"bb"
+
+    monkeypatch.setattr(settings, "STORAGE_BACKEND", "s3")
+    with pytest.raises(RuntimeError, match="s3_bucket"):
+        Storage.from_env()
+
+
+def test_s3_backend_end_to_end(s3_client, tmp_path, monkeypatch):
+    client, fake = s3_client
+    lines = [f"line {i}:" + "x" * (i % 97) for i in range(5000)]
+    content = ("\n".join(lines) + "\n").encode()
+    assert len(content) > 3 * 64 * 1024
+    rv = client.post("/files", data={"file": (io.BytesIO(content), "big.txt")})
+    assert rv.status_code == 200
+    assert rv.get_json()["storage"] == "s3"
+
+    # Sent as a multipart upload, stored whole, and nothing left in the local staging area.
+    assert fake.calls["complete_multipart_upload"] == 1
+    assert fake.calls["upload_part"] == -(-len(content) // (64 * 1024))
+    assert (tmp_path / "s3" / "bucket" / _key("big.txt")).read_bytes() == content
+    assert os.listdir(tmp_path / "uploads" / ".staging") == []
+
+    # A random line is at most one ranged GET (of its chunk's blocks), also for the last
+    # (partial) chunk; asking again is served from the block cache.
+    for n in (1, 1001, 4999, 5000):
+        monkeypatch.setattr("api.models.line_model.random.randint", lambda lo, hi: n - 1)
+        gets = []
+        for _ in range(2):
+            before = fake.ranged_gets
+            rv = client.get("/lines/random?file_name=big.txt", headers={"Accept": "application/json"})
+            assert rv.get_json()["line"] == lines[n - 1]
+            gets.append(fake.ranged_gets - before)
+        assert gets[0] <= 1 and gets[1] == 0
+
+    # Winners are read back with bounded ranges, with and without the block cache.
+    from api.utils import reader
+    from api.utils.cache import ByteLRU
+
+    ranges = []
+    get_object = fake.get_object
+    monkeypatch.setattr(fake, "get_object", lambda **kw: ranges.append(kw.get("Range")) or get_object(**kw))
+    longest = sorted(lines, key=len, reverse=True)
+    for block_cache in (ByteLRU(0), ByteLRU(1 << 20)):
+        monkeypatch.setattr(reader, "_block_cache", block_cache)
+        rv = client.get("/lines/longest?file_name=big.txt&limit=3", headers={"Accept": "application/json"})
+        assert [item["line"] for item in rv.get_json()] == longest[:3]
+    assert ranges and all(r is None or not r.endswith("-") for r in ranges)
+
+    stats = client.get("/files/big.txt/stats").get_json()
+    assert stats["num_lines"] == 5000 and stats["max"] == len(longest[0])
+
+
+def test_s3_backend_dense_and_replace(s3_client, tmp_path, monkeypatch):
+    client, fake = s3_client
+    monkeypatch.setattr("config.settings.ORPHAN_GRACE_S", 0)
+    client.post("/files", data={"file": (io.BytesIO(b"a\nbb\nccc\n"), "d.txt"), "index_mode": "dense"})
+    monkeypatch.setattr("api.models.line_model.random.randint", lambda lo, hi: 1 if hi else 0)
+    rv = client.get("/lines/random?file_name=d.txt", headers={"Accept": "text/plain"})
+    assert rv.data == b"bb"
+
+    # Re-uploading in chunk mode stores a new object and index and deletes the old ones.
+    old_keys = [_key("d.txt", column) for column in ("object_key", "idx_key", "longest_key")]
+    client.post("/files", data={"file": (io.BytesIO(b"other\n"), "d.txt")})
+    assert (tmp_path / "s3" / "bucket" / _key("d.txt")).read_bytes() == b"other\n"
+    assert not any((tmp_path / "s3" / "bucket" / key).exists() for key in old_keys)
+    rv = client.get("/lines/random?file_name=d.txt", headers={"Accept": "text/plain"})
+    assert rv.data == b"other"
+
+
+def test_s3_slow_upload_does_not_block_other_writes(s3_client, monkeypatch):
+    """Tests that an upload still being transferred to S3 holds no database lock other writers wait for."""
+    import threading
+
+    client, fake = s3_client
+    monkeypatch.setattr("config.settings.DB_BUSY_TIMEOUT_MS", 200)
+    transferring, release = threading.Event(), threading.Event()
+    complete = fake.complete_multipart_upload
+
+    def slow_complete(**kwargs):
+        transferring.set()
+        release.wait(10)
+        return complete(**kwargs)
+
+    fake.complete_multipart_upload = slow_complete
+    big = b"".join(b"slow line %d\n" % i for i in range(20000))
+    results = {}
+
+    def upload_big():
+        with app.test_client() as other:
+            results["big"] = other.post("/files", data={"file": (io.BytesIO(big), "slow.txt")}).status_code
+
+    thread = threading.Thread(target=upload_big)
+    thread.start()
+    try:
+        assert transferring.wait(10)
+        rv = client.post("/files", data={"file": (io.BytesIO(b"tiny\n"), "tiny.txt")})
+        assert rv.status_code == 200
+        rv = client.get("/lines/random?file_name=tiny.txt", headers={"Accept": "text/plain"})
+        assert rv.data == b"tiny"
+    finally:
+        release.set()
+        thread.join(10)
+    assert results["big"] == 200
+    rv = client.get("/lines/longest?file_name=slow.txt&limit=1", headers={"Accept": "text/plain"})
+    assert rv.data == b"slow line 10000"
+
+
+def test_s3_multipart_upload_aborts_on_error(tmp_path):
+    from api.utils.s3_local import LocalS3Client
+    from api.utils.storage import S3Storage
+
+    fake = LocalS3Client(str(tmp_path / "s3"))
+    storage = S3Storage(fake, "bucket", base_dir=str(tmp_path / "uploads"), part_bytes=1024)
+    path = storage.new_staging_file()
+    with open(path, "wb") as f:
+        f.write(b"x" * 5000)
+
+    def fail(**kwargs):
+        raise OSError("connection reset")
+
+    fake.upload_part = fail
+    with pytest.raises(OSError):
+        storage.commit_staged(path, "uploads/x.txt")
+    assert fake.calls["abort_multipart_upload"] == 1
+    assert os.listdir(tmp_path / "s3" / ".multipart" / "bucket") == []
+    assert os.path.exists(path)  # the staged copy is kept for a retry